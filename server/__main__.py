@@ -1,16 +1,28 @@
 # __main__.py
+#
+# $ python -m server          # serve the feeds and ingest the firehose in one process
+# $ python -m server serve    # feed skeletons only: no firehose, spaCy or torch
+# $ python -m server ingest   # firehose consumer and TTL cleanup, metrics on --metrics-port
+#
+# The serve and ingest roles share the database, so serve-only replicas can
+# be added in front of one ingest process.
 import argparse
 import sys
 from server import config
-from server.app import app, start_data_stream_thread, start_database_ttl_cleanup_thread
-from waitress import serve
+
+ROLES = ('all', 'serve', 'ingest')
 
 def main():
     # Define parser and arguments
     parser = argparse.ArgumentParser(description="Start Bluesky Flask app with Waitress.")
+    parser.add_argument('role', nargs='?', choices=ROLES, default='all',
+                        help="serve feeds, ingest the firehose, or both (default: all)")
     parser.add_argument('--host', default=config.HOST, help=f"Hostname (default: {config.HOST})")
     parser.add_argument('--port', type=int, default=int(config.PORT), help=f"Port (default: {config.PORT})")
     parser.add_argument('--threads', type=int, default=int(config.THREADS), help=f"Thread count (default: {config.THREADS})")
+    parser.add_argument('--metrics-port', type=int, default=config.INGEST_METRICS_PORT,
+                        help=f"Port of the ingest role's /health/ and /metrics/ listener, 0 for none "
+                             f"(default: {config.INGEST_METRICS_PORT})")
 
     # Check if user asked for help *before* parsing
     if '--help' in sys.argv or '-h' in sys.argv:
@@ -20,13 +32,33 @@ def main():
     # Parse arguments normally
     args = parser.parse_args()
 
-    # Start the background database TTL cleanup thread process
-    print("➡️ Starting background database TTL cleanup thread")
-    start_database_ttl_cleanup_thread()
+    # Imported by role so that serving never loads the classifier or the firehose client
+    if args.role in ('all', 'ingest'):
+        from server import ingest
+        ingest.install_signal_handlers()
+
+        # Start the background database TTL cleanup thread process
+        print("➡️ Starting background database TTL cleanup thread")
+        ingest.start_database_ttl_cleanup_thread()
+
+        # Start the background data stream consumer thread process
+        print("➡️ Starting background data stream consumer thread")
+        data_stream_thread = ingest.start_data_stream_thread()
+
+        if args.role == 'ingest':
+            # No feed server in this process to publish the ingestion metrics
+            if args.metrics_port:
+                print(f"➡️ Serving /health/ and /metrics/ on {args.host}:{args.metrics_port}")
+                ingest.start_metrics_server(args.host, args.metrics_port)
+            data_stream_thread.join()
+            return
+
+    if args.role == 'serve':
+        # The ingest role owns the schema; replicas only check it is current
+        config.DB_MIGRATE = False
 
-    # Start the background data stream consumer thread process
-    print("➡️ Starting background data stream consumer thread")
-    start_data_stream_thread()
+    from server.app import app
+    from waitress import serve
 
     # Start Waitress server
     print(f"➡️ Starting waitress with host={args.host}, port={args.port} and {args.threads} threads")
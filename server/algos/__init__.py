@@ -1,5 +1,6 @@
 from . import feed
+from .definitions import feeds
 
 algos = {
-    feed.uri: feed.handler
+    definition.uri: feed.make_handler(definition.name, definition.collapse_threads) for definition in feeds
 }
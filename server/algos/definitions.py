@@ -0,0 +1,81 @@
+# server/algos/definitions.py
+#
+# The feeds this server computes. Every feed is scored from the same ingest
+# pass: posts are decoded, cleaned and embedded once, then scored against
+# each feed's lists with its own thresholds, temperature and ambiguous
+# policy, and stored in the Post table under the feed's name.
+#
+# FEED_URI is always the first feed. More can be listed in FEEDS_FILE:
+#
+#   [{"uri": "at://did:plc:.../app.bsky.feed.generator/politics",
+#     "lists_did": "did:plc:...", "show_threshold": 0.8, "ambiguous_policy": "HIDE",
+#     "collapse_threads": true}]
+import json
+from typing import List
+
+from server import config
+
+
+class FeedDefinition:
+    __slots__ = ('uri', 'name', 'lists_did', 'show_thresh', 'hide_thresh',
+                 'temperature', 'bias_weight', 'ambiguous_policy', 'collapse_threads')
+
+    def __init__(self, uri: str, lists_did: str = None,
+                 show_thresh: float = None, hide_thresh: float = None,
+                 temperature: float = None, bias_weight: float = None,
+                 ambiguous_policy: str = None, collapse_threads: bool = None):
+        self.uri = uri
+        self.name = uri.rstrip('/').rsplit('/', 1)[-1]
+        self.lists_did = lists_did or config.DEFAULT_DID
+        self.show_thresh = config.SHOW_THRESH if show_thresh is None else min(max(float(show_thresh), 0.0), 1.0)
+        self.hide_thresh = config.HIDE_THRESH if hide_thresh is None else min(max(float(hide_thresh), 0.0), 1.0)
+        # Clamped to the same safe minimum as SOFTMAX_TEMPERATURE
+        self.temperature = config.TEMPERATURE if temperature is None else max(float(temperature), 0.1)
+        self.bias_weight = config.BIAS_WEIGHT if bias_weight is None else float(bias_weight)
+        policy = ambiguous_policy or config.AMBIGUOUS_POST_POLICY
+        self.ambiguous_policy = policy if policy in ("SHOW", "HIDE") else "SHOW"
+        self.collapse_threads = config.THREAD_COLLAPSE if collapse_threads is None else bool(collapse_threads)
+
+    def shows(self, decision: str) -> bool:
+        """Whether a post scored decision goes into this feed."""
+        return decision == "SHOW" or (decision == "AMBIGUOUS" and self.ambiguous_policy == "SHOW")
+
+    def settings(self) -> dict:
+        """Keyword arguments for score_batch and score_post."""
+        return {"show_thresh": self.show_thresh, "hide_thresh": self.hide_thresh,
+                "temperature": self.temperature, "bias_weight": self.bias_weight}
+
+    def __repr__(self) -> str:
+        return f'FeedDefinition({self.uri!r})'
+
+
+def load_feeds(path: str = None) -> List[FeedDefinition]:
+    """FEED_URI with the global settings, followed by the feeds listed in the FEEDS_FILE JSON."""
+    path = config.FEEDS_FILE if path is None else path
+    definitions = [FeedDefinition(config.FEED_URI)]
+    if path:
+        with open(path, encoding='utf-8') as f:
+            entries = json.load(f)
+        for entry in entries:
+            if not isinstance(entry, dict) or not entry.get('uri'):
+                raise RuntimeError(f'Every feed in {path} needs a "uri"')
+            if entry['uri'] == config.FEED_URI:
+                continue
+            definitions.append(FeedDefinition(
+                entry['uri'],
+                lists_did=entry.get('lists_did'),
+                show_thresh=entry.get('show_threshold'),
+                hide_thresh=entry.get('hide_threshold'),
+                temperature=entry.get('temperature'),
+                bias_weight=entry.get('bias_weight'),
+                ambiguous_policy=entry.get('ambiguous_policy'),
+                collapse_threads=entry.get('collapse_threads'),
+            ))
+    names = [definition.name for definition in definitions]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise RuntimeError(f'Feed record names must be unique, found {", ".join(duplicates)} more than once')
+    return definitions
+
+
+feeds = load_feeds()
@@ -11,8 +11,36 @@ CURSOR_EOF = 'eof'
 def generate_fake_jwt(user_did: str, aud_did: str) -> str:
     return f"dev:{user_did}"  # Unsafe, for testing only
 
-def handler(cursor: Optional[str], limit: int) -> dict:
-    posts = Post.select().order_by(Post.cid.desc()).order_by(Post.indexed_at.desc()).limit(limit)
+def make_handler(feed_name: str, collapse_threads: bool = False):
+    """
+    A getFeedSkeleton handler serving the posts stored under feed_name. With
+    collapse_threads, a thread appears once: as its root when the root is in
+    the feed, otherwise as its newest reply.
+    """
+    def feed_handler(cursor: Optional[str], limit: int) -> dict:
+        return _skeleton(feed_name, cursor, limit, collapse_threads)
+    return feed_handler
+
+def _collapse(feed_name: str, posts: list) -> list:
+    """Drop the replies whose thread is already represented by another post in the feed."""
+    roots = {post.reply_root for post in posts if post.reply_root}
+    if not roots:
+        return posts
+    # Both lookups are served by indexes: (feed, uri) and post_reply_root
+    in_feed = {row.uri for row in Post.select(Post.uri).where((Post.feed == feed_name) & Post.uri.in_(roots))}
+    newest = {}
+    for row in (Post.select(Post.reply_root, Post.uri)
+                .where((Post.feed == feed_name) & Post.reply_root.in_(roots - in_feed))
+                .order_by(Post.indexed_at.desc(), Post.cid.desc())):
+        newest.setdefault(row.reply_root, row.uri)
+    return [post for post in posts
+            if not post.reply_root or (post.reply_root not in in_feed and newest.get(post.reply_root) == post.uri)]
+
+def _skeleton(feed_name: str, cursor: Optional[str], limit: int, collapse_threads: bool = False) -> dict:
+    posts = (Post.select()
+             .where(Post.feed == feed_name)
+             .order_by(Post.cid.desc()).order_by(Post.indexed_at.desc())
+             .limit(limit))
 
     if cursor:
         if cursor == CURSOR_EOF:
@@ -28,10 +56,14 @@ def handler(cursor: Optional[str], limit: int) -> dict:
         indexed_at = datetime.fromtimestamp(int(indexed_at) / 1000)
         posts = posts.where(((Post.indexed_at == indexed_at) & (Post.cid < cid)) | (Post.indexed_at < indexed_at))
 
+    posts = list(posts)
+    # The cursor follows the last row read, so collapsed replies never shift the pages
+    last_post = posts[-1] if posts else None
+    if collapse_threads:
+        posts = _collapse(feed_name, posts)
     feed = [{'post': post.uri} for post in posts]
 
     cursor = CURSOR_EOF
-    last_post = posts[-1] if posts else None
     if last_post:
         cursor = f'{int(last_post.indexed_at.timestamp() * 1000)}::{last_post.cid}'
 
@@ -39,3 +71,5 @@ def handler(cursor: Optional[str], limit: int) -> dict:
         'cursor': cursor,
         'feed': feed
     }
+
+handler = make_handler(config.FEED_NAME, config.THREAD_COLLAPSE)
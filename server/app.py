@@ -1,16 +1,16 @@
 # app.py 
-import sys
-import signal
-import threading
-
+#
+# The feed-serving Flask app. It only needs Flask, peewee and atproto's auth
+# helpers: the firehose consumer and the classifier (spaCy, torch) live in
+# server.ingest and are never imported here, so a serve-only replica starts
+# quickly and stays small.
 from server import config
-from server import data_stream
+from server import metrics
 
 from flask import Flask, jsonify, request
 from server.algos import algos
 from server.algos.feed import handler, generate_fake_jwt
-from server.data_filter import operations_callback
-from server.database import cleanup_expired_posts
+from server.database import db
 from server.logger import setup_logger
 
 app = Flask(__name__)
@@ -22,44 +22,18 @@ app = Flask(__name__)
 logger = setup_logger(__name__)  # 👈 This tags the logger with the module path
 
 # ───────────────────────────────────────────────────────
-# Start a database TTL cleanup thread
+# Hand database connections back after each request so pooled
+# backends (PostgreSQL) can share them across waitress threads
 # ───────────────────────────────────────────────────────
 
-database_ttl_cleanup_stop_event = threading.Event()
+@app.before_request
+def open_db_connection():
+    db.connect(reuse_if_open=True)
 
-def start_database_ttl_cleanup_thread():
-    ttl_thread = threading.Thread(
-        target=cleanup_expired_posts,
-        args=(),
-        daemon=True  # so it won't block shutdown
-    )
-    ttl_thread.start()
-    return ttl_thread
-
-# ───────────────────────────────────────────────────────
-# Configure and start the data stream in a separate thread
-# ───────────────────────────────────────────────────────
-
-data_stream_stop_event = threading.Event()
-
-def start_data_stream_thread():
-    data_stream_thread = threading.Thread(
-        target=data_stream.run,
-        args=(config.SERVICE_DID, operations_callback, data_stream_stop_event),
-        daemon=True,
-    )
-    data_stream_thread.start()
-    return data_stream_thread
-
-def sigint_handler(*_):
-    print('Stopping background threads...')
-    database_ttl_cleanup_stop_event.set()
-    data_stream_stop_event.set()
-    sys.exit(0)
-
-signal.signal(signal.SIGINT, sigint_handler)
-signal.signal(signal.SIGTERM, sigint_handler)
-signal.signal(signal.SIGABRT, sigint_handler)
+@app.teardown_request
+def close_db_connection(exc):
+    if not db.is_closed():
+        db.close()
 
 # ───────────────────────────────────────────────────────
 # Define REST API and enter event loop
@@ -85,6 +59,10 @@ def health():
         'Status': 'OK'
     }), 200
 
+@app.route("/metrics/")
+def metrics_endpoint():
+    return jsonify(metrics.snapshot()), 200
+
 @app.route('/test-feed-handler/', methods=['GET'])
 def test_feed_handler():
     """
@@ -1,11 +1,68 @@
 # server/auth.py
-from atproto import DidInMemoryCache, IdResolver, verify_jwt
-from atproto.exceptions import TokenInvalidSignatureError
+# Imported from the atproto subpackages: the top-level package pulls in the
+# whole client and firehose stack, which a serve-only process does not need
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from atproto_identity.cache.in_memory_cache import DidInMemoryCache
+from atproto_identity.cache.models import CachedDid
+from atproto_identity.resolver import IdResolver
+from atproto_server.auth.jwt import verify_jwt
+from atproto_server.exceptions import TokenInvalidSignatureError
 from flask import Request
+from server import memory
 from server.config import FLASK_DEBUG
 
+# A resolved DID document with its keys and services, as parsed objects
+_DID_BYTES = 2048
+
+
+class _BudgetedDidCache(DidInMemoryCache):
+    """The in-memory DID cache, in least recently used order so the memory budget can shrink it."""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._cache = OrderedDict()
+        self.last_used = time.monotonic()
+        self._lock = threading.Lock()
+
+    def set(self, did, document) -> None:
+        with self._lock:
+            self.last_used = time.monotonic()
+            self._cache[did] = CachedDid(document, datetime.now(timezone.utc))
+            self._cache.move_to_end(did)
+
+    def delete(self, did) -> None:
+        with self._lock:
+            self._cache.pop(did, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+    def get(self, did):
+        with self._lock:
+            self.last_used = time.monotonic()
+            if did in self._cache:
+                self._cache.move_to_end(did)
+        return super().get(did)
+
+    def memory_bytes(self) -> int:
+        return len(self._cache) * _DID_BYTES
+
+    def shrink(self, nbytes: int) -> int:
+        with self._lock:
+            released = min(len(self._cache), -(-nbytes // _DID_BYTES))
+            for _ in range(released):
+                self._cache.popitem(last=False)
+            return released * _DID_BYTES
+
 
-_CACHE = DidInMemoryCache()
+_CACHE = _BudgetedDidCache()
+# Cheap to lose: an evicted requester's key is resolved again on their next request
+memory.budget.register('did_cache', _CACHE, cost=0.5)
 _ID_RESOLVER = IdResolver(cache=_CACHE)
 
 _AUTHORIZATION_HEADER_NAME = 'Authorization'
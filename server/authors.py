@@ -0,0 +1,242 @@
+# server/authors.py
+#
+# Per-author reputation. Many authors post about the same things every
+# time and get the same decision every time, so each author's decisions are
+# tallied with exponential decay, along with the mean white and black
+# probabilities their posts scored. Once an author's recent history is
+# confidently one-sided for every feed, their next posts take the cheap
+# path: a keyword check against each feed's lists on the raw text, and the
+# author's usual decision unless a keyword argues against it. No cleaning or
+# embedding is done for them.
+#
+# A share of those posts (AUTHOR_VERIFY_RATE) are scored in full anyway. A
+# verified post that disagrees with the author's usual decision resets the
+# author, who then has to build up a history again.
+#
+# At most AUTHOR_MAX_ENTRIES authors are tracked, least recently seen
+# evicted first; authors whose history has decayed away are dropped too.
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from server import config, memory, metrics
+from server.algos.definitions import FeedDefinition, feeds
+from server.vector import DECISIONS, keyword_hits
+
+_URL_RE = re.compile(r"https?://\S+|www\.\S+")
+_NON_WORD_RE = re.compile(r"[^\w\s]")
+_SHOW, _HIDE = DECISIONS.index("SHOW"), DECISIONS.index("HIDE")
+# An author whose decayed history weighs less than this is forgotten
+_MIN_WEIGHT = 0.05
+
+
+class _History:
+    __slots__ = ('counts', 'white', 'black', 'updated')
+
+    def __init__(self, n_feeds: int, now: float):
+        self.counts = np.zeros((n_feeds, len(DECISIONS)))  # decayed decisions per feed
+        self.white = np.zeros(n_feeds)  # decayed sums of prob_white and prob_black
+        self.black = np.zeros(n_feeds)
+        self.updated = now
+
+
+class AuthorReputation:
+    """Decayed decision tallies by author DID, least recently seen first."""
+
+    def __init__(self, half_life: float = None, max_entries: int = None, min_posts: float = None,
+                 confidence: float = None, verify_rate: float = None,
+                 definitions: List[FeedDefinition] = None, seed: int = None):
+        self.half_life = config.AUTHOR_HALF_LIFE if half_life is None else half_life
+        self.max_entries = config.AUTHOR_MAX_ENTRIES if max_entries is None else max_entries
+        self.min_posts = config.AUTHOR_MIN_POSTS if min_posts is None else min_posts
+        self.confidence = config.AUTHOR_CONFIDENCE if confidence is None else confidence
+        self.verify_rate = config.AUTHOR_VERIFY_RATE if verify_rate is None else verify_rate
+        self.feeds = feeds if definitions is None else definitions
+        self._authors: "OrderedDict[str, _History]" = OrderedDict()
+        self._scope = None
+        self._random = random.Random(seed)
+        self._counts = {"predicted": 0, "verified": 0, "mismatched": 0, "keyword_vetoes": 0}
+        # Per author: the DID, three small arrays and the ordered dict's node
+        self._entry_bytes = 600 + 40 * len(self.feeds)
+        self.last_used = time.monotonic()
+        self._lock = threading.Lock()
+
+    def bind(self, scope) -> None:
+        """Forget every author when what their decisions were made against (e.g. the feeds' lists) changes."""
+        with self._lock:
+            if scope != self._scope:
+                self._scope = scope
+                self._authors.clear()
+                metrics.set_gauge('authors.tracked', 0)
+
+    def predict(self, post, feed_lists: list) -> Optional[Tuple[tuple, bool]]:
+        """
+        (decisions, verify) for a post whose author is confidently one-sided
+        for every feed with lists, or None when it has to be scored. With
+        verify the post is to be scored anyway and passed to verify().
+        """
+        with self._lock:
+            self.last_used = time.monotonic()
+            history = self._authors.get(post.author)
+            if history is None:
+                return None
+            now = self.last_used
+            self._decay(history, now)
+            self._authors.move_to_end(post.author)
+            decisions = [None] * len(feed_lists)
+            for index, (definition, lists) in enumerate(zip(self.feeds, feed_lists)):
+                if lists is None:
+                    continue
+                decision = self._usual(history, index, definition)
+                if decision is None:
+                    return None
+                decisions[index] = decision
+            if all(decision is None for decision in decisions):
+                return None
+
+            if self._random.random() < self.verify_rate:
+                self._counts["verified"] += 1
+                metrics.increment('authors.verified')
+                return tuple(decisions), True
+
+        # A keyword that argues against the usual decision sends the post to the model
+        text = _NON_WORD_RE.sub(" ", _URL_RE.sub(" ", post.text or "")).lower()
+        for decision, lists in zip(decisions, feed_lists):
+            if lists is None:
+                continue
+            hits = keyword_hits(text, keyword_matcher=lists.matcher)
+            if hits["white" if decision == "HIDE" else "black"]:
+                with self._lock:
+                    self._counts["keyword_vetoes"] += 1
+                metrics.increment('authors.keyword_vetoes')
+                return None
+        with self._lock:
+            self._counts["predicted"] += 1
+        metrics.increment('authors.predicted')
+        return tuple(decisions), False
+
+    def observe(self, author: str, decisions: tuple, prob_white: list, prob_black: list) -> None:
+        """Add a post's model decisions (None for feeds that made none) to its author's history."""
+        with self._lock:
+            now = self.last_used = time.monotonic()
+            history = self._authors.get(author)
+            if history is None:
+                self._evict(now)
+                history = self._authors[author] = _History(len(self.feeds), now)
+            else:
+                self._decay(history, now)
+                self._authors.move_to_end(author)
+            for index, decision in enumerate(decisions[:len(self.feeds)]):
+                if decision is None:
+                    continue
+                history.counts[index, DECISIONS.index(decision)] += 1
+                history.white[index] += prob_white[index] or 0.0
+                history.black[index] += prob_black[index] or 0.0
+            metrics.set_gauge('authors.tracked', len(self._authors))
+
+    def verify(self, author: str, predicted: tuple, decisions: tuple, prob_white: list, prob_black: list) -> bool:
+        """Check a sampled prediction against the post's model decisions; a mismatch resets the author."""
+        agreed = all(p is None or p == d for p, d in zip(predicted, decisions))
+        if not agreed:
+            with self._lock:
+                self._counts["mismatched"] += 1
+                self._authors.pop(author, None)
+            metrics.increment('authors.mismatched')
+        self.observe(author, decisions, prob_white, prob_black)
+        return agreed
+
+    def summary(self, author: str) -> Optional[dict]:
+        """The author's decayed decision counts and mean probabilities per feed."""
+        with self._lock:
+            history = self._authors.get(author)
+            if history is None:
+                return None
+            self._decay(history, time.monotonic())
+            totals = history.counts.sum(axis=1)
+            return {
+                definition.name: {
+                    "posts": round(float(total), 2),
+                    **{decision.lower(): round(float(count), 2) for decision, count in zip(DECISIONS, counts)},
+                    "mean_white": round(float(white / total), 4) if total else None,
+                    "mean_black": round(float(black / total), 4) if total else None,
+                }
+                for definition, counts, total, white, black
+                in zip(self.feeds, history.counts, totals, history.white, history.black)
+            }
+
+    def stats(self) -> dict:
+        with self._lock:
+            checked = self._counts["predicted"] + self._counts["verified"] + self._counts["keyword_vetoes"]
+            return {
+                "tracked": len(self._authors),
+                **self._counts,
+                "skip_rate": round(self._counts["predicted"] / checked, 4) if checked else 0.0,
+            }
+
+    def memory_bytes(self) -> int:
+        return len(self._authors) * self._entry_bytes
+
+    def shrink(self, nbytes: int) -> int:
+        """Forget the least recently seen authors until about nbytes are freed (see server.memory)."""
+        with self._lock:
+            released = min(len(self._authors), -(-nbytes // self._entry_bytes))
+            for _ in range(released):
+                self._authors.popitem(last=False)
+            metrics.increment('authors.evicted', released)
+            metrics.set_gauge('authors.tracked', len(self._authors))
+            return released * self._entry_bytes
+
+    def __len__(self) -> int:
+        return len(self._authors)
+
+    def _usual(self, history: _History, index: int, definition: FeedDefinition) -> Optional[str]:
+        """The decision the author nearly always gets in the feed at index, if any."""
+        counts = history.counts[index]
+        total = counts.sum()
+        if total < self.min_posts:
+            return None
+        usual = int(np.argmax(counts))
+        if counts[usual] / total < self.confidence:
+            return None
+        # The mean probability must clear the threshold too, so borderline authors are always scored
+        if usual == _SHOW and history.white[index] / total >= definition.show_thresh:
+            return "SHOW"
+        if usual == _HIDE and history.black[index] / total >= definition.hide_thresh:
+            return "HIDE"
+        return None
+
+    def _decay(self, history: _History, now: float) -> None:
+        factor = 0.5 ** ((now - history.updated) / self.half_life)
+        history.counts *= factor
+        history.white *= factor
+        history.black *= factor
+        history.updated = now
+
+    def _evict(self, now: float) -> None:
+        # Room for one more author
+        while len(self._authors) >= self.max_entries:
+            self._authors.popitem(last=False)
+            metrics.increment('authors.evicted')
+        # The least recently seen authors have decayed the most
+        while self._authors:
+            author, history = next(iter(self._authors.items()))
+            weight = history.counts.sum() * 0.5 ** ((now - history.updated) / self.half_life)
+            if weight >= _MIN_WEIGHT:
+                break
+            del self._authors[author]
+            metrics.increment('authors.evicted')
+
+
+def stats() -> dict:
+    return index.stats() if index is not None else {}
+
+
+index = AuthorReputation() if config.AUTHOR_REPUTATION_ENABLED else None
+metrics.register_collector('authors', stats)
+if index is not None:
+    memory.budget.register('authors', index, cost=4.0)
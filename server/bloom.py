@@ -0,0 +1,97 @@
+# server/bloom.py
+#
+# Rotating Bloom filter: set membership with no false negatives for keys
+# added within the last window seconds, in a fixed amount of memory. Keys go
+# into the current generation; once it is window seconds old it becomes the
+# previous one and a fresh generation starts, and the generation before is
+# dropped. A key is reported for window to 2 * window seconds after it was
+# added.
+#
+# Each generation is sized for capacity keys at half the target false-
+# positive rate, since a lookup checks two generations. Indexes come from
+# double hashing one 128-bit BLAKE2b digest per key.
+import hashlib
+import math
+import threading
+import time
+from typing import Iterable, List
+
+import numpy as np
+
+
+class RotatingBloomFilter:
+
+    def __init__(self, window: float, capacity: int, fpr: float = 0.01):
+        self.window = window
+        self.capacity = max(int(capacity), 1)
+        target = min(max(fpr, 1e-9), 0.5) / 2
+        self.bits = max(int(math.ceil(-self.capacity * math.log(target) / math.log(2) ** 2)), 64)
+        self.hashes = max(int(round(self.bits / self.capacity * math.log(2))), 1)
+        self._generations = [self._empty(), self._empty()]  # current, previous
+        self._added = [0, 0]
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add_many(self, keys: Iterable[str]) -> None:
+        indexes = self._indexes(keys)
+        if not len(indexes):
+            return
+        with self._lock:
+            self._rotate(time.monotonic())
+            current = self._generations[0]
+            np.bitwise_or.at(current, indexes >> 3, (1 << (indexes & 7)).astype(np.uint8))
+            self._added[0] += len(indexes) // self.hashes
+
+    def might_contain(self, keys: List[str]) -> List[bool]:
+        """Per key, False when it was certainly not added within the window."""
+        indexes = self._indexes(keys)
+        if not len(indexes):
+            return []
+        with self._lock:
+            self._rotate(time.monotonic())
+            rows = indexes.reshape(len(keys), self.hashes)
+            masks = (1 << (rows & 7)).astype(np.uint8)
+            found = np.zeros(len(keys), dtype=bool)
+            for generation in self._generations:
+                found |= ((generation[rows >> 3] & masks) != 0).all(axis=1)
+            return found.tolist()
+
+    def estimated_fpr(self) -> float:
+        """False-positive rate of a lookup given how full both generations are."""
+        with self._lock:
+            passes = 1.0
+            for generation in self._generations:
+                fill = np.unpackbits(generation).mean() if len(generation) else 0.0
+                passes *= 1 - fill ** self.hashes
+            return 1 - passes
+
+    def stats(self) -> dict:
+        return {
+            "keys": sum(self._added),
+            "bits": self.bits,
+            "hashes": self.hashes,
+            "bytes": sum(generation.nbytes for generation in self._generations),
+            "estimated_fpr": round(self.estimated_fpr(), 6),
+        }
+
+    def _empty(self) -> np.ndarray:
+        return np.zeros((self.bits + 7) // 8, dtype=np.uint8)
+
+    def _indexes(self, keys: Iterable[str]) -> np.ndarray:
+        """(len(keys) * hashes,) bit indexes, key by key."""
+        digests = b"".join(hashlib.blake2b(key.encode(), digest_size=16).digest() for key in keys)
+        if not digests:
+            return np.zeros(0, dtype=np.uint64)
+        halves = np.frombuffer(digests, dtype=np.uint64).reshape(-1, 2)
+        steps = np.arange(self.hashes, dtype=np.uint64)
+        # Wraps modulo 2**64 before the reduction, which is fine for hashing
+        return ((halves[:, :1] + steps * (halves[:, 1:] | np.uint64(1))) % np.uint64(self.bits)).ravel()
+
+    def _rotate(self, now: float) -> None:
+        if now - self._started < self.window:
+            return
+        # After a gap of two windows or more the current generation has expired too
+        kept = now - self._started < 2 * self.window
+        self._generations = [self._empty(), self._generations[0] if kept else self._empty()]
+        self._added = [0, self._added[0] if kept else 0]
+        self._started = now
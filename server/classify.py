@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+#
+# classify.py
+#
+# Streaming batch classifier for offline corpora. Reads JSONL posts from a
+# file or stdin, cleans and embeds them in batches with a single loaded model,
+# scores them against a user's white- and blacklists and streams JSONL
+# decisions out. Memory stays bounded by --batch-size and the number of
+# batches in flight, so corpora of millions of posts can be piped through.
+#
+# $ python -m server.classify --input posts.jsonl --output decisions.jsonl
+# $ zcat posts.jsonl.gz | python -m server.classify --workers 4 --show-threshold 0.8 > decisions.jsonl
+# $ python -m server.classify --input posts.jsonl --shard 2/8 > part-2.jsonl
+#
+# Each input line is a JSON object with:
+#   text        post text (or taken from record.text)
+#   uri         optional identifier, copied to the output
+#   extra_text  optional alt text / link text, a string or list of strings
+#   record      optional Bluesky post record; its alt text and links are
+#               extracted when extra_text is absent (external embeds fetch
+#               the linked page)
+#   label       optional expected decision, copied to the output
+#
+import argparse
+import json
+import os
+import sys
+import time
+from collections import Counter, deque
+from multiprocessing import get_context
+from typing import Iterator, List, Optional, TextIO
+
+from server import config
+from server.user_lists import get_user_lists
+from server.text_utils import clean_texts, extract_extra_text
+from server.vector import DECISIONS, keyword_hits, score_batch, strings_to_vectors
+
+# Per-process classifier state, filled in by _init_worker
+_STATE = {}
+
+
+def _init_worker(options: dict) -> None:
+    lists = get_user_lists(options["did"])
+    if lists is None:
+        raise SystemExit(f"No white- and blacklists stored for {options['did']}")
+
+    _STATE.update(options)
+    _STATE["lists"] = lists
+
+    if options["torch_threads"]:
+        import torch
+        torch.set_num_threads(options["torch_threads"])
+
+
+def combine_post_text(post: dict) -> str:
+    """Post text plus its extra (alt, link) text, as the live pipeline combines them."""
+    record = post.get("record") or {}
+    text = post.get("text") or record.get("text") or ""
+    extra = post.get("extra_text")
+    if extra is None and record:
+        extra = extract_extra_text(record)
+    if isinstance(extra, list):
+        extra = " ".join(extra)
+    return f"{text} {extra}" if extra else text
+
+
+def classify_batch(lines: List[str]) -> List[dict]:
+    """Classify one batch of raw JSONL lines; runs in the worker process."""
+    posts, results = [], []
+    for line in lines:
+        try:
+            posts.append(json.loads(line))
+        except json.JSONDecodeError as e:
+            posts.append({"error": f"invalid JSON: {e}"})
+
+    valid = [i for i, post in enumerate(posts) if "error" not in post]
+    cleaned = clean_texts([combine_post_text(posts[i]) for i in valid], batch_size=_STATE["batch_size"])
+    vectors = strings_to_vectors(cleaned, batch_size=_STATE["batch_size"]) if cleaned else []
+    hits = [keyword_hits(text, keyword_matcher=_STATE["lists"].matcher) for text in cleaned]
+    batch = score_batch(
+        vectors,
+        _STATE["lists"].matrix,
+        [bool(hit["white"]) for hit in hits],
+        [bool(hit["black"]) for hit in hits],
+        show_thresh=_STATE["show_thresh"],
+        hide_thresh=_STATE["hide_thresh"],
+        temperature=_STATE["temperature"],
+        bias_weight=_STATE["bias_weight"],
+    ) if cleaned else None
+    scored = {}
+    for j, (i, hit) in enumerate(zip(valid, hits)):
+        scored[i] = {key: batch[key][j] for key in ("raw_white", "raw_black", "prob_white", "prob_black")}
+        scored[i].update(decision=DECISIONS[batch["decision"][j]], white_hits=hit["white"], black_hits=hit["black"])
+
+    for i, post in enumerate(posts):
+        result = {"uri": post.get("uri")}
+        if i not in scored:
+            result["error"] = post.get("error")
+        else:
+            scores = scored[i]
+            decision = scores["decision"]
+            result.update({
+                "decision": decision,
+                "final_decision": _STATE["policy"] if decision == "AMBIGUOUS" else decision,
+                "prob_white": round(float(scores["prob_white"]), 6),
+                "prob_black": round(float(scores["prob_black"]), 6),
+                "raw_white": round(float(scores["raw_white"]), 6),
+                "raw_black": round(float(scores["raw_black"]), 6),
+                "white_hits": scores.get("white_hits", []),
+                "black_hits": scores.get("black_hits", []),
+            })
+        if "label" in post:
+            result["label"] = post["label"]
+        results.append(result)
+    return results
+
+
+def _batches(stream: TextIO, batch_size: int, shard_index: int, shard_count: int) -> Iterator[List[str]]:
+    batch = []
+    for line_number, line in enumerate(stream):
+        if line_number % shard_count != shard_index or not line.strip():
+            continue
+        batch.append(line)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class _Progress:
+    """Periodic throughput report on stderr."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.started = self.last_report = time.time()
+        self.count = 0
+        self.decisions = Counter()
+
+    def update(self, results: List[dict]) -> None:
+        self.count += len(results)
+        self.decisions.update(r.get("decision", "ERROR") for r in results)
+        now = time.time()
+        if self.interval and now - self.last_report >= self.interval:
+            self.last_report = now
+            self.report()
+
+    def report(self, final: bool = False) -> None:
+        elapsed = max(time.time() - self.started, 1e-9)
+        label = "done" if final else "progress"
+        counts = ", ".join(f"{k}={v}" for k, v in sorted(self.decisions.items()))
+        print(f"[classify] {label}: {self.count} posts in {elapsed:.1f}s "
+              f"({self.count / elapsed:.1f} posts/s) {counts}", file=sys.stderr, flush=True)
+
+
+def run(stream: TextIO, output: TextIO, options: dict, workers: int = 1,
+        shard: tuple = (0, 1), progress_interval: float = 10.0) -> Counter:
+    progress = _Progress(progress_interval)
+
+    def emit(results: List[dict]) -> None:
+        for result in results:
+            output.write(json.dumps(result) + "\n")
+        progress.update(results)
+
+    batches = _batches(stream, options["batch_size"], *shard)
+    if workers <= 1:
+        _init_worker(options)
+        for batch in batches:
+            emit(classify_batch(batch))
+    else:
+        # Keep at most two batches per worker in flight so memory stays bounded
+        # and results are written in input order.
+        with get_context("fork").Pool(workers, initializer=_init_worker, initargs=(options,)) as pool:
+            pending = deque()
+            for batch in batches:
+                pending.append(pool.apply_async(classify_batch, (batch,)))
+                if len(pending) >= workers * 2:
+                    emit(pending.popleft().get())
+            while pending:
+                emit(pending.popleft().get())
+
+    output.flush()
+    progress.report(final=True)
+    return progress.decisions
+
+
+def _parse_shard(value: Optional[str]) -> tuple:
+    if not value:
+        return 0, 1
+    index, count = (int(part) for part in value.split("/"))
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError("shard must be K/N with 0 <= K < N")
+    return index, count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Classify a JSONL corpus of posts against a user's lists.")
+    parser.add_argument("-i", "--input", default="-", help="Input JSONL file (default: stdin)")
+    parser.add_argument("-o", "--output", default="-", help="Output JSONL file (default: stdout)")
+    parser.add_argument("--did", default=config.DEFAULT_DID, help=f"User whose lists are used (default: {config.DEFAULT_DID})")
+    parser.add_argument("--show-threshold", type=float, default=config.SHOW_THRESH)
+    parser.add_argument("--hide-threshold", type=float, default=config.HIDE_THRESH)
+    parser.add_argument("--temperature", type=float, default=config.TEMPERATURE)
+    parser.add_argument("--bias-weight", type=float, default=config.BIAS_WEIGHT)
+    parser.add_argument("--policy", choices=("SHOW", "HIDE"), default=config.AMBIGUOUS_POST_POLICY,
+                        help="Decision for AMBIGUOUS posts in final_decision")
+    parser.add_argument("--batch-size", type=int, default=64, help="Posts per clean/encode batch (default: 64)")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes, each with its own model (default: 1)")
+    parser.add_argument("--shard", type=_parse_shard, default=(0, 1), help="Only process lines where index %% N == K, as K/N")
+    parser.add_argument("--progress-interval", type=float, default=10.0, help="Seconds between progress reports (0 disables)")
+    args = parser.parse_args()
+
+    options = {
+        "did": args.did,
+        "show_thresh": args.show_threshold,
+        "hide_thresh": args.hide_threshold,
+        "temperature": max(args.temperature, 0.1),
+        "bias_weight": args.bias_weight,
+        "policy": args.policy,
+        "batch_size": max(args.batch_size, 1),
+        # Split the cores between workers instead of letting each one grab all of them
+        "torch_threads": max((os.cpu_count() or 1) // args.workers, 1) if args.workers > 1 else 0,
+    }
+
+    stream = sys.stdin if args.input == "-" else open(args.input, "r", encoding="utf-8")
+    output = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        run(stream, output, options, workers=args.workers, shard=args.shard,
+            progress_interval=args.progress_interval)
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -26,6 +26,9 @@ if not FEED_URI:
     raise RuntimeError('Publish your feed first (run publish_feed.py) to obtain Feed URI. '
                        'Set this URI to "FEED_URI" environment variable.')
 
+# Feed rows are keyed by the record name at the end of the feed URI
+FEED_NAME = FEED_URI.rstrip('/').rsplit('/', 1)[-1]
+
 
 def _get_bool_env_var(value: str) -> bool:
     if value is None:
@@ -49,6 +52,20 @@ DESCRIPTION = os.getenv("DESCRIPTION")
 HOST = os.getenv("HOST", "0.0.0.0")
 PORT = int(os.getenv("PORT", 8000))
 THREADS = int(os.getenv("THREADS", 4))
+# Port of the /health/ and /metrics/ listener of the ingest role, which serves no feeds; 0 turns it off
+INGEST_METRICS_PORT = int(os.getenv("INGEST_METRICS_PORT", 8001))
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///feed_database.db")
+DATABASE_POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", THREADS + 4))
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", -10000))             # ~10MB (in KB if negative)
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", 5000))            # milliseconds
+SQLITE_TEMP_STORE = os.getenv("SQLITE_TEMP_STORE", "memory")
+SQLITE_WAL_AUTOCHECKPOINT = int(os.getenv("SQLITE_WAL_AUTOCHECKPOINT", 1000))  # pages
+POSTGRES_COPY_THRESHOLD = int(os.getenv("POSTGRES_COPY_THRESHOLD", 100))
+# Whether importing server.database creates tables and applies migrations.
+# The serve role turns it off and only checks that the schema is current, so
+# serve replicas started together never race on a migration.
+DB_MIGRATE = _get_bool_env_var(os.getenv("DB_MIGRATE", "true"))
 DB_RECORD_TTL = int(os.getenv("DB_RECORD_TTL", 1800))
 DB_THREAD_HYSTERESIS = int(os.getenv("DB_THREAD_HYSTERESIS", 15))
 MODEL_NAME = os.getenv("MODEL_NAME", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
@@ -61,3 +78,155 @@ TEMPERATURE = float(os.getenv("SOFTMAX_TEMPERATURE", 1.0))
 # Clamp temperature to safe minimum value
 if TEMPERATURE <= 0.0:
     TEMPERATURE = 0.1
+
+# Firehose connection supervision. Reconnects back off exponentially from
+# FIREHOSE_BACKOFF_BASE up to FIREHOSE_BACKOFF_MAX seconds (with full jitter);
+# a connection that delivers nothing for FIREHOSE_STALL_TIMEOUT seconds is
+# treated as dead and reopened from the stored cursor.
+FIREHOSE_URI = os.getenv("FIREHOSE_URI", "wss://bsky.network/xrpc").rstrip("/")
+FIREHOSE_BACKOFF_BASE = max(float(os.getenv("FIREHOSE_BACKOFF_BASE", 1.0)), 0.0)
+FIREHOSE_BACKOFF_MAX = max(float(os.getenv("FIREHOSE_BACKOFF_MAX", 60.0)), FIREHOSE_BACKOFF_BASE)
+FIREHOSE_STALL_TIMEOUT = max(float(os.getenv("FIREHOSE_STALL_TIMEOUT", 30.0)), 1.0)
+
+# Firehose catch-up (replay from the stored cursor after a restart)
+CATCHUP_LAG_THRESHOLD = int(os.getenv("CATCHUP_LAG_THRESHOLD", 30))
+CATCHUP_BATCH_SIZE = max(int(os.getenv("CATCHUP_BATCH_SIZE", 50)), 1)
+CATCHUP_MAX_POSTS_PER_SECOND = float(os.getenv("CATCHUP_MAX_POSTS_PER_SECOND", 100))
+
+# Adaptive load shedding when the firehose consumer falls behind. Entering
+# each level needs the smoothed commit lag (seconds) to exceed its threshold:
+# 1 skip webpage fetches, 2 skip alt text, 3 keyword-only scoring, 4 sampling.
+SHED_LAG_THRESHOLDS = [float(x) for x in os.getenv("SHED_LAG_THRESHOLDS", "10,30,60,120").split(",")]
+SHED_RECOVERY_RATIO = float(os.getenv("SHED_RECOVERY_RATIO", 0.5))
+SHED_MIN_DWELL = float(os.getenv("SHED_MIN_DWELL", 15))
+SHED_SAMPLE_RATE = min(max(float(os.getenv("SHED_SAMPLE_RATE", 0.25)), 0.0), 1.0)
+
+# Duplicate detection. Copies of a post seen within DEDUP_WINDOW seconds reuse
+# the first copy's decision; near-copies may differ in up to DEDUP_MAX_DISTANCE
+# bits of their 64-bit SimHash (0 disables near-copy matching). With DEDUP_COLLAPSE only the first copy
+# of a shown post is added to the feed.
+DEDUP_ENABLED = _get_bool_env_var(os.getenv("DEDUP_ENABLED", "true"))
+DEDUP_WINDOW = float(os.getenv("DEDUP_WINDOW", 3600))
+DEDUP_MAX_ENTRIES = max(int(os.getenv("DEDUP_MAX_ENTRIES", 50000)), 1)
+DEDUP_MAX_DISTANCE = min(max(int(os.getenv("DEDUP_MAX_DISTANCE", 6)), 0), 16)
+DEDUP_MIN_LENGTH = int(os.getenv("DEDUP_MIN_LENGTH", 24))
+DEDUP_COLLAPSE = _get_bool_env_var(os.getenv("DEDUP_COLLAPSE"))
+
+# Local embedding service (python -m server.embedding_service). When
+# EMBEDDING_SOCKET names its Unix socket, encode calls go to the service;
+# otherwise, or while it is unreachable, the model is loaded in-process.
+# The service batches requests up to EMBEDDING_MAX_BATCH texts, waiting at
+# most EMBEDDING_MAX_WAIT_MS for a batch to fill.
+EMBEDDING_SOCKET = os.getenv("EMBEDDING_SOCKET", "")
+EMBEDDING_MAX_BATCH = max(int(os.getenv("EMBEDDING_MAX_BATCH", 64)), 1)
+EMBEDDING_MAX_WAIT_MS = max(float(os.getenv("EMBEDDING_MAX_WAIT_MS", 10)), 0.0)
+EMBEDDING_TIMEOUT = max(float(os.getenv("EMBEDDING_TIMEOUT", 30)), 1.0)
+EMBEDDING_RETRY_SECONDS = max(float(os.getenv("EMBEDDING_RETRY_SECONDS", 30)), 0.0)
+
+# Cross-commit micro-batching of live firehose posts. Posts from consecutive
+# commits are classified together once MICROBATCH_MAX_SIZE posts are queued
+# or the oldest has waited MICROBATCH_MAX_WAIT_MS; both shrink automatically
+# when posts arrive too slowly to fill a batch. At most MICROBATCH_MAX_PENDING
+# commits wait for classification before the firehose reader blocks.
+MICROBATCH_MAX_SIZE = max(int(os.getenv("MICROBATCH_MAX_SIZE", 64)), 1)
+MICROBATCH_MAX_WAIT_MS = max(float(os.getenv("MICROBATCH_MAX_WAIT_MS", 50)), 0.0)
+MICROBATCH_MAX_PENDING = max(int(os.getenv("MICROBATCH_MAX_PENDING", 2000)), 1)
+
+# Format of stored list vectors: "float32", or "int8" (per-vector scaled,
+# a quarter of the size). Existing rows are converted by the v5 migration.
+VECTOR_STORAGE = os.getenv("VECTOR_STORAGE", "float32").strip().lower()
+if VECTOR_STORAGE not in ("float32", "int8"):
+    raise RuntimeError(f"VECTOR_STORAGE must be float32 or int8, not {VECTOR_STORAGE!r}")
+
+# Rebuilding list vectors from URLs (user_list_tool): pages are fetched by up
+# to LIST_FETCH_WORKERS threads, and a page fetched less than PAGE_CACHE_TTL
+# seconds ago is reused without fetching it again.
+LIST_FETCH_WORKERS = max(int(os.getenv("LIST_FETCH_WORKERS", 8)), 1)
+PAGE_CACHE_TTL = max(float(os.getenv("PAGE_CACHE_TTL", 86400)), 0.0)
+
+# What the model reads of each post. Sources are filled in priority order
+# (post text, then alt and link card text, then the linked page), each up to
+# its token budget, until the model's input length is used up. With
+# EMBED_CHUNK_PAGES the rest of a long page is embedded in up to
+# EMBED_MAX_CHUNKS more pieces and pooled with the post's vector.
+# EMBED_MAX_TOKENS is the model's input length when the model is not loaded
+# in-process (embedding service).
+EMBED_TOKEN_BUDGETS = os.getenv("EMBED_TOKEN_BUDGETS", "post:128,alt:48,page:128")
+EMBED_CHUNK_PAGES = _get_bool_env_var(os.getenv("EMBED_CHUNK_PAGES"))
+EMBED_MAX_CHUNKS = max(int(os.getenv("EMBED_MAX_CHUNKS", 4)), 0)
+EMBED_MAX_TOKENS = max(int(os.getenv("EMBED_MAX_TOKENS", 128)), 8)
+
+# Embeddings of the posts scored within the DB_RECORD_TTL window, kept so a
+# change to the user's lists is applied to posts already judged. At most
+# WINDOW_STORE_MAX_POSTS are kept, as int8 or float32 (WINDOW_STORE_STORAGE),
+# memory-mapped from WINDOW_STORE_PATH when it is set.
+WINDOW_STORE_ENABLED = _get_bool_env_var(os.getenv("WINDOW_STORE_ENABLED", "true"))
+WINDOW_STORE_MAX_POSTS = max(int(os.getenv("WINDOW_STORE_MAX_POSTS", 100000)), 1)
+WINDOW_STORE_STORAGE = os.getenv("WINDOW_STORE_STORAGE", "int8").strip().lower()
+WINDOW_STORE_PATH = os.getenv("WINDOW_STORE_PATH", "")
+if WINDOW_STORE_STORAGE not in ("float32", "int8"):
+    raise RuntimeError(f"WINDOW_STORE_STORAGE must be float32 or int8, not {WINDOW_STORE_STORAGE!r}")
+
+# More feeds served from the same ingest pass: a JSON file holding a list of
+# {"uri", "lists_did", "show_threshold", "hide_threshold", "temperature",
+# "bias_weight", "ambiguous_policy"} objects. Only "uri" is required; the
+# rest default to DEFAULT_DID and the settings above. FEED_URI is always
+# served, with those defaults.
+FEEDS_FILE = os.getenv("FEEDS_FILE", "")
+
+# Thread decisions. The decisions of recent posts are kept for THREAD_WINDOW
+# seconds (at most THREAD_MAX_ENTRIES), and a reply inherits its parent's or
+# thread root's decision instead of being scored when THREAD_INHERIT allows
+# it: "hide", "show", "both" or "none" (default). With THREAD_COLLAPSE a feed
+# shows one post per thread: the root when it is in the feed, otherwise the
+# thread's newest reply.
+THREAD_INHERIT = os.getenv("THREAD_INHERIT", "none").strip().lower()
+if THREAD_INHERIT not in ("hide", "show", "both", "none"):
+    raise RuntimeError(f"THREAD_INHERIT must be hide, show, both or none, not {THREAD_INHERIT!r}")
+THREAD_WINDOW = float(os.getenv("THREAD_WINDOW", DB_RECORD_TTL))
+THREAD_MAX_ENTRIES = max(int(os.getenv("THREAD_MAX_ENTRIES", 200000)), 1)
+THREAD_COLLAPSE = _get_bool_env_var(os.getenv("THREAD_COLLAPSE"))
+
+# Author reputation. Decisions are tallied per author with exponential decay
+# (AUTHOR_HALF_LIFE seconds), for at most AUTHOR_MAX_ENTRIES authors. Once an
+# author has AUTHOR_MIN_POSTS (decayed) decisions of which a share of at least
+# AUTHOR_CONFIDENCE agree for every feed, their posts take that decision after
+# a keyword check instead of being embedded. AUTHOR_VERIFY_RATE of them are
+# scored anyway; a disagreement resets the author. Off by default: a small
+# share of decisions differ from what the model would have made.
+AUTHOR_REPUTATION_ENABLED = _get_bool_env_var(os.getenv("AUTHOR_REPUTATION_ENABLED", "false"))
+AUTHOR_HALF_LIFE = max(float(os.getenv("AUTHOR_HALF_LIFE", 86400)), 1.0)
+AUTHOR_MAX_ENTRIES = max(int(os.getenv("AUTHOR_MAX_ENTRIES", 100000)), 1)
+AUTHOR_MIN_POSTS = max(float(os.getenv("AUTHOR_MIN_POSTS", 8)), 1.0)
+AUTHOR_CONFIDENCE = min(max(float(os.getenv("AUTHOR_CONFIDENCE", 0.95)), 0.5), 1.0)
+AUTHOR_VERIFY_RATE = min(max(float(os.getenv("AUTHOR_VERIFY_RATE", 0.1)), 0.0), 1.0)
+
+# Deletes of posts never accepted into a feed. URIs written to the Post table
+# are added to a rotating Bloom filter covering the DB_RECORD_TTL window,
+# sized for ACCEPTED_FILTER_CAPACITY URIs per window at a false-positive
+# rate of ACCEPTED_FILTER_FPR, and firehose deletes of any other URI are
+# dropped before they reach the database.
+ACCEPTED_FILTER_ENABLED = _get_bool_env_var(os.getenv("ACCEPTED_FILTER_ENABLED", "true"))
+ACCEPTED_FILTER_CAPACITY = max(int(os.getenv("ACCEPTED_FILTER_CAPACITY", 200000)), 1)
+ACCEPTED_FILTER_FPR = min(max(float(os.getenv("ACCEPTED_FILTER_FPR", 0.01)), 1e-6), 0.5)
+
+# Memory budget shared by the in-process caches (server.memory). The total of
+# the DID cache, dedup index, thread decisions, author histories and feed
+# window, plus fixed allocations such as model weights, is kept under
+# MEMORY_BUDGET_MB; 0 uses MEMORY_BUDGET_FRACTION of the cgroup memory limit,
+# or of physical memory outside a container. Every MEMORY_CHECK_INTERVAL
+# seconds a total over the budget is cut to MEMORY_LOW_WATER of it by
+# evicting the oldest entries of the cheapest, least recently used caches.
+MEMORY_BUDGET_MB = max(float(os.getenv("MEMORY_BUDGET_MB", 0)), 0.0)
+MEMORY_BUDGET_FRACTION = min(max(float(os.getenv("MEMORY_BUDGET_FRACTION", 0.5)), 0.0), 1.0)
+MEMORY_LOW_WATER = min(max(float(os.getenv("MEMORY_LOW_WATER", 0.9)), 0.1), 1.0)
+MEMORY_CHECK_INTERVAL = max(float(os.getenv("MEMORY_CHECK_INTERVAL", 10)), 0.0)
+
+# Logging. Records at LOG_LEVEL and above (DEBUG under FLASK_DEBUG, ERROR
+# otherwise) are queued by the logging thread and written to stdout by a
+# background listener. Per-post debug records are sampled: one post in
+# LOG_SAMPLE_EVERY is logged.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG" if FLASK_DEBUG else "ERROR").strip().upper()
+if LOG_LEVEL not in ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"):
+    raise RuntimeError(f"LOG_LEVEL must be DEBUG, INFO, WARNING, ERROR or CRITICAL, not {LOG_LEVEL!r}")
+LOG_SAMPLE_EVERY = max(int(os.getenv("LOG_SAMPLE_EVERY", 100)), 1)
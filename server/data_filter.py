@@ -1,19 +1,27 @@
 import datetime
 
 from collections import defaultdict
+from typing import List, Optional
+
+import numpy as np
 
 from atproto import models
 
-from server import config
-from server.database import db, Post, fetch_user_lists_fields
-from server.logger import setup_logger
-from server.text_utils import clean_text, extract_extra_text
-from server.vector import string_to_vector, score_post
+from server import authors, config, dedup, feed_window, metrics, threads
+from server.algos.definitions import FeedDefinition, feeds
+from server.load_shedding import controller, KEYWORD_ONLY, NO_ALT_TEXT, NO_WEBPAGES
+from server.database import delete_accepted_posts, insert_posts
+from server.logger import sample, setup_logger
+from server.post_record import PostRecord
+from server.embedding_inputs import SOURCES, embed_posts
+from server.text_utils import EXTRA_SOURCES, clean_texts, extract_extra_sources
+from server.user_lists import CompiledLists, get_user_lists
+from server.vector import DECISIONS, keyword_hits, score_batch_feeds, score_post_keywords
 
 logger = setup_logger(__name__)
 
 
-def is_archive_post(record: 'models.AppBskyFeedPost.Record') -> bool:
+def is_archive_post(post: PostRecord) -> bool:
     # Sometimes users will import old posts from Twitter/X which con flood a feed with
     # old posts. Unfortunately, the only way to test for this is to look an old
     # created_at date. However, there are other reasons why a post might have an old
@@ -24,96 +32,263 @@ def is_archive_post(record: 'models.AppBskyFeedPost.Record') -> bool:
     # See https://github.com/MarshalX/bluesky-feed-generator/pull/21
 
     archived_threshold = datetime.timedelta(days=1)
-    created_at = datetime.datetime.fromisoformat(record.created_at)
+    try:
+        created_at = datetime.datetime.fromisoformat(post.created_at)
+    except (TypeError, ValueError):
+        return False
     now = datetime.datetime.now(datetime.UTC)
 
     return now - created_at > archived_threshold
 
 
-def should_ignore_post(created_post: dict) -> bool:
-    record = created_post['record']
-    uri = created_post['uri']
-
-    if config.IGNORE_ARCHIVED_POSTS and is_archive_post(record):
-        logger.debug(f'Ignoring archived post: {uri}')
+def should_ignore_post(post: PostRecord) -> bool:
+    if config.IGNORE_ARCHIVED_POSTS and is_archive_post(post):
+        logger.debug('Ignoring archived post: %s', post.uri)
         return True
 
-    if config.IGNORE_REPLY_POSTS and record.reply:
-        logger.debug(f'Ignoring reply post: {uri}')
+    if config.IGNORE_REPLY_POSTS and post.is_reply:
+        logger.debug('Ignoring reply post: %s', post.uri)
         return True
 
     return False
 
 
+def score_posts(posts: List[PostRecord], level: int, feed_lists: List[Optional[CompiledLists]],
+                definitions: List[FeedDefinition] = None) -> List[dict]:
+    """
+    Score posts for every feed with as much work as the shedding level
+    allows. Cleaning and embedding run once over the whole batch whatever
+    the number of feeds, and the feeds' vector scores come from one matrix
+    product. feed_lists holds each feed's lists, or None for a feed whose
+    lists are not saved yet; such a feed gets no decision.
+    """
+    definitions = feeds if definitions is None else definitions
+    source_texts = []
+    for post in posts:
+        # Primary text and embedded extras (links, alt text, link card, linked page), kept apart by source
+        sources = extract_extra_sources(post,
+                                        fetch_webpages=level < NO_WEBPAGES,
+                                        include_alt_text=level < NO_ALT_TEXT)
+        post.extra_text = " ".join(text for source in EXTRA_SOURCES for text in sources[source])
+        source_texts += [" ".join([post.text] + sources["links"]),
+                         " ".join(sources["alt"] + sources["card"]),
+                         " ".join(sources["page"])]
+
+    cleaned = clean_texts(source_texts)
+    embedding_inputs = [dict(zip(SOURCES, cleaned[i:i + len(SOURCES)])) for i in range(0, len(cleaned), len(SOURCES))]
+    cleaned_texts = [" ".join(filter(None, inputs.values())) for inputs in embedding_inputs]
+
+    decisions = [[None] * len(feed_lists) for _ in posts]
+    prob_white = [[None] * len(feed_lists) for _ in posts]
+    prob_black = [[None] * len(feed_lists) for _ in posts]
+    no_hits = {"white": [], "black": []}
+    hits = [[no_hits] * len(feed_lists) for _ in posts]
+    vector_feeds = []
+    for index, (definition, lists) in enumerate(zip(definitions, feed_lists)):
+        if lists is None:
+            continue
+        if level < KEYWORD_ONLY and lists.matrix is not None:
+            vector_feeds.append(index)
+            for n, cleaned_text in enumerate(cleaned_texts):
+                hits[n][index] = keyword_hits(cleaned_text, keyword_matcher=lists.matcher)
+            continue
+        for n, cleaned_text in enumerate(cleaned_texts):
+            scores = score_post_keywords(cleaned_text, lists.white_words, lists.black_words,
+                                         bias_weight=definition.bias_weight, keyword_matcher=lists.matcher)
+            decisions[n][index] = scores["decision"]
+            hits[n][index] = {"white": scores["white_hits"], "black": scores["black_hits"]}
+
+    vectors = None
+    if vector_feeds:
+        # Each source is held to its token budget so the post text is never cut off by a long page
+        vectors = embed_posts(embedding_inputs)
+        selected = [definitions[index] for index in vector_feeds]
+        scores = score_batch_feeds(
+            vectors, np.stack([feed_lists[index].matrix for index in vector_feeds]),
+            np.array([[bool(post_hits[index]["white"]) for index in vector_feeds] for post_hits in hits], dtype=bool),
+            np.array([[bool(post_hits[index]["black"]) for index in vector_feeds] for post_hits in hits], dtype=bool),
+            show_thresh=[definition.show_thresh for definition in selected],
+            hide_thresh=[definition.hide_thresh for definition in selected],
+            temperature=[definition.temperature for definition in selected],
+            bias_weight=[definition.bias_weight for definition in selected])
+        for n, codes in enumerate(scores["decision"]):
+            for column, (index, code) in enumerate(zip(vector_feeds, codes)):
+                decisions[n][index] = DECISIONS[code]
+                prob_white[n][index] = float(scores["prob_white"][n, column])
+                prob_black[n][index] = float(scores["prob_black"][n, column])
+
+    return [
+        {
+            "decisions": tuple(decisions[n]),
+            "white_hits": [hit["white"] for hit in hits[n]],
+            "black_hits": [hit["black"] for hit in hits[n]],
+            # None for feeds decided on keywords alone
+            "prob_white": prob_white[n],
+            "prob_black": prob_black[n],
+            # Kept in the feed window for re-scoring when the lists change
+            "text": cleaned_texts[n],
+            "vector": vectors[n] if vectors is not None else None,
+        }
+        for n in range(len(posts))
+    ]
+
+
+class _Candidate:
+    """A created post on its way through operations_callback, and what is known about it so far."""
+    # decisions: per-feed decisions, None until scored or reused; first_uri: the post a copy reuses
+    # decisions from; vector and text: kept for the feed window; inherited: per-feed decisions taken
+    # from the thread; predicted: the author's usual decisions, to be verified against the scores
+    __slots__ = ('post', 'fingerprint', 'decisions', 'first_uri', 'explanations',
+                 'vector', 'text', 'inherited', 'predicted')
+
+    def __init__(self, post: PostRecord, fingerprint: Optional[dedup.Fingerprint], decisions: Optional[tuple],
+                 first_uri: Optional[str], explanations: List[str], inherited: Optional[tuple] = None,
+                 predicted: Optional[tuple] = None):
+        self.post = post
+        self.fingerprint = fingerprint
+        self.decisions = decisions
+        self.first_uri = first_uri
+        self.explanations = explanations
+        self.vector = None
+        self.text = None
+        self.inherited = inherited
+        self.predicted = predicted
+
+
 def operations_callback(ops: defaultdict) -> None:
-    # Here we can filter, process, run ML classification, etc.
-    # After our feed alg we can save posts into our DB
-    # Also, we should process deleted posts to remove them from our DB and keep it in sync
+    # Classify created posts into every feed: ignored and shed posts are
+    # dropped, replies may inherit their thread's decisions, near-copies reuse
+    # an earlier post's, confidently one-sided authors get their usual ones,
+    # and the rest are embedded and scored as one batch. Accepted posts are
+    # written, and deleted posts removed to keep the DB in sync.
 
-    # for example, let's create our custom feed that will contain all posts that contains 'python' related text
+    # Lookup each feed's whitelist and blacklist vectors and keywords
+    feed_lists = [get_user_lists(definition.lists_did) for definition in feeds]
 
-    # Lookup user-specific whitelist and blacklist vectors
-    user_did = config.DEFAULT_DID    # Let's use DEFAULT_DID for now...
-    white_list_text, white_list_vector, white_list_dim, black_list_text, black_list_vector, black_list_dim = fetch_user_lists_fields(user_did)
-    white_list_words=white_list_text.split()
-    black_list_words=black_list_text.split()
+    # Amount of work per post, stepped down while the consumer is lagging
+    level = controller.level
 
-    posts_to_create = []
-    for created_post in ops[models.ids.AppBskyFeedPost]['created']:
-        author = created_post['author']
-        record = created_post['record']
+    # Remembered decisions only hold for the lists they were made against
+    scope = tuple((definition.lists_did, lists and lists.modified_at) for definition, lists in zip(feeds, feed_lists))
+    dedup.index.bind(scope)
+    threads.index.bind(scope)
+    if authors.index is not None:
+        authors.index.bind(scope)
+    # Posts already in the window are re-scored once for each feed whose lists were edited
+    if feed_window.window is not None:
+        feed_window.window.bind(scope, feed_lists)
+
+    # Posts that survive filtering, with the decisions of an earlier copy or of their thread when there is one
+    candidates = []
+    needed = [lists is not None for lists in feed_lists]
+    # Nothing can be classified until lists have been saved for some feed
+    for post in ops[models.ids.AppBskyFeedPost]['created'] if any(feed_lists) else ():
+        if should_ignore_post(post):
+            continue
+
+        if not controller.keep(post.uri):
+            metrics.increment('load_shedding.posts_dropped')
+            continue
 
-        uri = created_post['uri']
-        cid = created_post['cid']
+        # Replies of a recently decided thread take its decisions, for every feed or only some
+        inherited = threads.index.inherit(post, needed)
+        if inherited is not None and all(d is not None or not need for d, need in zip(inherited, needed)):
+            candidates.append(_Candidate(post, None, inherited, None, ["thread"] * len(feeds), inherited=inherited))
+            continue
+
+        # Copies of a recent post reuse its decisions without any cleaning or model work
+        fingerprint = dedup.fingerprint(post) if config.DEDUP_ENABLED else None
+        scored, first_uri = dedup.index.match(fingerprint) if fingerprint else (None, None)
+        explanation = "duplicate"
+
+        # Authors who nearly always get the same decisions get them again, bar a sample that is checked
+        predicted = None
+        if scored is None and inherited is None and authors.index is not None:
+            prediction = authors.index.predict(post, feed_lists)
+            if prediction is not None:
+                predicted, verify = prediction
+                if not verify:
+                    scored, predicted, explanation = predicted, None, "author"
+        candidates.append(_Candidate(post, fingerprint, scored, first_uri, [explanation] * len(feeds),
+                                     inherited=inherited, predicted=predicted))
 
-        if should_ignore_post(created_post):
+    # Score the rest as one batch; exact copies within the batch are scored once
+    to_score, copies = [], {}
+    for candidate in candidates:
+        if candidate.decisions is not None:
             continue
+        fingerprint = candidate.fingerprint
+        leader = copies.get(fingerprint.exact) if fingerprint else None
+        if leader is not None:
+            candidate.first_uri = leader.post.uri
+            continue
+        to_score.append(candidate)
+        if fingerprint:
+            copies[fingerprint.exact] = candidate
+
+    for candidate, scores in zip(to_score, score_posts([c.post for c in to_score], level, feed_lists) if to_score else ()):
+        post = candidate.post
+        candidate.decisions = scores['decisions']
+        candidate.explanations = [f"white={white}, black={black}"
+                                  for white, black in zip(scores['white_hits'], scores['black_hits'])]
+        candidate.vector, candidate.text = scores['vector'], scores['text']
+        # Keyword-only decisions are a stopgap; let later copies be scored properly
+        if candidate.fingerprint and level < KEYWORD_ONLY:
+            dedup.index.add(candidate.fingerprint, candidate.decisions, post.uri)
+        if authors.index is not None and level < KEYWORD_ONLY:
+            if candidate.predicted is not None:
+                authors.index.verify(post.author, candidate.predicted, candidate.decisions,
+                                     scores['prob_white'], scores['prob_black'])
+            else:
+                authors.index.observe(post.author, candidate.decisions, scores['prob_white'], scores['prob_black'])
 
-        # Combine primary text and embedded alt text (e.g. image descriptions)
-        combined_text = record.text
-        extra_text = extract_extra_text(record)
-        if extra_text:
-            combined_text += " " + " ".join(extra_text)
-
-        cleaned = clean_text(combined_text)
-        post_vector = string_to_vector(cleaned)
-
-        scores = score_post(
-            post_vector,
-            white_list_vector,
-            black_list_vector,
-            post_text=cleaned,
-            whitelist_words=white_list_words,
-            blacklist_words=black_list_words,
-        )
-
-        decision = config.AMBIGUOUS_POST_POLICY if scores.get("decision") == "AMBIGUOUS" else scores.get("decision")
-        if decision == "SHOW":
-            reply_root = reply_parent = None
-            if record.reply:
-                reply_root = record.reply.root.uri
-                reply_parent = record.reply.parent.uri
-
-            post_dict = {
-                'uri': uri,
-                'cid': cid,
-                'reply_parent': reply_parent,
-                'reply_root': reply_root,
-            }
-
-            posts_to_create.append(post_dict)
-            logger.debug(f"✅ Included post {created_post['uri']}: scored=({scores.get("decision")}), policy=({config.AMBIGUOUS_POST_POLICY}), decision=({decision})")
-        else:
-            logger.debug(f"🚫 Filtered out post {created_post['uri']}: scored=({scores.get("decision")}), policy=({config.AMBIGUOUS_POST_POLICY}), decision=({decision})")
+    posts_to_create = []
+    for candidate in candidates:
+        post, first_uri, explanations, inherited = (candidate.post, candidate.first_uri,
+                                                    candidate.explanations, candidate.inherited)
+        scored = candidate.decisions
+        if scored is None:
+            # An in-batch copy takes the decisions of the post it copies
+            scored = copies[candidate.fingerprint.exact].decisions
+        if inherited is not None:
+            scored = tuple(scored_decision if decision is None else decision
+                           for decision, scored_decision in zip(inherited, scored))
+            explanations = [explanation if decision is None else "thread"
+                            for decision, explanation in zip(inherited, explanations)]
+        # Keyword-only decisions are a stopgap and are not passed down threads
+        if level < KEYWORD_ONLY or inherited is not None:
+            threads.index.record(post.uri, scored)
+        shown = [definition.shows(decision) and not (first_uri and config.DEDUP_COLLAPSE)
+                 for definition, decision in zip(feeds, scored)]
+        if feed_window.window is not None:
+            feed_window.window.add(post, candidate.vector, candidate.text, shown, first_uri)
+        logged = sample(logger, post.uri)
+        for definition, decision, show, explanation in zip(feeds, scored, shown, explanations):
+            if decision is None:
+                continue
+            if show:
+                posts_to_create.append(post.row(definition.name))
+                if logged:
+                    logger.debug("✅ Included post %s in %s: scored=(%s), policy=(%s), keywords=(%s)",
+                                 post.uri, definition.name, decision, definition.ambiguous_policy, explanation)
+            elif first_uri and definition.shows(decision):
+                metrics.increment('dedup.collapsed')
+                if logged:
+                    logger.debug("🔁 Collapsed post %s into %s in %s", post.uri, first_uri, definition.name)
+            elif logged:
+                logger.debug("🚫 Filtered out post %s from %s: scored=(%s), policy=(%s), keywords=(%s)",
+                             post.uri, definition.name, decision, definition.ambiguous_policy, explanation)
 
     posts_to_delete = ops[models.ids.AppBskyFeedPost]['deleted']
     if posts_to_delete:
         post_uris_to_delete = [post['uri'] for post in posts_to_delete]
-        Post.delete().where(Post.uri.in_(post_uris_to_delete))
-        logger.debug(f'Deleted from feed: {len(post_uris_to_delete)}')
+        if feed_window.window is not None:
+            feed_window.window.discard(post_uris_to_delete)
+        # Nearly all of these were never in a feed; those are dropped before the query
+        deleted = delete_accepted_posts(post_uris_to_delete)
+        logger.debug('Deleted from feed: %d of %d', deleted, len(post_uris_to_delete))
 
     if posts_to_create:
-        with db.atomic():
-            for post_dict in posts_to_create:
-                post_obj = Post.create(**post_dict)
-        logger.debug(f'Added to feed: {len(posts_to_create)}')
+        # Replaying from a stored cursor may deliver posts we already have
+        insert_posts(posts_to_create)
+        logger.debug('Added to feed: %d', len(posts_to_create))
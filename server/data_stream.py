@@ -1,24 +1,68 @@
 # data_stream.py
+import random
+import threading
 import time
 from collections import defaultdict
-from atproto import AtUri, CAR, firehose_models, FirehoseSubscribeReposClient, models, parse_subscribe_repos_message
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from urllib.parse import urlencode
+import libipld
+from atproto import firehose_models, models, parse_subscribe_repos_message
 from atproto.exceptions import FirehoseError
-from server.database import SubscriptionState
+from atproto_client.models.common import XrpcError
+from websockets.exceptions import ConnectionClosed, InvalidHandshake
+from websockets.sync.client import connect
+from server import config, metrics
+from server.database import SubscriptionState, save_cursor
+from server.load_shedding import controller
+from server.micro_batch import MicroBatcher
+from server.post_record import PostRecord
 from server.logger import setup_logger
 
 logger = setup_logger(__name__)
 
+# Set once the consumer has replayed the backlog since the stored cursor
+# and is reading commits within CATCHUP_LAG_THRESHOLD of the live head.
+catchup_complete = threading.Event()
+
+# Same frame size limit as the atproto client
+_MAX_MESSAGE_SIZE_BYTES = 5 * 1024 * 1024
+
+# How often a blocked receive wakes up to check for shutdown and stalls
+_POLL_INTERVAL = 0.5
+
+# Errors after which the connection is reopened rather than the consumer stopped
+_CONNECTION_ERRORS = (ConnectionClosed, InvalidHandshake, OSError, TimeoutError)
+
+# Other records kept as pydantic models; posts are decoded into PostRecord
 _INTERESTED_RECORDS = {
     models.AppBskyFeedLike: models.ids.AppBskyFeedLike,
-    models.AppBskyFeedPost: models.ids.AppBskyFeedPost,
     models.AppBskyGraphFollow: models.ids.AppBskyGraphFollow,
 }
 
 
-def _get_ops_by_type(commit: models.ComAtprotoSyncSubscribeRepos.Commit) -> defaultdict:
+def _commit_lag_seconds(commit: models.ComAtprotoSyncSubscribeRepos.Commit) -> float:
+    """Seconds between the commit timestamp and the local wall clock."""
+    try:
+        commit_time = datetime.fromisoformat(commit.time.replace('Z', '+00:00'))
+    except (AttributeError, TypeError, ValueError):
+        return 0.0
+    if commit_time.tzinfo is None:
+        commit_time = commit_time.replace(tzinfo=timezone.utc)
+    return max((datetime.now(timezone.utc) - commit_time).total_seconds(), 0.0)
+
+
+def _decode_blocks(commit: models.ComAtprotoSyncSubscribeRepos.Commit) -> dict:
+    """Commit blocks keyed by CID string, without building a CID object per block as CAR.from_bytes does."""
+    _, blocks = libipld.decode_car(commit.blocks)
+    return {libipld.encode_cid(cid): block for cid, block in blocks.items()}
+
+
+def _get_ops_by_type(commit: models.ComAtprotoSyncSubscribeRepos.Commit,
+                     indexed_at: Optional[datetime] = None) -> defaultdict:
     operation_by_type = defaultdict(lambda: {'created': [], 'deleted': []})
 
-    car = CAR.from_bytes(commit.blocks)
+    blocks = None  # decoded on the first create, most commits carry only likes and deletes
 
     for i, op in enumerate(commit.ops):
     
@@ -30,77 +74,258 @@ def _get_ops_by_type(commit: models.ComAtprotoSyncSubscribeRepos.Commit) -> defa
             # we are not interested in updates
             continue
 
-        uri = AtUri.from_str(f'at://{commit.repo}/{op.path}')
+        uri = f'at://{commit.repo}/{op.path}'
+        collection = op.path.split('/', 1)[0]
 
         if op.action == 'create':
             if not op.cid:
                 continue
 
-            create_info = {'uri': str(uri), 'cid': str(op.cid), 'author': commit.repo}
+            if blocks is None:
+                blocks = _decode_blocks(commit)
+            cid = str(op.cid)
+            record_raw_data = blocks.get(cid)
+            if not isinstance(record_raw_data, dict):
+                continue
 
-            record_raw_data = car.blocks.get(op.cid)
-            if not record_raw_data:
+            # Posts, by far the hottest path, skip the pydantic model entirely
+            if collection == models.ids.AppBskyFeedPost:
+                if record_raw_data.get('$type') == models.ids.AppBskyFeedPost:
+                    operation_by_type[collection]['created'].append(
+                        PostRecord.from_block(uri, cid, commit.repo, record_raw_data, indexed_at))
                 continue
 
+            create_info = {'uri': uri, 'cid': cid, 'author': commit.repo}
+            if indexed_at is not None:
+                create_info['indexed_at'] = indexed_at
+
             record = models.get_or_create(record_raw_data, strict=False)
             if record is None:  # unknown record (out of bsky lexicon)
                 continue
 
             for record_type, record_nsid in _INTERESTED_RECORDS.items():
-                if uri.collection == record_nsid and models.is_record_type(record, record_type):
+                if collection == record_nsid and models.is_record_type(record, record_type):
                     operation_by_type[record_nsid]['created'].append({'record': record, **create_info})
                     break
 
         if op.action == 'delete':
-            operation_by_type[uri.collection]['deleted'].append({'uri': str(uri)})
+            operation_by_type[collection]['deleted'].append({'uri': uri})
 
     return operation_by_type
 
 
+class FirehoseStalled(Exception):
+    """No frame arrived within FIREHOSE_STALL_TIMEOUT on an open connection."""
+
+
+def _backoff_delay(failures: int) -> float:
+    """Capped exponential backoff with full jitter, so many consumers do not reconnect in lockstep."""
+    ceiling = min(config.FIREHOSE_BACKOFF_MAX, config.FIREHOSE_BACKOFF_BASE * 2 ** min(failures - 1, 32))
+    return random.uniform(0, ceiling)
+
+
 def run(name, operations_callback, stream_stop_event=None):
-    while stream_stop_event is None or not stream_stop_event.is_set():
+    """
+    Supervise the firehose connection until stream_stop_event is set. Every
+    disconnect, error frame or stall reopens the connection from the stored
+    cursor after a backoff that grows with consecutive failures and resets
+    once a connection has stayed healthy for FIREHOSE_BACKOFF_MAX seconds.
+    """
+    stop_event = stream_stop_event or threading.Event()
+    # Live commits are classified in batches on the batcher's worker thread
+    batcher = MicroBatcher(operations_callback)
+    failures = 0
+    disconnected_at = None  # wall time the last healthy stream was lost
+
+    while not stop_event.is_set():
+        session = {'first_message_at': None, 'disconnected_at': disconnected_at}
         try:
-            _run(name, operations_callback, stream_stop_event)
+            _run(name, operations_callback, stop_event, session, batcher)
+        except FirehoseStalled as e:
+            metrics.increment('firehose.stalls')
+            logger.error(f'⚠️ Firehose stalled: {e}. Reconnecting from the stored cursor.')
         except FirehoseError as e:
-            wait = 2
             if "ConsumerTooSlow" in str(e):
-                logger.error(f"⚠️ FirehoseError: ConsumerTooSlow. Sleeping {wait}s before retry...")
+                logger.error("⚠️ FirehoseError: ConsumerTooSlow. Reconnecting with less work per post.")
+                # Do less work per post so the consumer keeps up after reconnecting
+                controller.escalate("ConsumerTooSlow")
             else:
                 logger.error(f'Firehose error: {e}. Reconnecting to the firehose.')
-            time.sleep(wait)
-            continue
+        except _CONNECTION_ERRORS as e:
+            logger.error(f'Firehose connection lost: {e!r}. Reconnecting to the firehose.')
+        metrics.set_gauge('firehose.connected', 0)
 
-def _run(name, operations_callback, stream_stop_event=None):
-    state = SubscriptionState.get_or_none(SubscriptionState.service == name)
+        if stop_event.is_set():
+            break
 
-    params = None
-    if state:
-        params = models.ComAtprotoSyncSubscribeRepos.Params(cursor=state.cursor)
+        first_message_at = session['first_message_at']
+        if first_message_at is not None:
+            disconnected_at = time.time()
+            if disconnected_at - first_message_at >= config.FIREHOSE_BACKOFF_MAX:
+                failures = 0
+        elif disconnected_at is None:
+            disconnected_at = time.time()
+        failures += 1
 
-    client = FirehoseSubscribeReposClient(params)
+        delay = _backoff_delay(failures)
+        metrics.increment('firehose.reconnects')
+        logger.info(f'🔁 Reconnecting to the firehose in {delay:.1f}s (attempt {failures})')
+        # Returns early when shutdown is requested
+        stop_event.wait(delay)
 
-    if not state:
-        SubscriptionState.create(service=name, cursor=0)
+    batcher.stop()
+    logger.info(f'🛑 Firehose consumer for {name} stopped')
 
-    def on_message_handler(message: firehose_models.MessageFrame) -> None:
-        # stop on next message if requested
-        if stream_stop_event and stream_stop_event.is_set():
-            client.stop()
+
+class _CatchUpBuffer:
+    """
+    Accumulates operations from many replayed commits so that classification
+    runs in batches, and throttles it to CATCHUP_MAX_POSTS_PER_SECOND so that
+    the backfill does not starve the feed-serving threads.
+    """
+
+    def __init__(self, operations_callback):
+        self.operations_callback = operations_callback
+        self.ops = defaultdict(lambda: {'created': [], 'deleted': []})
+        self.pending = 0
+        self.posts_replayed = 0
+        self.commits_skipped = 0
+        self.started_at = time.time()
+        self.last_seq = None  # seq of the newest replayed commit, buffered or handed over
+
+    def add(self, ops: defaultdict, seq: int) -> None:
+        self.last_seq = seq
+        for collection, actions in ops.items():
+            self.ops[collection]['created'].extend(actions['created'])
+            self.ops[collection]['deleted'].extend(actions['deleted'])
+            self.pending += len(actions['created'])
+        if self.pending >= config.CATCHUP_BATCH_SIZE:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.ops:
             return
+        start = time.time()
+        self.operations_callback(self.ops)
+        self.posts_replayed += self.pending
+
+        if config.CATCHUP_MAX_POSTS_PER_SECOND > 0:
+            budget = self.pending / config.CATCHUP_MAX_POSTS_PER_SECOND
+            elapsed = time.time() - start
+            if elapsed < budget:
+                time.sleep(budget - elapsed)
+
+        self.ops = defaultdict(lambda: {'created': [], 'deleted': []})
+        self.pending = 0
+
+
+def _subscribe_uri(cursor: Optional[int]) -> str:
+    query = f'?{urlencode({"cursor": cursor})}' if cursor is not None else ''
+    return f'{config.FIREHOSE_URI}/{models.ids.ComAtprotoSyncSubscribeRepos}{query}'
+
+
+def _run(name, operations_callback, stream_stop_event, session, batcher: MicroBatcher):
+    state = SubscriptionState.get_or_none(SubscriptionState.service == name)
+
+    cursor = None
+    if state and state.cursor:
+        cursor = state.cursor
+        if not catchup_complete.is_set():
+            logger.info(f'⏪ Resuming {name} from stored cursor {state.cursor}')
+    else:
+        # Nothing to replay; start from the live head.
+        catchup_complete.set()
+
+    catchup = _CatchUpBuffer(operations_callback)
 
+    def on_message_handler(message: firehose_models.MessageFrame) -> None:
         commit = parse_subscribe_repos_message(message)
         if not isinstance(commit, models.ComAtprotoSyncSubscribeRepos.Commit):
             return
 
+        lag = _commit_lag_seconds(commit)
+        catching_up = not catchup_complete.is_set()
+        if catching_up and lag <= config.CATCHUP_LAG_THRESHOLD:
+            catchup.flush()
+            catchup_complete.set()
+            catching_up = False
+            logger.info(
+                f'✅ Catch-up complete for {name}: replayed {catchup.posts_replayed} posts, '
+                f'skipped {catchup.commits_skipped} expired commits in {time.time() - catchup.started_at:.1f}s'
+            )
+
         # update stored state every ~1k events
         if commit.seq % 1000 == 0:  # lower value could lead to performance issues
-            logger.debug(f'Updated cursor for {name} to {commit.seq}')
-            client.update_params(models.ComAtprotoSyncSubscribeRepos.Params(cursor=commit.seq))
-            SubscriptionState.update(cursor=commit.seq).where(SubscriptionState.service == name).execute()
+            # Never persist a cursor past operations that are still buffered
+            catchup.flush()
+            batcher.flush()
+            logger.debug('Updated cursor for %s to %d', name, commit.seq)
+            save_cursor(name, commit.seq)
 
         if not commit.blocks:
             return
 
-        operations_callback(_get_ops_by_type(commit))
+        if not catching_up:
+            controller.observe(lag)
+            batcher.add(_get_ops_by_type(commit), commit.seq, lag=lag)
+            return
+
+        # Posts older than the TTL window would be expired immediately; skip them.
+        if lag > config.DB_RECORD_TTL:
+            catchup.commits_skipped += 1
+            catchup.last_seq = commit.seq
+            return
+
+        indexed_at = datetime.now(timezone.utc) - timedelta(seconds=lag)
+        catchup.add(_get_ops_by_type(commit, indexed_at=indexed_at), commit.seq)
+
+    try:
+        with connect(_subscribe_uri(cursor), max_size=_MAX_MESSAGE_SIZE_BYTES,
+                     open_timeout=config.FIREHOSE_STALL_TIMEOUT, close_timeout=0.1) as websocket:
+            last_frame_at = time.monotonic()
+            while not stream_stop_event.is_set():
+                try:
+                    raw_frame = websocket.recv(timeout=_POLL_INTERVAL)
+                except TimeoutError:
+                    # A half-open TCP connection never errors; only silence gives it away
+                    silence = time.monotonic() - last_frame_at
+                    if silence >= config.FIREHOSE_STALL_TIMEOUT:
+                        raise FirehoseStalled(f'no frames for {silence:.0f}s') from None
+                    continue
+
+                last_frame_at = time.monotonic()
+                if session['first_message_at'] is None:
+                    session['first_message_at'] = time.time()
+                    metrics.set_gauge('firehose.connected', 1)
+                    if session['disconnected_at'] is not None:
+                        downtime = session['first_message_at'] - session['disconnected_at']
+                        metrics.increment('firehose.downtime_seconds', round(downtime, 3))
+                        logger.info(f'✅ Firehose stream restored after {downtime:.1f}s')
+                metrics.set_gauge('firehose.last_frame_at', time.time())
+
+                if isinstance(raw_frame, str):
+                    continue  # text frames are not part of the protocol
+
+                try:
+                    frame = firehose_models.Frame.from_bytes(raw_frame)
+                except Exception as e:
+                    # Skip a frame that cannot be decoded rather than drop the connection
+                    logger.debug('Skipping undecodable firehose frame: %s', e)
+                    continue
+                if isinstance(frame, firehose_models.ErrorFrame):
+                    raise FirehoseError(XrpcError(frame.body.error, frame.body.message))
+                if not isinstance(frame, firehose_models.MessageFrame):
+                    continue
 
-    client.start(on_message_handler)
+                try:
+                    on_message_handler(frame)
+                except Exception as e:
+                    logger.error(f'Error while processing firehose message: {e}', exc_info=True)
+    finally:
+        # Resume from the last processed commit rather than the last ~1k checkpoint, so a
+        # reconnect while catching up does not replay the operations buffered until now
+        catchup.flush()
+        batcher.flush()
+        last_seq = batcher.last_seq if batcher.last_seq is not None else catchup.last_seq
+        if last_seq is not None:
+            save_cursor(name, last_seq)
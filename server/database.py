@@ -5,30 +5,26 @@ import peewee
 import time
 
 import numpy as np
-from server.config import DEFAULT_DID, DB_RECORD_TTL, DB_THREAD_HYSTERESIS
+from playhouse.migrate import SchemaMigrator, migrate
+from server.config import (ACCEPTED_FILTER_CAPACITY, ACCEPTED_FILTER_ENABLED, ACCEPTED_FILTER_FPR,
+                           DATABASE_URL, DB_RECORD_TTL, DB_THREAD_HYSTERESIS, FEED_NAME, VECTOR_STORAGE)
+from server import config, memory, metrics, vector_codec
+from server.bloom import RotatingBloomFilter
 from server.logger import setup_logger
+from server.storage import backend_from_url
 
 logger = setup_logger(__name__)
 
-db = peewee.SqliteDatabase('feed_database.db')
-
-# Ensure WAL mode is enabled after connecting
-@db.connection_context()
-def configure_sqlite():
-    journal_mode = db.execute_sql("PRAGMA journal_mode=WAL;").fetchone()[0]
-    db.execute_sql("PRAGMA synchronous = NORMAL;")   # Less fsync = faster writes
-    db.execute_sql("PRAGMA cache_size = -10000;")    # ~10MB cache (in KB if negative)
-
-    logger.debug(f"SQLite PRAGMA settings: journal_mode={journal_mode}, synchronous=NORMAL, cache_size=-10000")
-
-configure_sqlite()
+backend = backend_from_url(DATABASE_URL)
+db = backend.database
 
 class BaseModel(peewee.Model):
     class Meta:
         database = db
 
 class Post(BaseModel):
-    uri = peewee.CharField(index=True)
+    feed = peewee.CharField(default=FEED_NAME)  # record name of the feed the post was accepted into
+    uri = peewee.CharField()
     cid = peewee.CharField()
     reply_parent = peewee.CharField(null=True, default=None)
     reply_root = peewee.CharField(null=True, default=None)
@@ -37,6 +33,10 @@ class Post(BaseModel):
         formats=["%Y-%m-%d %H:%M:%S.%f%z", "%Y-%m-%d %H:%M:%S%z"],
     )
 
+    class Meta:
+        # A post can be in several feeds, once in each
+        indexes = ((('feed', 'uri'), True),)
+
 class SubscriptionState(BaseModel):
     service = peewee.CharField(unique=True)
     cursor = peewee.BigIntegerField()
@@ -44,43 +44,265 @@ class SubscriptionState(BaseModel):
 class UserLists(BaseModel):
     did = peewee.CharField(index=True)
     white_list_text = peewee.TextField(null=True)
+    white_list_words = peewee.TextField(null=True)  # JSON list, keeps multi-word phrases intact
     white_list_urls = peewee.TextField(null=True)
     white_list_vector = peewee.BlobField(null=True)
     white_list_dim = peewee.IntegerField(null=True)
     black_list_text = peewee.TextField(null=True)
+    black_list_words = peewee.TextField(null=True)
     black_list_urls = peewee.TextField(null=True)
     black_list_vector = peewee.BlobField(null=True)
     black_list_dim = peewee.IntegerField(null=True)
+    vectors_normalized = peewee.BooleanField(default=False)  # list vectors stored with unit length
     modified_at = peewee.DateTimeField(default=lambda: datetime.now(timezone.utc))
 
-if db.is_closed():
-    db.connect()
-    # Drop only the specified tables
-    db.drop_tables([SubscriptionState, Post])  # Drop in reverse dependency order
-    db.create_tables([Post, SubscriptionState, UserLists])
+class PageCache(BaseModel):
+    # Cleaned text and embedding of a list URL, reused while the page content is unchanged
+    url = peewee.TextField(unique=True)
+    content_hash = peewee.CharField()
+    text = peewee.TextField()
+    vector = peewee.BlobField(null=True)  # vector_codec format; null when the page has too little text
+    model = peewee.CharField()
+    fetched_at = peewee.FloatField(default=time.time)  # epoch seconds, compared the same way on every backend
+
+class SchemaVersion(BaseModel):
+    version = peewee.IntegerField(unique=True)
+    applied_at = peewee.DateTimeField(default=lambda: datetime.now(timezone.utc))
+
+# ───────────────────────────────────────────────────────
+# Schema migrations
+#
+# Each migration runs exactly once, in order, and is recorded in the
+# SchemaVersion table. Add new migrations to the end of MIGRATIONS; never
+# edit one that has already shipped.
+# ───────────────────────────────────────────────────────
+
+def _migrate_v1_initial_schema(writer: peewee.Database):
+    # Databases created before schema versioning dropped the Post table on
+    # every start, so its contents are disposable; recreate it with a unique
+    # uri so that replaying the firehose from a stored cursor is idempotent.
+    writer.drop_tables([Post], safe=True)
+    writer.create_tables([Post, SubscriptionState, UserLists], safe=True)
+
+def _migrate_v2_feed_indexes(writer: peewee.Database):
+    backend.create_indexes(Post)
+
+def _migrate_v3_user_list_words(writer: peewee.Database):
+    # The keyword lists as entered; *_list_text joins them with spaces, which
+    # loses where one phrase ends and the next begins. Rows saved before this
+    # migration fall back to splitting the text. Tables created by v1 on a
+    # fresh database already have the columns.
+    table = UserLists._meta.table_name
+    existing = {column.name for column in writer.get_columns(table)}
+    migrator = SchemaMigrator.from_database(writer)
+    operations = [migrator.add_column(table, field.column_name, field)
+                  for field in (UserLists.white_list_words, UserLists.black_list_words)
+                  if field.column_name not in existing]
+    if operations:
+        migrate(*operations)
+
+def _migrate_v4_normalized_vectors(writer: peewee.Database):
+    # List vectors saved from now on are L2-normalized. Older rows keep their
+    # vectors and the False flag, and are normalized when they are loaded.
+    table = UserLists._meta.table_name
+    if UserLists.vectors_normalized.column_name not in {column.name for column in writer.get_columns(table)}:
+        migrator = SchemaMigrator.from_database(writer)
+        migrate(migrator.add_column(table, UserLists.vectors_normalized.column_name, UserLists.vectors_normalized))
+
+def _migrate_v5_packed_vectors(writer: peewee.Database):
+    # List vectors get a header saying how they are stored (vector_codec) and
+    # are rewritten, normalized, in the VECTOR_STORAGE format. *_dim stays.
+    rows = (UserLists
+            .select(UserLists.id, UserLists.vectors_normalized,
+                    UserLists.white_list_vector, UserLists.white_list_dim,
+                    UserLists.black_list_vector, UserLists.black_list_dim)
+            .tuples()
+            .execute(writer))
+    for row_id, normalized, *vectors in rows:
+        update = {}
+        for field, (blob, dim) in zip((UserLists.white_list_vector, UserLists.black_list_vector),
+                                      (vectors[0:2], vectors[2:4])):
+            if not blob or not dim or vector_codec.has_header(blob):
+                continue
+            vector = vector_codec.unpack_vector(blob, dim)
+            norm = np.linalg.norm(vector)
+            if not normalized and norm > 0:
+                vector = vector / norm
+            update[field] = vector_codec.pack_vector(vector, VECTOR_STORAGE, normalized=True)
+        if update:
+            update[UserLists.vectors_normalized] = True
+            UserLists.update(update).where(UserLists.id == row_id).execute(writer)
+
+def _migrate_v6_page_cache(writer: peewee.Database):
+    writer.create_tables([PageCache], safe=True)
+
+def _migrate_v7_feed_column(writer: peewee.Database):
+    # Several feeds are served from one ingest pass, so Post rows are keyed
+    # by (feed, uri). Rows stored so far belong to FEED_URI's feed.
+    table = Post._meta.table_name
+    if Post.feed.column_name not in {column.name for column in writer.get_columns(table)}:
+        migrator = SchemaMigrator.from_database(writer)
+        migrate(migrator.add_column(table, Post.feed.column_name, Post.feed))
+    writer.execute_sql('DROP INDEX IF EXISTS post_uri')
+    writer.execute_sql(f'CREATE UNIQUE INDEX IF NOT EXISTS post_feed_uri ON "{table}" (feed, uri)')
+    backend.create_indexes(Post)
+
+MIGRATIONS = [
+    (1, _migrate_v1_initial_schema),
+    (2, _migrate_v2_feed_indexes),
+    (3, _migrate_v3_user_list_words),
+    (4, _migrate_v4_normalized_vectors),
+    (5, _migrate_v5_packed_vectors),
+    (6, _migrate_v6_page_cache),
+    (7, _migrate_v7_feed_column),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def get_schema_version() -> int:
+    return SchemaVersion.select(peewee.fn.MAX(SchemaVersion.version)).scalar() or 0
+
+def initialize_database():
+    """Create missing tables and apply pending migrations, keeping existing data."""
+    # Models read through the reader pool by default; point them at the writer
+    # while the schema is being changed.
+    with backend.writer.bind_ctx([Post, SubscriptionState, UserLists, PageCache, SchemaVersion]):
+        with backend.write() as writer:
+            writer.create_tables([SchemaVersion], safe=True)
+            current = get_schema_version()
+        for version, migration in MIGRATIONS:
+            if version <= current:
+                continue
+            with backend.write() as writer:
+                migration(writer)
+                SchemaVersion.create(version=version)
+            logger.info(f"🗄️ Applied schema migration v{version} ({migration.__name__})")
+
+def check_schema():
+    """For processes that do not migrate: fail fast unless the schema is the one this code expects."""
+    current = get_schema_version() if SchemaVersion.table_exists() else 0
+    if current != SCHEMA_VERSION:
+        raise RuntimeError(f"Database schema is at v{current}, not v{SCHEMA_VERSION}: start the ingest "
+                           f"role (or run with DB_MIGRATE=true) to migrate it before serving")
+
+backend.configure()
+# Read from the module rather than imported, so the serve role can turn it off before importing us
+if config.DB_MIGRATE:
+    initialize_database()
+else:
+    check_schema()
+metrics.register_collector('storage', backend.stats)
+
+def save_cursor(service: str, cursor: int) -> None:
+    """Store the firehose cursor for a service, creating its row on first use."""
+    with backend.write() as writer:
+        (SubscriptionState
+         .insert(service=service, cursor=cursor)
+         .on_conflict(conflict_target=[SubscriptionState.service],
+                      update={SubscriptionState.cursor: cursor})
+         .execute(writer))
+
+# URIs written to the Post table. A row can outlive its TTL by up to one
+# cleanup interval, so the filter keeps URIs for two TTLs plus the hysteresis.
+# It is built from the table by load_accepted_uris() when ingestion starts, so
+# posts from before a restart count; until then every delete is sent through.
+accepted_uris = None
+_delete_stats = {"checked": 0, "skipped": 0, "false_positives": 0, "queries": 0, "queries_saved": 0}
+
+def load_accepted_uris() -> None:
+    """
+    Build accepted_uris from the URIs in the Post table, sized for
+    ACCEPTED_FILTER_CAPACITY or the rows already stored, whichever is more.
+    """
+    global accepted_uris
+    if not ACCEPTED_FILTER_ENABLED:
+        return
+    started = time.time()
+    stored = Post.select().count()
+    bloom = RotatingBloomFilter(2 * DB_RECORD_TTL + DB_THREAD_HYSTERESIS, max(ACCEPTED_FILTER_CAPACITY, stored),
+                                ACCEPTED_FILTER_FPR)
+    bloom.add_many(uri for (uri,) in Post.select(Post.uri).tuples().iterator())
+    accepted_uris = bloom
+    memory.budget.register_fixed('accepted_uris', bloom.stats()["bytes"])
+    logger.info(f"🧮 Loaded {stored} stored URIs into the accepted-URI filter in {time.time() - started:.2f}s")
+
+def insert_posts(rows: list[dict]) -> None:
+    """Add accepted posts to the feed using the backend's bulk ingest path."""
+    backend.insert_posts(Post, rows)
+    if accepted_uris is not None:
+        accepted_uris.add_many(row['uri'] for row in rows)
+
+def delete_posts(uris: list[str], feed: str = None, chunk_size: int = 500) -> int:
+    """Remove posts by URI from one feed, or from every feed, and return how many rows were deleted."""
+    deleted = 0
+    with backend.write() as writer:
+        # Chunked to stay under SQLite's bound parameter limit
+        for start in range(0, len(uris), chunk_size):
+            condition = Post.uri.in_(uris[start:start + chunk_size])
+            if feed is not None:
+                condition &= Post.feed == feed
+            deleted += Post.delete().where(condition).execute(writer)
+    return deleted
+
+def delete_accepted_posts(uris: list[str], chunk_size: int = 500) -> int:
+    """
+    delete_posts for firehose deletes: URIs that were never written to the
+    Post table, per accepted_uris, are dropped without a query.
+    """
+    if accepted_uris is None:
+        return delete_posts(uris, chunk_size=chunk_size)
+
+    candidates = [uri for uri, present in zip(uris, accepted_uris.might_contain(uris)) if present]
+    queries = -(-len(candidates) // chunk_size)
+    _delete_stats["checked"] += len(uris)
+    _delete_stats["skipped"] += len(uris) - len(candidates)
+    _delete_stats["queries"] += queries
+    _delete_stats["queries_saved"] += -(-len(uris) // chunk_size) - queries
+    metrics.increment('deletes.skipped', len(uris) - len(candidates))
+    if not candidates:
+        return 0
+    deleted = delete_posts(candidates, chunk_size=chunk_size)
+    # An estimate: posts that expired since count as misses, and a post stored for several feeds hides one
+    _delete_stats["false_positives"] += max(len(candidates) - deleted, 0)
+    return deleted
+
+def delete_stats() -> dict:
+    """Firehose deletes checked against accepted_uris, and how well the filter did."""
+    stats = dict(_delete_stats)
+    negatives = stats["skipped"] + stats["false_positives"]
+    stats["observed_fpr"] = round(stats["false_positives"] / negatives, 6) if negatives else 0.0
+    if accepted_uris is not None:
+        stats.update(filter=accepted_uris.stats())
+    return stats
+
+metrics.register_collector('deletes', delete_stats)
 
 def fetch_user_lists_fields(did: str) -> tuple[str, np.ndarray, int, str, np.ndarray, int]:
     try:
-        row = UserLists.get_or_none(UserLists.did == DEFAULT_DID)
+        row = UserLists.get_or_none(UserLists.did == did)
     except UserLists.DoesNotExist:
-        logger.error(f'🚫 ERROR! white and black lists do not exist for user {user_did} !!!')
+        row = None
+    if row is None:
+        logger.error(f'🚫 ERROR! white and black lists do not exist for user {did} !!!')
         return None
-    white_vec = np.frombuffer(row.white_list_vector, dtype=np.float32, count=row.white_list_dim)
-    black_vec = np.frombuffer(row.black_list_vector, dtype=np.float32, count=row.black_list_dim)
+    white_vec = vector_codec.unpack_vector(row.white_list_vector, row.white_list_dim)
+    black_vec = vector_codec.unpack_vector(row.black_list_vector, row.black_list_dim)
     return row.white_list_text, white_vec, row.white_list_dim, row.black_list_text, black_vec, row.black_list_dim
 
+def delete_expired_posts(ttl_seconds: int = DB_RECORD_TTL) -> int:
+    """Remove Post rows older than the TTL window and return how many were deleted."""
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=ttl_seconds)
+    # A range delete served by the indexed_at index
+    with backend.write() as writer:
+        return Post.delete().where(Post.indexed_at < cutoff).execute(writer)
+
 def cleanup_expired_posts(ttl_seconds: int=DB_RECORD_TTL, hysteresis_seconds: int = DB_THREAD_HYSTERESIS):
     """Background task that removes expired Post row entries based on TTL."""
     while True:
-        now = datetime.now(timezone.utc)
-        cutoff = now - timedelta(seconds=ttl_seconds)
-
-        # Delete expired posts
-        expired_posts = Post.select().where(Post.indexed_at < cutoff)
-        expired_post_ids = [post.id for post in expired_posts]
-        if expired_post_ids:
-            Post.delete().where(Post.id.in_(expired_post_ids)).execute()
-            logger.info(f"[TTL Cleanup] Deleted {len(expired_post_ids)} expired posts at {datetime.now(timezone.utc)}")
+        deleted = delete_expired_posts(ttl_seconds)
+        if deleted:
+            logger.info(f"[TTL Cleanup] Deleted {deleted} expired posts at {datetime.now(timezone.utc)}")
+        backend.checkpoint()
 
         # Sleep before next run
-        time.sleep(ttl_seconds + hysteresis_seconds)
\ No newline at end of file
+        time.sleep(ttl_seconds + hysteresis_seconds)
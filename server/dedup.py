@@ -0,0 +1,196 @@
+# server/dedup.py
+#
+# Duplicate detection for spam waves and copy-paste campaigns. Posts are
+# fingerprinted from their own text plus cheap embed fields (alt text, link
+# title and description; URLs are dropped and nothing is fetched) before any
+# cleaning or model work. An exact hash catches identical copies and a 64-bit
+# SimHash catches copies with small edits. A copy reuses the decision made
+# for the first one.
+#
+# Fingerprints are kept for DEDUP_WINDOW seconds, and at most
+# DEDUP_MAX_ENTRIES of them, so memory stays bounded whatever the firehose
+# throws at it.
+import hashlib
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from server import config, memory, metrics
+
+# Per entry beyond the preallocated slots: exact key, URI and the dict entry
+_ENTRY_BYTES = 280
+
+_URL_RE = re.compile(r"https?://\S+|www\.\S+")
+_NON_WORD_RE = re.compile(r"[^\w\s]")
+
+if hasattr(np, "bitwise_count"):
+    _popcount = np.bitwise_count
+else:
+    _POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def _popcount(values: np.ndarray) -> np.ndarray:
+        return _POPCOUNT_TABLE[values.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+class Fingerprint:
+    __slots__ = ('exact', 'simhash')
+
+    def __init__(self, exact: bytes, simhash: int):
+        self.exact = exact
+        self.simhash = simhash
+
+
+def _embed_text(embed) -> List[str]:
+    """Alt text and link card text of a raw embed, uncleaned and without fetching."""
+    if not isinstance(embed, dict):
+        return []
+    embed_type = embed.get("$type")
+    if embed_type == "app.bsky.embed.images":
+        return [image.get("alt") or "" for image in embed.get("images") or [] if isinstance(image, dict)]
+    if embed_type == "app.bsky.embed.external":
+        external = embed.get("external") or {}
+        return [external.get("title") or "", external.get("description") or ""] if isinstance(external, dict) else []
+    if embed_type == "app.bsky.embed.recordWithMedia":
+        return _embed_text(embed.get("media"))
+    return []
+
+
+def normalize(text: str) -> str:
+    """Lowercase, drop URLs and punctuation, collapse whitespace."""
+    text = _URL_RE.sub(" ", text.casefold())
+    return " ".join(_NON_WORD_RE.sub(" ", text).split())
+
+
+def simhash(tokens: List[str]) -> int:
+    """
+    64-bit SimHash over words. Shingles would be the usual choice for
+    documents, but posts are so short that one edited word changes most of
+    the bits a shingled hash has.
+    """
+    digests = b"".join(hashlib.blake2b(token.encode(), digest_size=8).digest() for token in tokens)
+    bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8).reshape(-1, 8), axis=1)
+    majority = bits.sum(axis=0) * 2 > len(tokens)
+    return int.from_bytes(np.packbits(majority).tobytes(), "big")
+
+
+def fingerprint(post) -> Optional[Fingerprint]:
+    """Fingerprint of a PostRecord, or None when its text is too short to say anything."""
+    text = normalize(" ".join([post.text, *_embed_text(post.embed)]))
+    if len(text) < config.DEDUP_MIN_LENGTH:
+        return None
+    exact = hashlib.blake2b(text.encode(), digest_size=16).digest()
+    return Fingerprint(exact, simhash(text.split()))
+
+
+class DedupIndex:
+    """
+    Sliding window of recent fingerprints and the decisions made for them,
+    in a ring of max_entries slots. Exact copies are a dict lookup; near
+    copies are found by one vectorized Hamming distance over every SimHash in
+    the ring. Entries older than the window are released as soon as the
+    index is touched, and the ring overwrites the oldest entry when full.
+    """
+
+    def __init__(self, window: float = None, max_entries: int = None, max_distance: int = None):
+        self.window = config.DEDUP_WINDOW if window is None else window
+        self.max_entries = config.DEDUP_MAX_ENTRIES if max_entries is None else max_entries
+        self.max_distance = config.DEDUP_MAX_DISTANCE if max_distance is None else max_distance
+        self._simhashes = np.zeros(self.max_entries, dtype=np.uint64)
+        self._seen_at = np.full(self.max_entries, -np.inf)
+        self._exact_keys: List[Optional[bytes]] = [None] * self.max_entries
+        self._decisions: List[Optional[str]] = [None] * self.max_entries
+        self._uris: List[Optional[str]] = [None] * self.max_entries
+        self._exact: Dict[bytes, int] = {}
+        self._oldest = 0  # ring positions: entries live in [oldest, oldest + count)
+        self._count = 0
+        self._scope = None
+        self.last_used = time.monotonic()
+        self._lock = threading.Lock()
+
+    def bind(self, scope) -> None:
+        """Forget every decision when what they were made against (e.g. the user's lists) changes."""
+        with self._lock:
+            if scope != self._scope:
+                self._scope = scope
+                while self._count:
+                    self._release_oldest()
+                metrics.set_gauge('dedup.entries', 0)
+
+    def match(self, fp: Fingerprint) -> Tuple[Optional[str], Optional[str]]:
+        """(decision, first uri) of an earlier copy inside the window, or (None, None)."""
+        with self._lock:
+            self.last_used = time.monotonic()
+            self._evict(self.last_used)
+            if not self._count:
+                return None, None
+
+            slot = self._exact.get(fp.exact)
+            if slot is not None:
+                metrics.increment('dedup.exact_hits')
+                return self._decisions[slot], self._uris[slot]
+
+            if self.max_distance > 0:
+                distances = _popcount(self._simhashes ^ np.uint64(fp.simhash))
+                # Released slots have seen_at = -inf
+                distances[self._seen_at == -np.inf] = 64
+                slot = int(np.argmin(distances))
+                if distances[slot] <= self.max_distance:
+                    metrics.increment('dedup.near_hits')
+                    return self._decisions[slot], self._uris[slot]
+            return None, None
+
+    def add(self, fp: Fingerprint, decision: str, uri: str) -> None:
+        with self._lock:
+            self.last_used = time.monotonic()
+            self._evict(self.last_used)
+            if self._count == self.max_entries:
+                self._release_oldest()
+            slot = (self._oldest + self._count) % self.max_entries
+            self._count += 1
+            self._simhashes[slot] = fp.simhash
+            self._seen_at[slot] = time.monotonic()
+            self._exact_keys[slot] = fp.exact
+            self._decisions[slot] = decision
+            self._uris[slot] = uri
+            self._exact.setdefault(fp.exact, slot)
+            metrics.set_gauge('dedup.entries', self._count)
+
+    def memory_bytes(self) -> int:
+        # SimHash and timestamp arrays plus three lists of pointers per slot
+        return self.max_entries * 40 + self._count * _ENTRY_BYTES
+
+    def shrink(self, nbytes: int) -> int:
+        """Release the oldest entries until about nbytes are freed (see server.memory)."""
+        with self._lock:
+            released = min(self._count, -(-nbytes // _ENTRY_BYTES))
+            for _ in range(released):
+                self._release_oldest()
+            metrics.set_gauge('dedup.entries', self._count)
+            return released * _ENTRY_BYTES
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _evict(self, now: float) -> None:
+        evicted = False
+        while self._count and now - self._seen_at[self._oldest] > self.window:
+            self._release_oldest()
+            evicted = True
+        if evicted:
+            metrics.set_gauge('dedup.entries', self._count)
+
+    def _release_oldest(self) -> None:
+        slot = self._oldest
+        if self._exact.get(self._exact_keys[slot]) == slot:
+            del self._exact[self._exact_keys[slot]]
+        self._seen_at[slot] = -np.inf
+        self._exact_keys[slot] = self._decisions[slot] = self._uris[slot] = None
+        self._oldest = (slot + 1) % self.max_entries
+        self._count -= 1
+
+
+index = DedupIndex()
+memory.budget.register('dedup', index, cost=1.0)
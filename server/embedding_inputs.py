@@ -0,0 +1,126 @@
+# server/embedding_inputs.py
+#
+# Builds the text the model embeds for a post from its sources, in priority
+# order: the post text, then alt and link card text, then the linked page.
+# The model only reads its first max_seq_length tokens, so rather than let a
+# long alt text or page push everything after it off the end, each source is
+# capped at its EMBED_TOKEN_BUDGETS share and the sources are truncated to
+# fit, in order. With EMBED_CHUNK_PAGES the rest of a long page is embedded
+# in extra chunks whose mean is pooled with the post's own vector.
+#
+# All texts of a batch, chunks included, go to the model in one call;
+# SentenceTransformer.encode sorts them by length before splitting them into
+# batches, so short posts are not padded to the length of a page.
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from server import config, metrics
+from server.vector import get_tokenizer, max_tokens, normalize_vectors, strings_to_vectors
+
+SOURCES = ("post", "alt", "page")
+
+# Rough wordpiece tokens per cleaned word, when no fast tokenizer is available
+_TOKENS_PER_WORD = 1.3
+
+
+class TokenCounter:
+    """Counts and cuts text in model tokens, or estimates them from words without a fast tokenizer."""
+
+    def __init__(self, tokenizer=None):
+        self.tokenizer = tokenizer if getattr(tokenizer, "is_fast", False) else None
+
+    def split(self, text: str, limit: int) -> Tuple[str, str, int]:
+        """(first `limit` tokens of text, the rest, tokens kept)."""
+        if not text or limit <= 0:
+            return "", text or "", 0
+        if self.tokenizer is None:
+            words = text.split()
+            keep = int(limit / _TOKENS_PER_WORD)
+            return " ".join(words[:keep]), " ".join(words[keep:]), min(int(len(words) * _TOKENS_PER_WORD + 0.5), limit)
+        offsets = self.tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)["offset_mapping"]
+        if len(offsets) <= limit:
+            return text, "", len(offsets)
+        cut = offsets[limit - 1][1]
+        return text[:cut], text[cut:].strip(), limit
+
+
+def parse_budgets(spec: str) -> Dict[str, int]:
+    """"post:128,alt:48,page:128" -> {"post": 128, "alt": 48, "page": 128}; unnamed sources are unlimited."""
+    budgets = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        source, _, tokens = item.partition(":")
+        if source.strip() not in SOURCES:
+            raise ValueError(f"unknown embedding source {source!r} (expected one of {', '.join(SOURCES)})")
+        budgets[source.strip()] = int(tokens)
+    return budgets
+
+
+def build_inputs(posts: List[Dict[str, str]],
+                 budgets: Dict[str, int] = None,
+                 chunk_pages: bool = None,
+                 max_chunks: int = None,
+                 counter: Optional[TokenCounter] = None,
+                 limit: int = None) -> Tuple[List[str], List[int]]:
+    """
+    Texts to embed for posts given as {"post": ..., "alt": ..., "page": ...}
+    cleaned text, and the index of the post each text belongs to. A post's
+    own text comes first, followed by any page chunks.
+    """
+    budgets = parse_budgets(config.EMBED_TOKEN_BUDGETS) if budgets is None else budgets
+    chunk_pages = config.EMBED_CHUNK_PAGES if chunk_pages is None else chunk_pages
+    max_chunks = config.EMBED_MAX_CHUNKS if max_chunks is None else max_chunks
+    counter = counter or TokenCounter(get_tokenizer())
+    # Room left once the model adds its [CLS] and [SEP] tokens
+    limit = (limit or max_tokens()) - 2
+
+    texts, owners, truncated = [], [], 0
+    for index, sources in enumerate(posts):
+        remaining, parts, overflow = limit, [], ""
+        for source in SOURCES:
+            kept, rest, used = counter.split(sources.get(source) or "", min(budgets.get(source, limit), remaining))
+            if kept:
+                parts.append(kept)
+            remaining -= used
+            if rest:
+                truncated += 1
+                if source == "page":
+                    overflow = rest
+        texts.append(" ".join(parts))
+        owners.append(index)
+
+        for _ in range(max_chunks if chunk_pages else 0):
+            if not overflow:
+                break
+            chunk, overflow, _ = counter.split(overflow, limit)
+            texts.append(chunk)
+            owners.append(index)
+
+    if truncated:
+        metrics.increment('embedding.sources_truncated', truncated)
+    return texts, owners
+
+
+def embed_posts(posts: List[Dict[str, str]], **options) -> np.ndarray:
+    """
+    One unit-length vector per post. A post with page chunks gets its own
+    vector plus the mean of its chunk vectors, so the post text and alt text
+    keep at least half the weight however long the page is.
+    """
+    if not posts:
+        return np.zeros((0, 0), dtype=np.float32)
+    texts, owners = build_inputs(posts, **options)
+    vectors = strings_to_vectors(texts)
+    if len(texts) == len(posts):
+        return vectors
+
+    owners = np.asarray(owners)
+    heads = np.searchsorted(owners, np.arange(len(posts)))
+    pooled = vectors[heads].copy()
+    chunk_rows = np.setdiff1d(np.arange(len(texts)), heads)
+    if len(chunk_rows):
+        sums = np.zeros_like(pooled)
+        np.add.at(sums, owners[chunk_rows], vectors[chunk_rows])
+        counts = np.bincount(owners[chunk_rows], minlength=len(posts))[:, None]
+        pooled += np.divide(sums, counts, out=np.zeros_like(sums), where=counts > 0)
+    return normalize_vectors(pooled)
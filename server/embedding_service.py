@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+#
+# embedding_service.py
+#
+# Local embedding service: one process holds the SentenceTransformer and
+# answers encode requests from every other process over a Unix socket, so
+# the feed server, ingest workers, classify/sweep runs and the list tool do
+# not each load their own copy of the model.
+#
+# $ python -m server.embedding_service --socket /tmp/feed-embeddings.sock
+#
+# and set EMBEDDING_SOCKET to the same path for the clients. Requests that
+# arrive close together are coalesced into one model call: a batch is run
+# once it holds --max-batch texts or --max-wait-ms after its first request
+# arrived, whichever comes first. server.vector falls back to loading the
+# model in-process when the socket is not configured or not answering.
+#
+# Wire format, both directions: a 4-byte big-endian length and a JSON header,
+# then a 4-byte length and a binary body. Encode requests carry the texts in
+# the header; responses carry count and dim in the header and the float32
+# matrix as the body.
+#
+import argparse
+import json
+import os
+import queue
+import signal
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+from typing import List, Tuple
+
+import numpy as np
+
+from server import config
+from server.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+_LENGTH = struct.Struct("!I")
+
+
+class EmbeddingServiceError(Exception):
+    """The service answered with an error or an unreadable response."""
+
+
+def _send(sock: socket.socket, header: dict, body: bytes = b"") -> None:
+    payload = json.dumps(header).encode("utf-8")
+    sock.sendall(_LENGTH.pack(len(payload)) + payload + _LENGTH.pack(len(body)) + body)
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    chunks, remaining = [], size
+    while remaining:
+        chunk = sock.recv(min(remaining, 1 << 20))
+        if not chunk:
+            raise ConnectionError("embedding service connection closed")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
+
+
+def _recv(sock: socket.socket) -> Tuple[dict, bytes]:
+    header = json.loads(_recv_exact(sock, _LENGTH.unpack(_recv_exact(sock, _LENGTH.size))[0]))
+    body = _recv_exact(sock, _LENGTH.unpack(_recv_exact(sock, _LENGTH.size))[0])
+    return header, body
+
+
+# ───────────────────────────────────────────────────────
+# Client
+# ───────────────────────────────────────────────────────
+
+class EmbeddingClient:
+    """Thread-safe client; each thread keeps its own connection to the service."""
+
+    def __init__(self, path: str, timeout: float = None):
+        self.path = path
+        self.timeout = config.EMBEDDING_TIMEOUT if timeout is None else timeout
+        self._local = threading.local()
+
+    def _connection(self) -> socket.socket:
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.path)
+            except OSError:
+                sock.close()
+                raise
+            self._local.sock = sock
+        return sock
+
+    def _call(self, header: dict) -> Tuple[dict, bytes]:
+        # A connection the service dropped (e.g. after a restart) is retried once
+        for attempt in (1, 2):
+            sock = self._connection()
+            try:
+                _send(sock, header)
+                response, body = _recv(sock)
+                break
+            except (ConnectionError, BrokenPipeError):
+                self.close()
+                if attempt == 2:
+                    raise
+            except OSError:
+                self.close()
+                raise
+        if "error" in response:
+            raise EmbeddingServiceError(response["error"])
+        return response, body
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """(len(texts), dim) float32 matrix, as SentenceTransformer.encode returns for a list."""
+        response, body = self._call({"op": "encode", "texts": list(texts)})
+        try:
+            return np.frombuffer(body, dtype=np.float32).reshape(response["count"], response["dim"])
+        except (KeyError, ValueError) as e:
+            raise EmbeddingServiceError(f"malformed response: {e}") from e
+
+    def stats(self) -> dict:
+        return self._call({"op": "stats"})[0]
+
+    def close(self) -> None:
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            sock.close()
+            self._local.sock = None
+
+
+# ───────────────────────────────────────────────────────
+# Service
+# ───────────────────────────────────────────────────────
+
+class _Request:
+    __slots__ = ("texts", "arrived", "done", "result", "error")
+
+    def __init__(self, texts: List[str]):
+        self.texts = texts
+        self.arrived = time.monotonic()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class DynamicBatcher:
+    """
+    Runs queued encode requests through the model in batches. A batch closes
+    when it holds max_batch texts or max_wait seconds after its first request
+    arrived, so a lone request waits at most max_wait for company.
+    """
+
+    def __init__(self, encode, max_batch: int, max_wait: float):
+        self.encode = encode
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._requests = self._texts = self._batches = self._largest = 0
+        self._queue_seconds = self._encode_seconds = 0.0
+        self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, texts: List[str]) -> np.ndarray:
+        request = _Request(texts)
+        self._queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            size = len(batch[0].texts)
+            deadline = batch[0].arrived + self.max_wait
+            while size < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(request)
+                size += len(request.texts)
+            self._encode_batch(batch, size)
+
+    def _encode_batch(self, batch: List[_Request], size: int) -> None:
+        started = time.monotonic()
+        try:
+            vectors = self.encode([text for request in batch for text in request.texts])
+        except Exception as e:
+            logger.error(f"Embedding batch of {size} texts failed: {e}")
+            for request in batch:
+                request.error = e
+                request.done.set()
+            return
+
+        elapsed = time.monotonic() - started
+        offset = 0
+        for request in batch:
+            request.result = vectors[offset:offset + len(request.texts)]
+            offset += len(request.texts)
+            request.done.set()
+
+        with self._stats_lock:
+            self._requests += len(batch)
+            self._texts += size
+            self._batches += 1
+            self._largest = max(self._largest, size)
+            self._queue_seconds += sum(started - request.arrived for request in batch)
+            self._encode_seconds += elapsed
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            batches = max(self._batches, 1)
+            requests = max(self._requests, 1)
+            return {
+                "requests": self._requests,
+                "texts": self._texts,
+                "batches": self._batches,
+                "mean_batch_size": round(self._texts / batches, 2),
+                "largest_batch": self._largest,
+                "mean_queue_ms": round(self._queue_seconds / requests * 1000, 3),
+                "mean_encode_ms": round(self._encode_seconds / batches * 1000, 3),
+                "queued": self._queue.qsize(),
+            }
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self) -> None:
+        batcher: DynamicBatcher = self.server.batcher
+        while True:
+            try:
+                header, _ = _recv(self.request)
+            except (ConnectionError, OSError, ValueError):
+                return
+            try:
+                if header.get("op") == "encode":
+                    vectors = np.ascontiguousarray(batcher.submit(header.get("texts") or []), dtype=np.float32)
+                    _send(self.request, {"count": int(vectors.shape[0]),
+                                         "dim": int(vectors.shape[1]) if vectors.ndim == 2 else 0},
+                          vectors.tobytes())
+                elif header.get("op") == "stats":
+                    _send(self.request, batcher.stats())
+                else:
+                    _send(self.request, {"error": f"unknown op {header.get('op')!r}"})
+            except OSError:
+                return
+            except Exception as e:
+                _send(self.request, {"error": str(e)})
+
+
+class EmbeddingServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+    # Unix sockets refuse connections (EAGAIN) beyond the listen backlog, and every client thread connects
+    request_queue_size = 128
+
+    def __init__(self, path: str, batcher: DynamicBatcher):
+        # A socket file left behind by a previous run would make bind fail
+        if os.path.exists(path):
+            os.unlink(path)
+        self.batcher = batcher
+        super().__init__(path, _Handler)
+
+
+def model_encoder(batch_size: int):
+    """Encode function backed by the in-process model; only the service itself uses this."""
+    from server.vector import get_model
+
+    model = get_model()
+
+    def encode(texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, model.get_sentence_embedding_dimension() or 0), dtype=np.float32)
+        return model.encode(texts, batch_size=batch_size, show_progress_bar=False).astype(np.float32)
+
+    return encode
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve batched sentence embeddings over a Unix socket.")
+    parser.add_argument("--socket", default=config.EMBEDDING_SOCKET or "/tmp/feed-embeddings.sock",
+                        help="Unix socket path (default: EMBEDDING_SOCKET or /tmp/feed-embeddings.sock)")
+    parser.add_argument("--max-batch", type=int, default=config.EMBEDDING_MAX_BATCH,
+                        help=f"Texts per model call (default: {config.EMBEDDING_MAX_BATCH})")
+    parser.add_argument("--max-wait-ms", type=float, default=config.EMBEDDING_MAX_WAIT_MS,
+                        help=f"Longest a request waits for a batch to fill (default: {config.EMBEDDING_MAX_WAIT_MS})")
+    args = parser.parse_args()
+
+    batcher = DynamicBatcher(model_encoder(args.max_batch), max(args.max_batch, 1), max(args.max_wait_ms, 0) / 1000)
+    server = EmbeddingServer(args.socket, batcher)
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown).start())
+    print(f"[embedding_service] {config.MODEL_NAME} listening on {args.socket}", file=sys.stderr, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+        print(f"[embedding_service] stopped: {json.dumps(batcher.stats())}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+# server/feed_window.py
+#
+# Embeddings of every post scored within the feed's TTL window, shown or
+# not, so that a change to the user's lists can be applied to posts already
+# judged. When a feed's lists change (modified_at), the whole window is
+# re-scored for that feed in one vectorized pass against the new list
+# vectors and keywords, and its Post rows are brought in line: posts that now
+# pass are inserted, posts that no longer do are deleted. Nothing is cleaned
+# or embedded again.
+#
+# Vectors are kept int8-quantized by default (see vector_codec), in a
+# memory-mapped file when WINDOW_STORE_PATH is set so they live in the page
+# cache rather than on the heap. Keyword text and row fields stay in memory.
+# The store only covers posts seen since the process started; it is not
+# reloaded on restart.
+import threading
+import time
+from datetime import timezone
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from server import config, memory, metrics
+from server.database import delete_posts, insert_posts
+from server.algos.definitions import FeedDefinition, feeds
+from server.logger import setup_logger
+from server.vector import DECISIONS, keyword_hits, score_batch, score_batch_int8
+from server.vector_codec import quantize_int8
+
+logger = setup_logger(__name__)
+
+# Per post beyond the preallocated slots: its Post row, keyword text and URI
+_ENTRY_BYTES = 1200
+
+
+class WindowStore:
+    """
+    Ring of max_entries slots holding each scored post's vector, cleaned
+    keyword text, Post row and whether it is currently in the feed. Slots
+    older than the window are released as soon as the store is touched, and
+    the ring overwrites the oldest slot when full.
+    """
+
+    def __init__(self, window: float = None, max_entries: int = None,
+                 storage: str = None, path: str = None, definitions: List[FeedDefinition] = None):
+        self.window = config.DB_RECORD_TTL if window is None else window
+        self.max_entries = config.WINDOW_STORE_MAX_POSTS if max_entries is None else max_entries
+        self.storage = config.WINDOW_STORE_STORAGE if storage is None else storage
+        self.path = config.WINDOW_STORE_PATH if path is None else path
+        self.feeds = feeds if definitions is None else definitions
+        self._vectors: Optional[np.ndarray] = None  # allocated on first add, once the dim is known
+        self._scales = np.zeros(self.max_entries, dtype=np.float32)
+        self._indexed_at = np.full(self.max_entries, -np.inf)  # epoch seconds; -inf for released or deleted posts
+        self._shown = np.zeros((self.max_entries, len(self.feeds)), dtype=bool)  # per slot, per feed
+        self._copy = np.zeros(self.max_entries, dtype=bool)
+        self._rows: List[Optional[dict]] = [None] * self.max_entries
+        self._texts: List[Optional[str]] = [None] * self.max_entries
+        self._slots: Dict[str, int] = {}
+        self._oldest = 0  # ring positions: entries live in [oldest, oldest + count)
+        self._count = 0
+        self._scopes = None
+        self.last_used = time.monotonic()
+        self._lock = threading.Lock()
+
+    def bind(self, scopes: tuple, feed_lists: list) -> Dict[str, dict]:
+        """
+        Note the (lists did, modified_at) each feed's next posts are scored
+        against. Every feed whose lists changed since the last call is
+        re-scored against its new lists; returns the re-score stats by feed
+        name.
+        """
+        with self._lock:
+            if scopes == self._scopes:
+                return {}
+            previous, self._scopes = self._scopes, scopes
+            if previous is None:
+                return {}
+            return {definition.name: self._rescore(index, lists)
+                    for index, (definition, old, new, lists) in enumerate(zip(self.feeds, previous, scopes, feed_lists))
+                    if old != new and lists is not None and lists.matrix is not None}
+
+    def add(self, post, vector: Optional[np.ndarray], text: Optional[str],
+            shown: List[bool], first_uri: Optional[str] = None) -> bool:
+        """
+        Keep a scored post and whether it is in each feed. A copy that reused the decision of first_uri
+        (vector None) shares that post's vector and text, and is left out of
+        the feed on re-score when DEDUP_COLLAPSE is set. Returns False when
+        there is nothing to keep (a copy of a post no longer in the window).
+        """
+        with self._lock:
+            self.last_used = time.monotonic()
+            self._evict(time.time())
+            source = None
+            if vector is None:
+                source = self._slots.get(first_uri) if first_uri else None
+                if source is None:
+                    return False
+            elif self._vectors is None:
+                self._allocate(len(vector))
+
+            if self._count == self.max_entries:
+                self._release_oldest()
+                metrics.increment('window.evicted')
+            slot = (self._oldest + self._count) % self.max_entries
+            self._count += 1
+
+            if source is not None:
+                self._vectors[slot] = self._vectors[source]
+                self._scales[slot] = self._scales[source]
+                text = self._texts[source]
+            elif self.storage == "int8":
+                quantized, scales = quantize_int8(vector)
+                self._vectors[slot], self._scales[slot] = quantized[0], scales[0]
+            else:
+                self._vectors[slot] = vector
+
+            row = post.row()
+            indexed_at = row['indexed_at']
+            if indexed_at.tzinfo is None:
+                indexed_at = indexed_at.replace(tzinfo=timezone.utc)
+            self._indexed_at[slot] = indexed_at.timestamp()
+            self._shown[slot] = shown
+            self._copy[slot] = first_uri is not None
+            self._rows[slot] = row
+            self._texts[slot] = text or ""
+            previous = self._slots.get(post.uri)
+            if previous is not None:
+                self._forget(previous)
+            self._slots[post.uri] = slot
+            metrics.set_gauge('window.posts', self._count)
+            return True
+
+    def discard(self, uris: List[str]) -> None:
+        """Drop deleted posts so a re-score cannot bring them back."""
+        with self._lock:
+            for uri in uris:
+                slot = self._slots.pop(uri, None)
+                if slot is not None:
+                    self._forget(slot)
+
+    def rescore(self, index: int, lists) -> dict:
+        """Re-score the window for the feed at index in definitions."""
+        with self._lock:
+            return self._rescore(index, lists)
+
+    def memory_bytes(self) -> int:
+        # Per-slot arrays and list pointers; memory-mapped vectors live in the page cache instead
+        per_slot = 4 + 8 + len(self.feeds) + 1 + 16
+        vectors = self._vectors.nbytes if self._vectors is not None and not self.path else 0
+        return self.max_entries * per_slot + vectors + self._count * _ENTRY_BYTES
+
+    def shrink(self, nbytes: int) -> int:
+        """Release the oldest posts until about nbytes are freed; they are no longer re-scored (see server.memory)."""
+        with self._lock:
+            released = min(self._count, -(-nbytes // _ENTRY_BYTES))
+            for _ in range(released):
+                self._release_oldest()
+            metrics.increment('window.evicted', released)
+            metrics.set_gauge('window.posts', self._count)
+            return released * _ENTRY_BYTES
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _rescore(self, index: int, lists) -> dict:
+        definition = self.feeds[index]
+        started = time.perf_counter()
+        now = time.time()
+        self._evict(now)
+        # Posts replayed from a cursor can expire before older slots of the ring do
+        slots = np.flatnonzero(self._indexed_at >= now - self.window)
+        stats = {"posts": len(slots), "added": 0, "removed": 0}
+        if not len(slots) or lists.matrix is None or self._vectors.shape[1] != lists.matrix.shape[1]:
+            stats["seconds"] = round(time.perf_counter() - started, 3)
+            return stats
+
+        hits = [keyword_hits(self._texts[slot], keyword_matcher=lists.matcher) for slot in slots]
+        white_hit = np.fromiter((bool(hit["white"]) for hit in hits), dtype=bool, count=len(slots))
+        black_hit = np.fromiter((bool(hit["black"]) for hit in hits), dtype=bool, count=len(slots))
+        if self.storage == "int8":
+            matrix, matrix_scales = quantize_int8(lists.matrix)
+            codes = score_batch_int8(self._vectors[slots], self._scales[slots], matrix, matrix_scales,
+                                     white_hit, black_hit, **definition.settings())["decision"]
+        else:
+            codes = score_batch(self._vectors[slots], lists.matrix, white_hit, black_hit,
+                                **definition.settings())["decision"]
+
+        decisions = np.array(DECISIONS)[codes]
+        show = (decisions == "SHOW") | ((decisions == "AMBIGUOUS") & (definition.ambiguous_policy == "SHOW"))
+        if config.DEDUP_COLLAPSE:
+            show &= ~self._copy[slots]
+        shown = self._shown[slots, index]
+        added, removed = slots[show & ~shown], slots[~show & shown]
+
+        if len(added):
+            insert_posts([{**self._rows[slot], 'feed': definition.name} for slot in added])
+        if len(removed):
+            delete_posts([self._rows[slot]['uri'] for slot in removed], feed=definition.name)
+        self._shown[slots, index] = show
+
+        stats.update(added=len(added), removed=len(removed), seconds=round(time.perf_counter() - started, 3))
+        metrics.increment('window.rescores')
+        metrics.increment('window.posts_added', len(added))
+        metrics.increment('window.posts_removed', len(removed))
+        logger.info(f"🔁 Re-scored {stats['posts']} posts in the window against the new lists of {definition.name}: "
+                    f"{stats['added']} added, {stats['removed']} removed in {stats['seconds']}s")
+        return stats
+
+    def _allocate(self, dim: int) -> None:
+        dtype = np.int8 if self.storage == "int8" else np.float32
+        if self.path:
+            self._vectors = np.memmap(self.path, dtype=dtype, mode="w+", shape=(self.max_entries, dim))
+        else:
+            self._vectors = np.zeros((self.max_entries, dim), dtype=dtype)
+
+    def _evict(self, now: float) -> None:
+        cutoff = now - self.window
+        evicted = False
+        while self._count and self._indexed_at[self._oldest] < cutoff:
+            self._release_oldest()
+            evicted = True
+        if evicted:
+            metrics.set_gauge('window.posts', self._count)
+
+    def _forget(self, slot: int) -> None:
+        # The slot stays in the ring until it is the oldest, but is never scored again
+        self._indexed_at[slot] = -np.inf
+        self._shown[slot] = False
+        self._rows[slot] = self._texts[slot] = None
+
+    def _release_oldest(self) -> None:
+        slot = self._oldest
+        row = self._rows[slot]
+        if row is not None and self._slots.get(row['uri']) == slot:
+            del self._slots[row['uri']]
+        self._forget(slot)
+        self._oldest = (slot + 1) % self.max_entries
+        self._count -= 1
+
+window = WindowStore() if config.WINDOW_STORE_ENABLED else None
+if window is not None:
+    memory.budget.register('window', window, cost=3.0)
@@ -0,0 +1,87 @@
+# ingest.py
+#
+# The writer side of the server: the firehose consumer that classifies
+# posts into the feeds, and the TTL cleanup of old posts. Importing this
+# module loads the firehose client and the classifier, so the serve role
+# (server.app) never does. Run on its own, the ingest role publishes its
+# metrics on a small listener of its own (start_metrics_server).
+import sys
+import signal
+import threading
+
+from flask import Flask, jsonify
+
+from server import config
+from server import data_stream
+from server import metrics
+from server.data_filter import operations_callback
+from server.database import cleanup_expired_posts, load_accepted_uris
+
+# ───────────────────────────────────────────────────────
+# Start a database TTL cleanup thread
+# ───────────────────────────────────────────────────────
+
+database_ttl_cleanup_stop_event = threading.Event()
+
+def start_database_ttl_cleanup_thread():
+    ttl_thread = threading.Thread(
+        target=cleanup_expired_posts,
+        args=(),
+        daemon=True  # so it won't block shutdown
+    )
+    ttl_thread.start()
+    return ttl_thread
+
+# ───────────────────────────────────────────────────────
+# Configure and start the data stream in a separate thread
+# ───────────────────────────────────────────────────────
+
+data_stream_stop_event = threading.Event()
+_data_stream_thread = None
+
+def start_data_stream_thread():
+    global _data_stream_thread
+    # Before the first firehose delete, so the consumer never waits on the Post table
+    load_accepted_uris()
+    data_stream_thread = threading.Thread(
+        target=data_stream.run,
+        args=(config.SERVICE_DID, operations_callback, data_stream_stop_event),
+        daemon=True,
+    )
+    data_stream_thread.start()
+    _data_stream_thread = data_stream_thread
+    return data_stream_thread
+
+# ───────────────────────────────────────────────────────
+# Serve /health/ and /metrics/ when no feed server runs in this process
+# ───────────────────────────────────────────────────────
+
+metrics_app = Flask(__name__)
+
+@metrics_app.route("/health/")
+def health():
+    # Unhealthy once the firehose consumer has died
+    if _data_stream_thread is not None and not _data_stream_thread.is_alive():
+        return jsonify({'Status': 'STOPPED'}), 503
+    return jsonify({'Status': 'OK'}), 200
+
+@metrics_app.route("/metrics/")
+def metrics_endpoint():
+    return jsonify(metrics.snapshot()), 200
+
+def start_metrics_server(host: str, port: int):
+    from waitress import create_server
+    server = create_server(metrics_app, host=host, port=port, threads=1)
+    threading.Thread(target=server.run, daemon=True).start()
+    return server
+
+def sigint_handler(*_):
+    print('Stopping background threads...')
+    database_ttl_cleanup_stop_event.set()
+    data_stream_stop_event.set()
+    sys.exit(0)
+
+def install_signal_handlers():
+    signal.signal(signal.SIGINT, sigint_handler)
+    signal.signal(signal.SIGTERM, sigint_handler)
+    signal.signal(signal.SIGABRT, sigint_handler)
@@ -0,0 +1,81 @@
+# server/load_shedding.py
+#
+# Adaptive degradation for the firehose consumer. The controller watches the
+# lag between commit timestamps and the wall clock and steps the amount of
+# work done per post down as lag grows, and back up as it recovers, so the
+# consumer keeps up with spikes instead of being disconnected by the relay
+# (ConsumerTooSlow) and reconnecting in a loop.
+import threading
+import time
+import zlib
+
+from server import config, metrics
+from server.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+FULL, NO_WEBPAGES, NO_ALT_TEXT, KEYWORD_ONLY, SAMPLED = range(5)
+LEVEL_NAMES = ("FULL", "NO_WEBPAGES", "NO_ALT_TEXT", "KEYWORD_ONLY", "SAMPLED")
+
+
+class DegradationController:
+    """
+    Level k (1..4) is entered when the smoothed lag exceeds thresholds[k-1]
+    and left when it falls below recovery_ratio times that threshold. The
+    controller moves one level at a time and steps back up only after staying
+    at a level for min_dwell seconds, so it does not flap around a threshold.
+    """
+
+    def __init__(self, thresholds=None, recovery_ratio=None, min_dwell=None,
+                 sample_rate=None, smoothing: float = 0.2):
+        self.thresholds = list(thresholds or config.SHED_LAG_THRESHOLDS)[:SAMPLED]
+        self.recovery_ratio = config.SHED_RECOVERY_RATIO if recovery_ratio is None else recovery_ratio
+        self.min_dwell = config.SHED_MIN_DWELL if min_dwell is None else min_dwell
+        self.sample_rate = config.SHED_SAMPLE_RATE if sample_rate is None else sample_rate
+        self.smoothing = smoothing
+        self.level = FULL
+        self.lag = 0.0
+        self._changed_at = time.monotonic()
+        self._lock = threading.Lock()
+        metrics.set_gauge('load_shedding.level', FULL)
+
+    def observe(self, lag_seconds: float) -> int:
+        """Feed one commit lag measurement; returns the level to apply."""
+        with self._lock:
+            self.lag += self.smoothing * (lag_seconds - self.lag)
+            metrics.set_gauge('load_shedding.lag_seconds', round(self.lag, 3))
+
+            now = time.monotonic()
+            if self.level < len(self.thresholds) and self.lag > self.thresholds[self.level]:
+                self._transition(self.level + 1, now)
+            elif (self.level > FULL
+                  and self.lag < self.thresholds[self.level - 1] * self.recovery_ratio
+                  and now - self._changed_at >= self.min_dwell):
+                self._transition(self.level - 1, now)
+            return self.level
+
+    def escalate(self, reason: str) -> int:
+        """Step down one level immediately, e.g. after the relay reports ConsumerTooSlow."""
+        with self._lock:
+            if self.level < len(self.thresholds):
+                self._transition(self.level + 1, time.monotonic(), reason)
+            return self.level
+
+    def _transition(self, level: int, now: float, reason: str = None) -> None:
+        previous, self.level, self._changed_at = self.level, level, now
+        metrics.set_gauge('load_shedding.level', level)
+        metrics.increment('load_shedding.transitions')
+        metrics.increment(f'load_shedding.transitions.{LEVEL_NAMES[previous]}->{LEVEL_NAMES[level]}')
+        logger.warning(
+            f"{'⬇️' if level > previous else '⬆️'} Load shedding {LEVEL_NAMES[previous]} -> {LEVEL_NAMES[level]} "
+            f"(lag {self.lag:.1f}s{', ' + reason if reason else ''})"
+        )
+
+    def keep(self, uri: str) -> bool:
+        """At the SAMPLED level, deterministically keep sample_rate of posts by URI."""
+        if self.level < SAMPLED:
+            return True
+        return zlib.crc32(uri.encode()) % 10000 < self.sample_rate * 10000
+
+
+controller = DegradationController()
@@ -1,26 +1,61 @@
 # server/logger.py
-
+#
+# Every module logger shares one QueueHandler. The thread that logs only
+# puts the record on an in-memory queue; a QueueListener thread writes it to
+# stdout, so the firehose consumer never blocks on a slow terminal or pipe.
+# Log with %-style arguments rather than f-strings: a record below LOG_LEVEL
+# is then dropped before its message is built.
+#
+# Per-post debug records go through sample(post.uri), which lets one post in
+# LOG_SAMPLE_EVERY through and costs a level check when debug is off. The
+# choice depends only on the URI, so every module logs the same posts and a
+# sampled post has its whole debug trail.
+import atexit
 import logging
-import os
+import logging.handlers
+import queue
 import sys
-from server.config import FLASK_DEBUG
+import threading
+import zlib
+from server.config import LOG_LEVEL, LOG_SAMPLE_EVERY
+
+_LEVEL = getattr(logging, LOG_LEVEL)
+_queue = queue.SimpleQueue()
+_handler = None
+_lock = threading.Lock()
+
+
+def _queue_handler() -> logging.Handler:
+    """The shared QueueHandler, starting the background writer on first use."""
+    global _handler
+    with _lock:
+        if _handler is None:
+            stream = logging.StreamHandler(sys.stdout)
+            stream.setFormatter(logging.Formatter('%(levelname)s:%(name)s:%(message)s'))
+            listener = logging.handlers.QueueListener(_queue, stream)
+            listener.start()
+            # Stopping drains the queue, so records logged just before exit are still written
+            atexit.register(listener.stop)
+            _handler = logging.handlers.QueueHandler(_queue)
+            _handler.setLevel(_LEVEL)
+        return _handler
+
 
 def setup_logger(name: str) -> logging.Logger:
     logger = logging.getLogger(name)
-    logger.setLevel(logging.DEBUG if FLASK_DEBUG else logging.ERROR)
+    logger.setLevel(_LEVEL)
 
     if logger.hasHandlers():
         return logger  # Prevent adding handlers multiple times
 
-    if not FLASK_DEBUG:
+    if _LEVEL > logging.DEBUG:
         logging.getLogger("werkzeug").setLevel(logging.ERROR)  # silence completely
         logging.getLogger("httpx").setLevel(logging.ERROR)  # silence completely
 
-    handler = logging.StreamHandler(sys.stdout)
-    handler.setLevel(logging.DEBUG if FLASK_DEBUG else logging.ERROR)
+    logger.addHandler(_queue_handler())
+    return logger
 
-    formatter = logging.Formatter('%(levelname)s:%(name)s:%(message)s')
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
 
-    return logger
+def sample(logger: logging.Logger, uri: str) -> bool:
+    """Whether to log the debug records of the post at uri: debug is on, and it is one post in LOG_SAMPLE_EVERY."""
+    return logger.isEnabledFor(logging.DEBUG) and zlib.crc32(uri.encode()) % LOG_SAMPLE_EVERY == 0
@@ -0,0 +1,176 @@
+# server/memory.py
+#
+# One memory budget for every in-process cache. Caches register with the
+# budget and report how many bytes they hold; fixed allocations such as
+# the model weights are counted against it but never evicted. When the total
+# goes over MEMORY_BUDGET_MB (by default MEMORY_BUDGET_FRACTION of the
+# container's cgroup memory limit, or of physical memory outside a
+# container), caches are asked to shrink, cheapest to rebuild and least
+# recently used first, until the total is back under MEMORY_LOW_WATER of
+# the budget.
+#
+# A cache registers itself with
+#
+#   budget.register("dedup", index, cost=2.0)
+#
+# where index has memory_bytes() -> int, shrink(nbytes) -> int (drop its
+# oldest entries until about nbytes are freed, and return what was freed)
+# and a last_used attribute (time.monotonic() of the last lookup or add).
+# cost weighs how expensive a byte of the cache is to lose. The budget is
+# checked every MEMORY_CHECK_INTERVAL seconds by a background thread, and
+# whenever enforce() is called.
+import os
+import threading
+import time
+import weakref
+from typing import Dict, Optional
+
+from server import config, metrics
+from server.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+_CGROUP_LIMITS = ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes")
+
+
+def memory_limit() -> Optional[int]:
+    """The cgroup memory limit in bytes, or physical memory when there is none; None when unknown."""
+    for path in _CGROUP_LIMITS:
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        # cgroup v2 says "max" and v1 a huge number when unlimited
+        if value.isdigit() and int(value) < 1 << 60:
+            return int(value)
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def default_limit() -> int:
+    """MEMORY_BUDGET_MB, or MEMORY_BUDGET_FRACTION of memory_limit(); 0 means unbounded."""
+    if config.MEMORY_BUDGET_MB > 0:
+        return int(config.MEMORY_BUDGET_MB * 1024 * 1024)
+    limit = memory_limit()
+    return int(limit * config.MEMORY_BUDGET_FRACTION) if limit else 0
+
+
+class _Registration:
+    __slots__ = ('cache', 'cost', 'evicted_bytes', 'shrinks')
+
+    def __init__(self, cache, cost: float):
+        self.cache = weakref.ref(cache)
+        self.cost = cost
+        self.evicted_bytes = 0
+        self.shrinks = 0
+
+
+class MemoryBudget:
+
+    def __init__(self, limit: int = None, low_water: float = None, interval: float = None):
+        self.limit = default_limit() if limit is None else limit
+        self.low_water = config.MEMORY_LOW_WATER if low_water is None else low_water
+        self.interval = config.MEMORY_CHECK_INTERVAL if interval is None else interval
+        self._caches: Dict[str, _Registration] = {}
+        self._fixed: Dict[str, int] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._warned = False
+        self._lock = threading.Lock()
+
+    def register(self, name: str, cache, cost: float = 1.0) -> None:
+        """Put a cache under the budget, replacing any cache registered under the same name."""
+        with self._lock:
+            self._caches[name] = _Registration(cache, cost)
+            if self.limit and self.interval > 0 and self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="memory-budget", daemon=True)
+                self._thread.start()
+
+    def register_fixed(self, name: str, nbytes: int) -> None:
+        """Count an allocation that cannot be evicted, such as model weights."""
+        with self._lock:
+            self._fixed[name] = int(nbytes)
+
+    def enforce(self) -> int:
+        """Shrink caches until the total is under the low-water mark; returns the bytes freed."""
+        if not self.limit:
+            return 0
+        with self._lock:
+            caches = self._live()
+            fixed = sum(self._fixed.values())
+        sizes = {name: cache.memory_bytes() for name, (cache, _) in caches.items()}
+        used = fixed + sum(sizes.values())
+        metrics.set_gauge('memory.used_bytes', used)
+        if used <= self.limit:
+            return 0
+
+        target = int(self.limit * self.low_water)
+        if fixed >= target and not self._warned:
+            self._warned = True
+            logger.warning(f"⚠️ Fixed allocations ({fixed >> 20} MB) leave no room for caches "
+                           f"in the memory budget of {self.limit >> 20} MB")
+        now = time.monotonic()
+        # Cheapest and stalest first: cost per byte, discounted by time since last use
+        order = sorted(caches, key=lambda name: caches[name][1].cost / (1.0 + now - caches[name][0].last_used))
+        freed = 0
+        for name in order:
+            if used - freed <= target:
+                break
+            cache, registration = caches[name]
+            released = cache.shrink(min(used - freed - target, sizes[name]))
+            if released:
+                registration.evicted_bytes += released
+                registration.shrinks += 1
+                freed += released
+                metrics.increment(f'memory.{name}.evicted_bytes', released)
+        if freed:
+            logger.info(f"🧹 Memory budget: freed {freed >> 10} KB from caches, "
+                        f"{(used - freed) >> 20} of {self.limit >> 20} MB in use")
+        return freed
+
+    def stats(self) -> dict:
+        with self._lock:
+            caches = self._live()
+            fixed = dict(self._fixed)
+        now = time.monotonic()
+        usage = {
+            name: {
+                "bytes": cache.memory_bytes(),
+                "cost": registration.cost,
+                "idle_seconds": round(now - cache.last_used, 1),
+                "evicted_bytes": registration.evicted_bytes,
+                "shrinks": registration.shrinks,
+            }
+            for name, (cache, registration) in caches.items()
+        }
+        return {
+            "limit_bytes": self.limit,
+            "used_bytes": sum(fixed.values()) + sum(entry["bytes"] for entry in usage.values()),
+            "fixed": fixed,
+            "caches": usage,
+        }
+
+    def _live(self) -> dict:
+        """name -> (cache, registration) for the caches still alive; the dead are dropped."""
+        live = {}
+        for name, registration in list(self._caches.items()):
+            cache = registration.cache()
+            if cache is None:
+                del self._caches[name]
+            else:
+                live[name] = (cache, registration)
+        return live
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.enforce()
+            except Exception as e:  # a broken cache must not stop enforcement for the others
+                logger.error(f"🚫 Memory budget check failed: {e}")
+
+
+budget = MemoryBudget()
+metrics.register_collector('memory', budget.stats)
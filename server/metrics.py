@@ -0,0 +1,48 @@
+# server/metrics.py
+#
+# Minimal in-process metrics registry. Counters and gauges are pushed by the
+# code that owns them; collectors are pulled when a snapshot is taken, for
+# components that already keep their own statistics.
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Dict
+
+_lock = threading.Lock()
+_counters: Dict[str, float] = defaultdict(float)
+_gauges: Dict[str, float] = {}
+_collectors: Dict[str, Callable[[], dict]] = {}
+_started_at = time.time()
+
+
+def increment(name: str, value: float = 1) -> None:
+    with _lock:
+        _counters[name] += value
+
+
+def set_gauge(name: str, value: float) -> None:
+    with _lock:
+        _gauges[name] = value
+
+
+def register_collector(name: str, collector: Callable[[], dict]) -> None:
+    """Register a callable whose dict result is included in every snapshot under `name`."""
+    with _lock:
+        _collectors[name] = collector
+
+
+def snapshot() -> dict:
+    with _lock:
+        result = {
+            'uptime_seconds': round(time.time() - _started_at, 1),
+            'counters': dict(_counters),
+            'gauges': dict(_gauges),
+        }
+        collectors = dict(_collectors)
+
+    for name, collector in collectors.items():
+        try:
+            result[name] = collector()
+        except Exception as e:  # a broken collector must not break the endpoint
+            result[name] = {'error': str(e)}
+    return result
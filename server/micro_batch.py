@@ -0,0 +1,185 @@
+# server/micro_batch.py
+#
+# Cross-commit micro-batching for the live firehose. Most commits carry one
+# or two posts, so classifying per commit leaves the batched cleaning and
+# embedding paths with nothing to batch. The scheduler queues the operations
+# of consecutive commits and hands them to operations_callback together,
+# once the batch holds enough posts or its oldest commit has waited long
+# enough, on a worker thread so decoding the next frames overlaps scoring.
+#
+# Both knobs follow the observed arrival rate: when posts arrive too slowly
+# for a batch to fill within MICROBATCH_MAX_WAIT_MS, waiting only adds
+# latency, so batches are flushed as soon as the worker is free.
+import queue
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Callable, Optional
+
+import numpy as np
+
+from server import config, metrics
+from server.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Latency samples kept for the percentiles reported at /metrics/
+_LATENCY_SAMPLES = 10000
+
+# Seconds over which arrivals are counted for each arrival rate sample
+_RATE_WINDOW = 0.25
+
+
+class _Commit:
+    # received_at is when the consumer decoded the commit and committed_at when
+    # the relay says it was made, both on the monotonic clock
+    __slots__ = ('ops', 'seq', 'posts', 'received_at', 'committed_at')
+
+    def __init__(self, ops: defaultdict, seq: Optional[int], posts: int, received_at: float, committed_at: float):
+        self.ops = ops
+        self.seq = seq
+        self.posts = posts
+        self.received_at = received_at
+        self.committed_at = committed_at
+
+
+class MicroBatcher:
+    """
+    Queue of decoded commits drained by one worker thread, so batches reach
+    operations_callback, and the database, in firehose order. The queue is
+    bounded: when classification cannot keep up, add() blocks, the commit lag
+    grows and load shedding takes over.
+    """
+
+    def __init__(self, operations_callback: Callable[[defaultdict], None],
+                 max_size: int = None, max_wait: float = None, max_pending: int = None,
+                 smoothing: float = 0.3):
+        self.operations_callback = operations_callback
+        self.max_size = config.MICROBATCH_MAX_SIZE if max_size is None else max_size
+        self.max_wait = config.MICROBATCH_MAX_WAIT_MS / 1000 if max_wait is None else max_wait
+        self.smoothing = smoothing
+        self._queue = queue.Queue(maxsize=config.MICROBATCH_MAX_PENDING if max_pending is None else max_pending)
+        self._rate = 0.0  # smoothed posts per second
+        self._window_start, self._window_posts = time.monotonic(), 0
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=_LATENCY_SAMPLES)  # commit to written, relay lag included
+        self._processing = deque(maxlen=_LATENCY_SAMPLES)  # received to written
+        self._posts = self._batches = 0
+        self._busy_seconds = 0.0
+        self._started_at = time.monotonic()
+        self.target_size, self.wait = 1, 0.0
+        self.last_seq = None  # seq of the newest commit whose operations were handed over
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._thread.start()
+        metrics.register_collector('micro_batch', self.stats)
+
+    def add(self, ops: defaultdict, seq: int = None, lag: float = 0.0) -> None:
+        """Queue a commit's operations; lag is how long before receipt the commit was made."""
+        posts = sum(len(actions['created']) for actions in ops.values())
+        now = time.monotonic()
+        with self._lock:
+            # Commits arrive in bursts, so the rate is measured over short windows rather than per gap
+            self._window_posts += posts
+            elapsed = now - self._window_start
+            if elapsed >= _RATE_WINDOW:
+                self._rate += self.smoothing * (self._window_posts / elapsed - self._rate)
+                self._window_start, self._window_posts = now, 0
+        self._queue.put(_Commit(ops, seq, posts, now, now - lag))
+
+    def flush(self) -> None:
+        """Block until every commit added so far has been handed to operations_callback."""
+        self._queue.join()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """Process what is queued, then stop the worker."""
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def _knobs(self):
+        """(posts per batch, seconds to wait for them) for the current arrival rate."""
+        with self._lock:
+            rate = self._rate
+        expected = rate * self.max_wait
+        if expected < 2:
+            # Too few arrivals within the deadline to be worth waiting for
+            return 1, 0.0
+        target = min(int(expected), self.max_size)
+        return target, min(self.max_wait, target / rate)
+
+    def _run(self) -> None:
+        while True:
+            try:
+                first = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                if self._stop.is_set():
+                    return
+                continue
+
+            self.target_size, self.wait = self._knobs()
+            batch, posts = [first], first.posts
+            deadline = first.received_at + self.wait
+            while posts < self.max_size:
+                remaining = deadline - time.monotonic() if posts < self.target_size else 0
+                try:
+                    # Commits that queued up while the last batch was scored are taken without waiting
+                    commit = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(commit)
+                posts += commit.posts
+            self._process(batch, posts)
+
+    def _process(self, batch, posts: int) -> None:
+        merged = defaultdict(lambda: {'created': [], 'deleted': []})
+        for commit in batch:
+            for collection, actions in commit.ops.items():
+                merged[collection]['created'].extend(actions['created'])
+                merged[collection]['deleted'].extend(actions['deleted'])
+
+        started = time.monotonic()
+        try:
+            self.operations_callback(merged)
+        except Exception as e:
+            logger.error(f'Error while processing a batch of {len(batch)} commits: {e}', exc_info=True)
+        finished = time.monotonic()
+
+        with self._lock:
+            self._posts += posts
+            self._batches += 1
+            self._busy_seconds += finished - started
+            for commit in batch:
+                if commit.posts:
+                    self._latencies.extend([finished - commit.committed_at] * commit.posts)
+                    self._processing.extend([finished - commit.received_at] * commit.posts)
+        for commit in batch:
+            if commit.seq is not None:
+                self.last_seq = commit.seq
+            self._queue.task_done()
+        metrics.increment('micro_batch.posts', posts)
+        metrics.increment('micro_batch.batches')
+
+    def stats(self) -> dict:
+        with self._lock:
+            elapsed = max(time.monotonic() - self._started_at, 1e-6)
+            return {
+                'arrival_rate': round(self._rate, 2),
+                'target_size': self.target_size,
+                'wait_ms': round(self.wait * 1000, 2),
+                'queued_commits': self._queue.qsize(),
+                'batches': self._batches,
+                'mean_batch_size': round(self._posts / max(self._batches, 1), 2),
+                'throughput_posts_per_second': round(self._posts / elapsed, 2),
+                'busy_ratio': round(self._busy_seconds / elapsed, 3),
+                # Post-to-feed: from the commit's own timestamp until its posts are written
+                'latency_ms': _percentiles(self._latencies),
+                # The part spent in this process: queueing, batching and classification
+                'processing_latency_ms': _percentiles(self._processing),
+            }
+
+
+def _percentiles(samples: deque) -> dict:
+    milliseconds = np.array(samples) * 1000 if samples else np.zeros(1)
+    p50, p95, p99 = np.percentile(milliseconds, [50, 95, 99])
+    return {'p50': round(p50, 2), 'p95': round(p95, 2), 'p99': round(p99, 2),
+            'max': round(float(milliseconds.max()), 2)}
@@ -0,0 +1,77 @@
+# server/post_record.py
+#
+# The one object a created post is carried in from the firehose decoder,
+# through classification, to the database row. It is built straight from the
+# decoded CAR block instead of a full pydantic record, and keeps only the
+# fields the pipeline reads.
+from datetime import datetime, timezone
+from typing import Optional
+
+
+class PostRecord:
+    # facets and embed are kept as the raw decoded dicts so extract_extra_text
+    # can read them without a model; extra_text is filled in by the filter.
+    __slots__ = ('uri', 'cid', 'author', 'text', 'facets', 'embed',
+                 'reply_root', 'reply_parent', 'created_at', 'indexed_at', 'extra_text')
+
+    def __init__(self, uri: str, cid: str, author: str, text: str = '',
+                 facets: Optional[list] = None, embed: Optional[dict] = None,
+                 reply_root: Optional[str] = None, reply_parent: Optional[str] = None,
+                 created_at: Optional[str] = None, indexed_at: Optional[datetime] = None):
+        self.uri = uri
+        self.cid = cid
+        self.author = author
+        self.text = text
+        self.facets = facets
+        self.embed = embed
+        self.reply_root = reply_root
+        self.reply_parent = reply_parent
+        self.created_at = created_at
+        self.indexed_at = indexed_at
+        self.extra_text = None
+
+    @classmethod
+    def from_block(cls, uri: str, cid: str, author: str, block: dict,
+                   indexed_at: Optional[datetime] = None) -> 'PostRecord':
+        """Build from an app.bsky.feed.post block as decoded from the commit CAR."""
+        text = block.get('text')
+        reply = block.get('reply')
+        reply_root = reply_parent = None
+        if isinstance(reply, dict):
+            reply_root = _ref_uri(reply.get('root'))
+            reply_parent = _ref_uri(reply.get('parent'))
+        return cls(
+            uri, cid, author,
+            text=text if isinstance(text, str) else '',
+            facets=block.get('facets'),
+            embed=block.get('embed'),
+            reply_root=reply_root,
+            reply_parent=reply_parent,
+            created_at=block.get('createdAt'),
+            indexed_at=indexed_at,
+        )
+
+    @property
+    def is_reply(self) -> bool:
+        return self.reply_parent is not None
+
+    def row(self, feed: Optional[str] = None) -> dict:
+        """The Post row stored when the post is shown in feed (by default FEED_URI's feed)."""
+        row = {
+            'uri': self.uri,
+            'cid': self.cid,
+            'reply_parent': self.reply_parent,
+            'reply_root': self.reply_root,
+            'indexed_at': self.indexed_at or datetime.now(timezone.utc),
+        }
+        if feed is not None:
+            row['feed'] = feed
+        return row
+
+    def __repr__(self) -> str:
+        return f'PostRecord({self.uri!r})'
+
+
+def _ref_uri(ref) -> Optional[str]:
+    uri = ref.get('uri') if isinstance(ref, dict) else None
+    return uri if isinstance(uri, str) else None
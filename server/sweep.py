@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+#
+# sweep.py
+#
+# Threshold sweep over a labeled corpus. Posts are cleaned and embedded once
+# into a cache directory (vectors.npy, memory-mapped on later runs); every
+# later sweep only computes two similarities per post and then evaluates
+# score_post's softmax, keyword bias and threshold logic for the whole
+# hyperparameter grid with NumPy.
+#
+# $ python -m server.sweep --corpus labeled.jsonl --cache .sweep_cache \
+#       --show 0.5:0.95:0.05 --hide 0.5:0.95:0.05 --temperature 0.05,0.1,0.5,1 --bias 0,0.05,0.1
+#
+# Corpus lines use the server.classify input format; "label" must be SHOW or
+# HIDE for a post to count towards precision and recall.
+#
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+from typing import List
+
+import numpy as np
+
+from server import config
+from server.classify import combine_post_text
+from server.text_utils import clean_texts
+from server.user_lists import get_user_lists
+from server.vector import HIDE, SHOW, softmax_probabilities, strings_to_vectors
+
+_LABELS = {"SHOW": SHOW, "HIDE": HIDE}
+
+
+def _corpus_signature(corpus_path: str) -> dict:
+    stat = os.stat(corpus_path)
+    return {"corpus": os.path.abspath(corpus_path), "size": stat.st_size,
+            "mtime": stat.st_mtime, "model": config.MODEL_NAME}
+
+
+def build_cache(corpus_path: str, cache_dir: str, batch_size: int = 64) -> None:
+    """Clean and embed the corpus once, streaming vectors into a .npy memmap."""
+    with open(corpus_path, "r", encoding="utf-8") as f:
+        count = sum(1 for line in f if line.strip())
+
+    os.makedirs(cache_dir, exist_ok=True)
+    vectors = None
+    labels = np.full(count, -1, dtype=np.int8)
+    start, row = time.time(), 0
+
+    with open(corpus_path, "r", encoding="utf-8") as f, \
+         open(os.path.join(cache_dir, "cleaned.txt"), "w", encoding="utf-8") as cleaned_out:
+        lines = (line for line in f if line.strip())
+        while True:
+            batch = [json.loads(line) for line in itertools.islice(lines, batch_size)]
+            if not batch:
+                break
+            cleaned = clean_texts([combine_post_text(post) for post in batch], batch_size=batch_size)
+            embedded = strings_to_vectors(cleaned, batch_size=batch_size)
+            if vectors is None:
+                vectors = np.lib.format.open_memmap(os.path.join(cache_dir, "vectors.npy"), mode="w+",
+                                                    dtype=np.float32, shape=(count, embedded.shape[1]))
+            vectors[row:row + len(batch)] = embedded
+            for offset, post in enumerate(batch):
+                labels[row + offset] = _LABELS.get(str(post.get("label", "")).upper(), -1)
+            cleaned_out.writelines(text + "\n" for text in cleaned)
+            row += len(batch)
+            print(f"[sweep] embedded {row}/{count} posts ({row / (time.time() - start):.1f} posts/s)",
+                  file=sys.stderr, flush=True)
+
+    if vectors is not None:
+        vectors.flush()
+    np.save(os.path.join(cache_dir, "labels.npy"), labels)
+    with open(os.path.join(cache_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(_corpus_signature(corpus_path), f)
+
+
+def cache_is_current(corpus_path: str, cache_dir: str) -> bool:
+    try:
+        with open(os.path.join(cache_dir, "meta.json"), "r", encoding="utf-8") as f:
+            return json.load(f) == _corpus_signature(corpus_path)
+    except (OSError, ValueError):
+        return False
+
+
+def cosine_to(vectors: np.ndarray, target: np.ndarray, chunk: int = 65536) -> np.ndarray:
+    """cosine_similarity of every row against one vector, computed in chunks over the memmap."""
+    target_norm = np.linalg.norm(target)
+    result = np.zeros(len(vectors), dtype=np.float64)
+    if target_norm == 0.0:
+        return result
+    for start in range(0, len(vectors), chunk):
+        block = np.asarray(vectors[start:start + chunk])
+        norms = np.linalg.norm(block, axis=1)
+        dots = block @ target
+        with np.errstate(divide="ignore", invalid="ignore"):
+            result[start:start + chunk] = np.where(norms == 0.0, 0.0, dots / (norms * target_norm))
+    return result
+
+
+def sweep(raw_white: np.ndarray, raw_black: np.ndarray,
+          white_hit: np.ndarray, black_hit: np.ndarray, labels: np.ndarray,
+          show_grid: List[float], hide_grid: List[float],
+          temperature_grid: List[float], bias_grid: List[float],
+          policy: str = config.AMBIGUOUS_POST_POLICY) -> List[dict]:
+    """
+    Evaluate every (show, hide, temperature, bias) combination. Probabilities
+    only depend on temperature and bias; for each of those pairs the decision
+    counts for the whole show x hide grid come from two matrix products over
+    threshold indicator matrices.
+    """
+    show_t = np.asarray(show_grid, dtype=np.float64)[:, None]
+    hide_t = np.asarray(hide_grid, dtype=np.float64)[:, None]
+    is_show = (labels == SHOW).astype(np.float64)
+    is_hide = (labels == HIDE).astype(np.float64)
+    total, n_show, n_hide = len(labels), is_show.sum(), is_hide.sum()
+    rows = []
+
+    for temperature, bias in itertools.product(temperature_grid, bias_grid):
+        prob_white, prob_black = softmax_probabilities(raw_white, raw_black, white_hit, black_hit,
+                                                       temperature=temperature, bias_weight=bias)
+        shown = (prob_white[None, :] >= show_t).astype(np.float64)        # (S, N)
+        not_shown = 1.0 - shown
+        hide_ok = (prob_black[None, :] >= hide_t).astype(np.float64)      # (H, N)
+
+        pred_show = shown.sum(axis=1)                                     # (S,)
+        pred_show_true = shown @ is_show                                  # (S,)
+        pred_hide = not_shown @ hide_ok.T                                 # (S, H)
+        pred_hide_true = (not_shown * is_hide) @ hide_ok.T                # (S, H)
+        # Posts labeled SHOW that end up AMBIGUOUS, for the policy-adjusted accuracy
+        amb_show = (not_shown * is_show).sum(axis=1)[:, None] - (not_shown * is_show) @ hide_ok.T
+        amb_hide = (not_shown * is_hide).sum(axis=1)[:, None] - pred_hide_true
+
+        for i, j in itertools.product(range(len(show_grid)), range(len(hide_grid))):
+            ambiguous = total - pred_show[i] - pred_hide[i, j]
+            correct = pred_show_true[i] + pred_hide_true[i, j] + (
+                amb_show[i, j] if policy == "SHOW" else amb_hide[i, j])
+            rows.append({
+                "show_threshold": float(show_grid[i]),
+                "hide_threshold": float(hide_grid[j]),
+                "temperature": float(temperature),
+                "bias_weight": float(bias),
+                "show_precision": _ratio(pred_show_true[i], pred_show[i]),
+                "show_recall": _ratio(pred_show_true[i], n_show),
+                "hide_precision": _ratio(pred_hide_true[i, j], pred_hide[i, j]),
+                "hide_recall": _ratio(pred_hide_true[i, j], n_hide),
+                "ambiguous_rate": _ratio(ambiguous, total),
+                "accuracy": _ratio(correct, n_show + n_hide),
+            })
+    return rows
+
+
+def _ratio(numerator: float, denominator: float) -> float:
+    return round(float(numerator) / float(denominator), 4) if denominator else 0.0
+
+
+def _parse_grid(value: str) -> List[float]:
+    """Either a comma list (0.1,0.5,1) or an inclusive range start:stop:step."""
+    if ":" in value:
+        start, stop, step = (float(part) for part in value.split(":"))
+        return [round(x, 6) for x in np.arange(start, stop + step / 2, step)]
+    return [float(part) for part in value.split(",") if part.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep classifier hyperparameters over a labeled corpus.")
+    parser.add_argument("--corpus", required=True, help="Labeled JSONL corpus")
+    parser.add_argument("--cache", default=".sweep_cache", help="Directory for cached embeddings (default: .sweep_cache)")
+    parser.add_argument("--rebuild", action="store_true", help="Re-embed even if the cache is current")
+    parser.add_argument("--did", default=config.DEFAULT_DID, help="User whose lists are scored against")
+    parser.add_argument("--show", type=_parse_grid, default=[config.SHOW_THRESH], help="SHOW_THRESHOLD grid")
+    parser.add_argument("--hide", type=_parse_grid, default=[config.HIDE_THRESH], help="HIDE_THRESHOLD grid")
+    parser.add_argument("--temperature", type=_parse_grid, default=[config.TEMPERATURE], help="SOFTMAX_TEMPERATURE grid")
+    parser.add_argument("--bias", type=_parse_grid, default=[config.BIAS_WEIGHT], help="BIAS_WEIGHT grid")
+    parser.add_argument("--policy", choices=("SHOW", "HIDE"), default=config.AMBIGUOUS_POST_POLICY,
+                        help="Decision for AMBIGUOUS posts when computing accuracy")
+    parser.add_argument("--sort-by", default="accuracy", help="Column to rank settings by (default: accuracy)")
+    parser.add_argument("--top", type=int, default=20, help="Rows to print (default: 20)")
+    parser.add_argument("--output", help="Write every row to this JSON file")
+    parser.add_argument("--batch-size", type=int, default=64)
+    args = parser.parse_args()
+
+    if args.rebuild or not cache_is_current(args.corpus, args.cache):
+        build_cache(args.corpus, args.cache, batch_size=args.batch_size)
+
+    lists = get_user_lists(args.did)
+    if lists is None:
+        sys.exit(f"No white- and blacklists stored for {args.did}")
+
+    vectors = np.load(os.path.join(args.cache, "vectors.npy"), mmap_mode="r")
+    labels = np.load(os.path.join(args.cache, "labels.npy"))
+    with open(os.path.join(args.cache, "cleaned.txt"), "r", encoding="utf-8") as f:
+        cleaned = [line.rstrip("\n") for line in f]
+
+    start = time.time()
+    raw_white = cosine_to(vectors, lists.white_vector)
+    raw_black = cosine_to(vectors, lists.black_vector)
+    hits = [lists.matcher.match(text.split()) for text in cleaned]
+    white_hit = np.array([bool(hit["white"]) for hit in hits], dtype=bool)
+    black_hit = np.array([bool(hit["black"]) for hit in hits], dtype=bool)
+
+    rows = sweep(raw_white, raw_black, white_hit, black_hit, labels,
+                 args.show, args.hide, args.temperature, args.bias, policy=args.policy)
+    elapsed = time.time() - start
+    print(f"[sweep] evaluated {len(rows)} settings over {len(labels)} posts in {elapsed:.2f}s", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+
+    columns = list(rows[0].keys()) if rows else []
+    ranked = sorted(rows, key=lambda row: row.get(args.sort_by, 0.0), reverse=True)[:args.top]
+    print("  ".join(f"{c:>14}" for c in columns))
+    for row in ranked:
+        print("  ".join(f"{row[c]:>14}" for c in columns))
+
+
+if __name__ == "__main__":
+    main()
@@ -5,11 +5,11 @@ import ftfy
 import httpx
 import os
 import re
-import spacy
+import time
 from bs4 import BeautifulSoup
 from html import unescape
 from dotenv import load_dotenv
-from server.logger import setup_logger
+from server.logger import sample, setup_logger
 from pydantic import BaseModel
 from typing import Any, Dict, List, Optional, Union
 from unidecode import unidecode
@@ -17,19 +17,47 @@ from urllib.parse import urlparse
 from server.config import BIAS_WEIGHT
 
 logger = setup_logger(__name__)
-nlp = spacy.load("en_core_web_sm")
 
-def extract_extra_text(record: Union[dict, BaseModel]) -> str:
+_nlp_instance = None
+
+def get_nlp():
+    """The spaCy pipeline, loaded on first use so importing this module stays cheap."""
+    global _nlp_instance
+    if _nlp_instance is None:
+        import spacy
+        start = time.time()
+        _nlp_instance = spacy.load("en_core_web_sm")
+        logger.debug(f"✅ Loaded spaCy pipeline in {time.time() - start:.2f} seconds")
+    return _nlp_instance
+
+def extract_extra_text(record: Union[dict, BaseModel],
+                       fetch_webpages: bool = True,
+                       include_alt_text: bool = True) -> str:
     """
     Extracts extra natural language content from a Bluesky post record.
     Supports dicts or Pydantic models.
 
     Handles:
     - Link URIs from 'facets'
-    - Alt-text from 'embed.images'
+    - Alt-text from 'embed.images' (unless include_alt_text is False)
     - Title/description from 'embed.external' (even if nested in recordWithMedia)
+    - Text of the linked page from 'embed.external' (unless fetch_webpages is False)
     """
-    extras: List[str] = []
+    sources = extract_extra_sources(record, fetch_webpages=fetch_webpages, include_alt_text=include_alt_text)
+    return " ".join(text for source in EXTRA_SOURCES for text in sources[source])
+
+# Where extra text comes from, in the order extract_extra_text joins it
+EXTRA_SOURCES = ("links", "alt", "card", "page")
+
+def extract_extra_sources(record: Union[dict, BaseModel],
+                          fetch_webpages: bool = True,
+                          include_alt_text: bool = True) -> Dict[str, List[str]]:
+    """
+    The pieces extract_extra_text joins, by source: "links" (facet URIs),
+    "alt" (image alt text), "card" (cleaned link card title and description)
+    and "page" (cleaned text of the linked page).
+    """
+    extras: Dict[str, List[str]] = {source: [] for source in EXTRA_SOURCES}
 
     def safe_get(obj: Any, attr: str, default=None):
         return getattr(obj, attr, default) if not isinstance(obj, dict) else obj.get(attr, default)
@@ -42,17 +70,17 @@ def extract_extra_text(record: Union[dict, BaseModel]) -> str:
             if safe_get(feature, "$type") == "app.bsky.richtext.facet#link":
                 uri = safe_get(feature, "uri")
                 if uri:
-                    extras.append(uri)
+                    extras["links"].append(uri)
 
     # --- Embeds ---
     def extract_from_embed(embed: Any):
         embed_type = safe_get(embed, "$type") or safe_get(embed, "py_type", "")
 
-        if embed_type == "app.bsky.embed.images":
+        if embed_type == "app.bsky.embed.images" and include_alt_text:
             for img in safe_get(embed, "images", []):
                 alt = safe_get(img, "alt", "")
                 if alt:
-                    extras.append(alt)
+                    extras["alt"].append(alt)
 
         elif embed_type == "app.bsky.embed.external":
             ext = safe_get(embed, "external", {})
@@ -60,11 +88,11 @@ def extract_extra_text(record: Union[dict, BaseModel]) -> str:
             desc = safe_get(ext, "description", "")
             url = safe_get(ext, "uri", "")
             if title:
-                extras.append(clean_text(title))
+                extras["card"].append(clean_text(title))
             if desc:
-                extras.append(clean_text(desc))
-            if url:
-                extras.append(clean_text(get_webpage_text(url)))
+                extras["card"].append(clean_text(desc))
+            if url and fetch_webpages:
+                extras["page"].append(clean_text(get_webpage_text(url)))
 
         elif embed_type == "app.bsky.embed.recordWithMedia":
             media = safe_get(embed, "media", {})
@@ -73,25 +101,15 @@ def extract_extra_text(record: Union[dict, BaseModel]) -> str:
     embed = safe_get(record, "embed", {})
     extract_from_embed(embed)
 
-    if extras:
-        logger.debug(f"🧠 Extracted extra text: {extras}")
+    # Records without a URI are not from the firehose and are always logged
+    uri = safe_get(record, "uri") or ""
+    if sample(logger, uri) and any(extras.values()):
+        logger.debug("🧠 Extracted extra text for %s: %s", uri, extras)
 
-    return " ".join(extras)
+    return extras
 
-def clean_text(string: str) -> str:
-    """
-    Clean and normalize input text:
-    - Strip HTML and script/style/nav tags
-    - Fix Unicode, decode HTML entities
-    - Expand contractions
-    - Remove URLs
-    - Remove punctuation
-    - Collapse excess whitespace
-    - Remove stopwords
-    - Lemmatize nouns, verbs, adjectives, adverbs
-    - Remove duplicated words
-    Return string
-    """
+def _normalize_text(string: str) -> str:
+    """Everything clean_text does before the spaCy pipeline."""
     # Strip HTML elements
     soup = BeautifulSoup(string, "html.parser")
     for tag in soup(["script", "style", "header", "footer", "nav"]):
@@ -114,10 +132,10 @@ def clean_text(string: str) -> str:
     text = re.sub(r"\s+", " ", text).strip().lower()
 
     # Final tag stripping (redundant but safe)
-    text = bleach.clean(text, tags=[], strip=True)
+    return bleach.clean(text, tags=[], strip=True)
 
-    # Tokenize, lemmatize, remove stopwords, normalize POS
-    doc = nlp(text)
+def _lemmatize_doc(doc) -> str:
+    """Everything clean_text does with the parsed spaCy document."""
     cleaned_tokens = [
         token.lemma_
         for token in doc
@@ -136,27 +154,116 @@ def clean_text(string: str) -> str:
     
     return " ".join(deduped_tokens)
 
-def keyword_match_bias(word_list: List[str], text: str) -> float:
+def clean_text(string: str) -> str:
+    """
+    Clean and normalize input text:
+    - Strip HTML and script/style/nav tags
+    - Fix Unicode, decode HTML entities
+    - Expand contractions
+    - Remove URLs
+    - Remove punctuation
+    - Collapse excess whitespace
+    - Remove stopwords
+    - Lemmatize nouns, verbs, adjectives, adverbs
+    - Remove duplicated words
+    Return string
+    """
+    # Tokenize, lemmatize, remove stopwords, normalize POS
+    return _lemmatize_doc(get_nlp()(_normalize_text(string)))
+
+def clean_texts(strings: List[str], batch_size: int = 64) -> List[str]:
+    """
+    Batch version of clean_text. Runs the spaCy pipeline once over all
+    inputs with nlp.pipe, which is considerably faster than one call per text.
+    """
+    normalized = [_normalize_text(string) for string in strings]
+    return [_lemmatize_doc(doc) for doc in get_nlp().pipe(normalized, batch_size=batch_size)]
+
+class KeywordMatcher:
+    """
+    Keyword lists compiled into one token trie, so a post is scanned once for
+    every list. Keywords may be single words or multi-word phrases. Each one
+    is indexed by its plain lowercase tokens and, with lemmatize, also by the
+    tokens clean_text turns it into. A phrase therefore matches the cleaned
+    post text it would appear as ("machine learning" -> "machine learn").
+
+        matcher = KeywordMatcher({"white": white_words, "black": black_words})
+        matcher.match(cleaned.split())  # {"white": ["machine learning"], "black": []}
+    """
+
+    _END = ""  # trie key holding the (label, keyword) pairs a path completes
+
+    def __init__(self, keyword_lists: Dict[str, List[str]], lemmatize: bool = True):
+        self.labels = list(keyword_lists)
+        self._root: dict = {}
+        self.max_length = 0
+        for label, keywords in keyword_lists.items():
+            keywords = [k.strip() for k in keywords or [] if k and k.strip()]
+            plain = [_normalize_text(k).split() for k in keywords]
+            lemmas = clean_texts(keywords) if lemmatize and keywords else [""] * len(keywords)
+            for keyword, plain_tokens, lemma_text in zip(keywords, plain, lemmas):
+                for tokens in (plain_tokens, lemma_text.split()):
+                    if tokens:
+                        self._add(tokens, label, keyword)
+
+    def _add(self, tokens: List[str], label: str, keyword: str) -> None:
+        node = self._root
+        for token in tokens:
+            node = node.setdefault(token, {})
+        node.setdefault(self._END, set()).add((label, keyword))
+        self.max_length = max(self.max_length, len(tokens))
+
+    def match(self, tokens: List[str]) -> Dict[str, List[str]]:
+        """Keywords of each list found in the token sequence, in order of first appearance."""
+        hits = {label: [] for label in self.labels}
+        seen = set()
+        root = self._root
+        for start in range(len(tokens)):
+            node = root.get(tokens[start])
+            position = start
+            while node is not None:
+                for found in node.get(self._END, ()):
+                    if found not in seen:
+                        seen.add(found)
+                        hits[found[0]].append(found[1])
+                position += 1
+                if position == len(tokens):
+                    break
+                node = node.get(tokens[position])
+        return hits
+
+    def __bool__(self) -> bool:
+        return bool(self._root)
+
+def keyword_match_bias(word_list: List[str], text: str, bias_weight: float = BIAS_WEIGHT) -> float:
     """
     Returns a bias score if any keyword exists in the text, otherwise returns 0.0.
 
     Parameters:
         word_list (List[str]): List of keywords to search for.
         text (str): Cleaned social media post content.
+        bias_weight (float): Bias returned on a match.
 
     Returns:
-        float: BIAS_WEIGHT if match found, otherwise 0.0
-    """
-
-    text_words = set(re.findall(r'\b\w+\b', text.strip().lower()))
-    keywords = set(word.strip().lower() for word in word_list)
+        float: bias_weight if match found, otherwise 0.0
 
-    return BIAS_WEIGHT if text_words & keywords else 0.0
+    Compiles the list on every call; callers scoring many posts should build
+    a KeywordMatcher once instead.
+    """
+    matcher = KeywordMatcher({"keywords": word_list}, lemmatize=False)
+    return bias_weight if matcher.match(text.split())["keywords"] else 0.0
 
 def get_webpage_text(url: str, timeout: float = 3.0) -> str:
     """
     Fetches a web page and returns visible text content (cleaned).
     """
+    return clean_text(fetch_webpage_text(url, timeout=timeout))
+
+def fetch_webpage_text(url: str, timeout: float = 3.0) -> str:
+    """
+    Fetches a web page and returns its visible text content, not yet cleaned,
+    or "" when the page cannot be fetched.
+    """
     try:
         # Avoid localhost or dangerous URLs
         netloc = urlparse(url).netloc.lower()
@@ -186,7 +293,7 @@ def get_webpage_text(url: str, timeout: float = 3.0) -> str:
         for tag in soup(["script", "style", "noscript", "nav", "footer", "header"]):
             tag.decompose()
 
-        return clean_text(soup.get_text(separator=" ", strip=True))
+        return soup.get_text(separator=" ", strip=True)
 
     except Exception as e:
         logger.error(f"Failed to fetch webpage text from {url}: {e}")
@@ -0,0 +1,126 @@
+# server/threads.py
+#
+# Decisions of recent posts by URI, so a reply can take its thread's
+# decision instead of being cleaned, embedded and scored. A reply looks up
+# its parent first and its thread root second; per feed, it inherits a HIDE
+# (or SHOW, or both, as THREAD_INHERIT says) made for either. A reply whose
+# every feed is decided this way skips the model; otherwise it is scored and
+# the inherited decisions replace the scored ones for those feeds. Replies
+# are recorded too, so a decision carries down a whole thread.
+#
+# Entries are kept for THREAD_WINDOW seconds, and at most THREAD_MAX_ENTRIES
+# of them, in insertion order, so memory stays bounded.
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from server import config, memory, metrics
+
+# Per entry: the URI, the decisions tuple and the ordered dict's node
+_ENTRY_BYTES = 320
+
+INHERITED = {"hide": ("HIDE",), "show": ("SHOW",), "both": ("HIDE", "SHOW"), "none": ()}
+
+
+class ThreadDecisions:
+    """URI -> (recorded at, per-feed decisions), oldest first."""
+
+    def __init__(self, window: float = None, max_entries: int = None, policy: str = None):
+        self.window = config.THREAD_WINDOW if window is None else window
+        self.max_entries = config.THREAD_MAX_ENTRIES if max_entries is None else max_entries
+        self.inherited = INHERITED[config.THREAD_INHERIT if policy is None else policy]
+        self._entries: "OrderedDict[str, Tuple[float, tuple]]" = OrderedDict()
+        self._scope = None
+        self._replies = 0
+        self._skipped = 0
+        self._partial = 0
+        self.last_used = time.monotonic()
+        self._lock = threading.Lock()
+
+    def bind(self, scope) -> None:
+        """Forget every decision when what they were made against (e.g. the feeds' lists) changes."""
+        with self._lock:
+            if scope != self._scope:
+                self._scope = scope
+                self._entries.clear()
+                metrics.set_gauge('threads.entries', 0)
+
+    def inherit(self, post, needed: List[bool]) -> Optional[tuple]:
+        """
+        Per-feed decisions a reply takes from its parent or thread root, with
+        None for feeds it has to be scored for; None when it inherits nothing.
+        needed marks the feeds that decide posts at all (their lists are
+        saved); the reply skips the model when it inherits all of those.
+        """
+        if not self.inherited or not post.is_reply:
+            return None
+        with self._lock:
+            self._replies += 1
+            self.last_used = time.monotonic()
+            self._evict(self.last_used)
+            sources = [self._entries.get(uri) for uri in (post.reply_parent, post.reply_root) if uri]
+            decisions = [None] * len(needed)
+            for _, recorded in filter(None, sources):
+                for index, decision in enumerate(recorded[:len(needed)]):
+                    if needed[index] and decisions[index] is None and decision in self.inherited:
+                        decisions[index] = decision
+            if all(decision is None for decision in decisions):
+                return None
+            if all(decision is not None or not need for decision, need in zip(decisions, needed)):
+                self._skipped += 1
+                metrics.increment('threads.replies_skipped')
+            else:
+                self._partial += 1
+                metrics.increment('threads.replies_partial')
+            return tuple(decisions)
+
+    def record(self, uri: str, decisions: tuple) -> None:
+        with self._lock:
+            self.last_used = time.monotonic()
+            self._entries.pop(uri, None)
+            self._entries[uri] = (self.last_used, tuple(decisions))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            metrics.set_gauge('threads.entries', len(self._entries))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "replies_checked": self._replies,
+                "replies_skipped": self._skipped,
+                "replies_partial": self._partial,
+                "skip_rate": round(self._skipped / self._replies, 4) if self._replies else 0.0,
+            }
+
+    def memory_bytes(self) -> int:
+        return len(self._entries) * _ENTRY_BYTES
+
+    def shrink(self, nbytes: int) -> int:
+        """Drop the oldest entries until about nbytes are freed (see server.memory)."""
+        with self._lock:
+            released = min(len(self._entries), -(-nbytes // _ENTRY_BYTES))
+            for _ in range(released):
+                self._entries.popitem(last=False)
+            metrics.set_gauge('threads.entries', len(self._entries))
+            return released * _ENTRY_BYTES
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _evict(self, now: float) -> None:
+        evicted = False
+        while self._entries:
+            uri, (recorded_at, _) = next(iter(self._entries.items()))
+            if now - recorded_at <= self.window:
+                break
+            del self._entries[uri]
+            evicted = True
+        if evicted:
+            metrics.set_gauge('threads.entries', len(self._entries))
+
+
+index = ThreadDecisions()
+metrics.register_collector('threads', index.stats)
+memory.budget.register('threads', index, cost=2.0)
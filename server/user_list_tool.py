@@ -12,12 +12,10 @@
 import streamlit as st
 import json
 import os
-from datetime import datetime, timezone
 from server.config import DEFAULT_DID
-from server.database import UserLists, db
-from server.vector import blob_to_vector, string_to_vector, vector_to_blob
-from server.text_utils import clean_text, get_webpage_text
-import numpy as np
+from server.database import UserLists
+from server.user_lists import list_words, save_user_lists
+from server.vector import blob_to_vector
 
 DEFAULT_JSON_PATH = "data/user_list.json"
 
@@ -30,11 +28,11 @@ def load_user_lists(did):
         row = UserLists.select().where(UserLists.did == did).get()
         return {
             "white_list": {
-                "words": row.white_list_text.split(),
+                "words": list_words(row.white_list_words, row.white_list_text),
                 "urls": json.loads(row.white_list_urls or "[]")
             },
             "black_list": {
-                "words": row.black_list_text.split(),
+                "words": list_words(row.black_list_words, row.black_list_text),
                 "urls": json.loads(row.black_list_urls or "[]")
             }
         }
@@ -57,52 +55,7 @@ def dump_vectors_to_console(did):
         print(f"No entry found for DID={did}")
 
 def save_to_database(did, data):
-    now = datetime.now(timezone.utc)
-    for kind in ("white_list", "black_list"):
-        words = data[kind].get("words", [])
-        urls = data[kind].get("urls", [])
-
-        vectors = []
-        keyword_text = " ".join(words)
-        if words:
-            vectors.append(string_to_vector(keyword_text))
-
-        for url in urls:
-            try:
-                raw = get_webpage_text(url)
-                if raw and len(raw.strip()) > 100:
-                    cleaned = clean_text(raw)
-                    vectors.append(string_to_vector(cleaned))
-            except Exception:
-                continue
-
-        if not vectors:
-            continue
-
-        combined_vec = sum(vectors) / len(vectors)
-        blob = vector_to_blob(combined_vec)
-        dim = combined_vec.shape[0]
-
-        try:
-            row = UserLists.get(UserLists.did == did)
-            update_data = {
-                f"{kind}_text": keyword_text,
-                f"{kind}_vector": blob,
-                f"{kind}_dim": dim,
-                f"{kind}_urls": json.dumps(urls),
-                "modified_at": now
-            }
-            UserLists.update(**update_data).where(UserLists.did == did).execute()
-        except UserLists.DoesNotExist:
-            insert_data = {
-                "did": did,
-                f"{kind}_text": keyword_text,
-                f"{kind}_vector": blob,
-                f"{kind}_dim": dim,
-                f"{kind}_urls": json.dumps(urls),
-                "modified_at": now
-            }
-            UserLists.create(**insert_data)
+    return save_user_lists(did, data)
 
 @st.cache_data(show_spinner=False)
 def load_json(path):
@@ -145,8 +98,9 @@ for kind in ("white_list", "black_list"):
 
 col1, col2, col3 = st.columns(3)
 if col1.button("💾 Save to Database"):
-    save_to_database(did, lists)
-    st.success("Saved to database.")
+    stats = save_to_database(did, lists)
+    st.success(f"Saved to database: {stats['lists_rebuilt']} list(s) rebuilt, "
+               f"{stats['pages_fetched']} page(s) fetched, {stats['pages_reused']} reused from cache.")
 
 if col2.button("📤 Export to JSON"):
     save_json(json_path, lists)
@@ -0,0 +1,219 @@
+# server/user_lists.py
+#
+# A user's white- and blacklists in the form the classifier needs them:
+# vectors decoded from their blobs, normalized and stacked into one matrix,
+# and keywords compiled into one KeywordMatcher. Compiled lists are cached per DID and rebuilt only when
+# the stored row's modified_at changes, so per-commit lookups cost a single
+# indexed query.
+#
+# save_user_lists builds the list vectors from keywords and URLs when lists
+# are edited.
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from server import config
+from server.database import PageCache, UserLists, backend
+from server.logger import setup_logger
+from server.text_utils import KeywordMatcher, clean_texts, fetch_webpage_text
+from server.vector import list_matrix, normalize_vectors, strings_to_vectors
+from server.vector_codec import is_normalized, pack_vector, unpack_vector
+
+logger = setup_logger(__name__)
+
+
+class CompiledLists:
+    __slots__ = ('did', 'modified_at', 'white_text', 'black_text', 'white_words', 'black_words',
+                 'white_vector', 'black_vector', 'matrix', 'matcher')
+
+    def __init__(self, row: UserLists):
+        self.did = row.did
+        self.modified_at = row.modified_at
+        self.white_text = row.white_list_text or ""
+        self.black_text = row.black_list_text or ""
+        self.white_words = list_words(row.white_list_words, self.white_text)
+        self.black_words = list_words(row.black_list_words, self.black_text)
+        self.white_vector = _vector(row.white_list_vector, row.white_list_dim, row.vectors_normalized)
+        self.black_vector = _vector(row.black_list_vector, row.black_list_dim, row.vectors_normalized)
+        self.matrix = (list_matrix(self.white_vector, self.black_vector)
+                       if self.white_vector is not None or self.black_vector is not None else None)
+        self.matcher = KeywordMatcher({"white": self.white_words, "black": self.black_words})
+
+
+def list_words(words_json: Optional[str], text: str) -> List[str]:
+    """Keywords as entered, or the words of the joined text for rows saved before phrases were kept."""
+    if words_json:
+        try:
+            words = json.loads(words_json)
+            if isinstance(words, list):
+                return [str(word) for word in words]
+        except ValueError:
+            pass
+    return (text or "").split()
+
+
+def _vector(blob: Optional[bytes], dim: Optional[int], normalized: bool) -> Optional[np.ndarray]:
+    if not blob or not dim:
+        return None
+    vector = unpack_vector(blob, dim)
+    # Rows saved before vectors were normalized at save time
+    return vector if normalized or is_normalized(blob) else normalize_vectors(vector)
+
+
+_cache: Dict[str, CompiledLists] = {}
+_lock = threading.Lock()
+
+
+def get_user_lists(did: str) -> Optional[CompiledLists]:
+    """Compiled lists for a user, or None if none are stored."""
+    modified_at: Optional[datetime] = (UserLists
+                                       .select(UserLists.modified_at)
+                                       .where(UserLists.did == did)
+                                       .scalar())
+    cached = _cache.get(did)
+    if cached is not None and modified_at is not None and cached.modified_at == modified_at:
+        return cached
+
+    with _lock:
+        row = UserLists.get_or_none(UserLists.did == did)
+        if row is None:
+            _cache.pop(did, None)
+            logger.error(f'🚫 ERROR! white and black lists do not exist for user {did} !!!')
+            return None
+        cached = _cache.get(did)
+        if cached is None or cached.modified_at != row.modified_at:
+            cached = _cache[did] = CompiledLists(row)
+            logger.info(f"🔑 Compiled lists for {did}: {len(cached.white_words)} white and "
+                        f"{len(cached.black_words)} black keywords")
+        return cached
+
+
+# ───────────────────────────────────────────────────────
+# Saving lists
+# ───────────────────────────────────────────────────────
+
+LIST_KINDS = ("white_list", "black_list")
+
+# Pages with less cleaned text than this do not contribute a vector
+_MIN_PAGE_TEXT = 100
+
+
+def _unchanged(row: Optional[UserLists], kind: str, words: List[str], urls: List[str]) -> bool:
+    if row is None or not getattr(row, f"{kind}_vector"):
+        return False
+    return (list_words(getattr(row, f"{kind}_words"), getattr(row, f"{kind}_text")) == words
+            and json.loads(getattr(row, f"{kind}_urls") or "[]") == urls)
+
+
+def save_user_lists(did: str, data: dict) -> dict:
+    """
+    Store a user's lists, given as {"white_list": {"words": [...], "urls": [...]},
+    "black_list": {...}}, with one vector per list averaged from its keywords
+    and the pages its URLs point to.
+
+    Only lists whose words or URLs changed are rebuilt. Their pages are
+    fetched concurrently; a page fetched within PAGE_CACHE_TTL, or whose
+    content hash matches the cached copy, reuses the stored embedding. New
+    page texts are cleaned in one pass and embedded, together with the
+    keywords, in one model call. Returns counts describing the rebuild.
+    """
+    now = datetime.now(timezone.utc)
+    row = UserLists.get_or_none(UserLists.did == did)
+    changed = {kind: (data[kind].get("words", []), data[kind].get("urls", [])) for kind in LIST_KINDS
+               if not _unchanged(row, kind, data[kind].get("words", []), data[kind].get("urls", []))}
+    stats = {"lists_rebuilt": len(changed), "pages_fetched": 0, "pages_reused": 0, "texts_encoded": 0}
+    if not changed:
+        return stats
+
+    urls = list(dict.fromkeys(url for _, kind_urls in changed.values() for url in kind_urls))
+    page_vectors, new_pages = _cached_pages(urls, stats)
+
+    keyword_texts = {kind: " ".join(words) for kind, (words, _) in changed.items() if words}
+    page_texts = [page["text"] for page in new_pages if len(page["text"].strip()) > _MIN_PAGE_TEXT]
+    texts = list(keyword_texts.values()) + page_texts
+    vectors = strings_to_vectors(texts) if texts else []
+    stats["texts_encoded"] = len(texts)
+    keyword_vectors = dict(zip(keyword_texts, vectors[:len(keyword_texts)]))
+    encoded = iter(vectors[len(keyword_texts):])
+    for page in new_pages:
+        page["vector"] = next(encoded) if len(page["text"].strip()) > _MIN_PAGE_TEXT else None
+        page_vectors[page["url"]] = page["vector"]
+
+    with backend.write() as writer:
+        for page in new_pages:
+            fields = {PageCache.content_hash: page["content_hash"], PageCache.text: page["text"],
+                      PageCache.vector: None if page["vector"] is None else pack_vector(page["vector"], normalized=True),
+                      PageCache.model: config.MODEL_NAME, PageCache.fetched_at: page["fetched_at"]}
+            (PageCache
+             .insert(url=page["url"], **{field.name: value for field, value in fields.items()})
+             .on_conflict(conflict_target=[PageCache.url], update=fields)
+             .execute(writer))
+
+        for kind, (words, kind_urls) in changed.items():
+            components = ([keyword_vectors[kind]] if kind in keyword_vectors else []) + \
+                         [page_vectors[url] for url in kind_urls if page_vectors.get(url) is not None]
+            if not components:
+                continue
+
+            # Unit length, so scoring is a plain dot product
+            combined_vec = normalize_vectors(np.mean(components, axis=0))
+            update_data = {
+                f"{kind}_text": " ".join(words),
+                f"{kind}_words": json.dumps(words),
+                f"{kind}_vector": pack_vector(combined_vec, config.VECTOR_STORAGE, normalized=True),
+                f"{kind}_dim": combined_vec.shape[0],
+                f"{kind}_urls": json.dumps(kind_urls),
+                "vectors_normalized": True,
+                "modified_at": now,
+            }
+            updated = UserLists.update(**update_data).where(UserLists.did == did).execute(writer)
+            if not updated:
+                UserLists.insert(did=did, **update_data).execute(writer)
+
+    logger.info(f"💾 Saved lists for {did}: {stats}")
+    return stats
+
+
+def _cached_pages(urls: List[str], stats: dict):
+    """
+    ({url: vector or None} for pages whose cached embedding can be reused,
+    [pages fetched with new content, cleaned and awaiting a vector]).
+    """
+    cached = {page.url: page for page in PageCache.select().where(PageCache.url.in_(urls))} if urls else {}
+    vectors, to_fetch = {}, []
+    for url in urls:
+        page = cached.get(url)
+        if page is not None and page.model == config.MODEL_NAME and time.time() - page.fetched_at < config.PAGE_CACHE_TTL:
+            vectors[url] = unpack_vector(page.vector) if page.vector else None
+            stats["pages_reused"] += 1
+        else:
+            to_fetch.append(url)
+
+    with ThreadPoolExecutor(max_workers=config.LIST_FETCH_WORKERS) as pool:
+        raw_texts = list(pool.map(fetch_webpage_text, to_fetch))
+    stats["pages_fetched"] = len(to_fetch)
+
+    new_pages = []
+    for url, raw in zip(to_fetch, raw_texts):
+        if not raw:
+            continue  # not cached, so the next save tries again
+        content_hash = hashlib.sha256(raw.encode("utf-8")).hexdigest()
+        page = cached.get(url)
+        if page is not None and page.model == config.MODEL_NAME and page.content_hash == content_hash:
+            vectors[url] = unpack_vector(page.vector) if page.vector else None
+            stats["pages_reused"] += 1
+            # Unchanged content: only the fetch time moves on
+            with backend.write() as writer:
+                PageCache.update(fetched_at=time.time()).where(PageCache.url == url).execute(writer)
+            continue
+        new_pages.append({"url": url, "raw": raw, "content_hash": content_hash, "fetched_at": time.time()})
+
+    for page, cleaned in zip(new_pages, clean_texts([page.pop("raw") for page in new_pages])):
+        page["text"] = cleaned
+    return vectors, new_pages
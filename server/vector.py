@@ -5,35 +5,104 @@ import os
 import time
 import numpy as np
 from typing import List, Literal
-from sentence_transformers import SentenceTransformer
-from server.config import MODEL_NAME, SHOW_THRESH, HIDE_THRESH, TEMPERATURE, BIAS_WEIGHT
+from server import memory, metrics
+from server.config import (MODEL_NAME, SHOW_THRESH, HIDE_THRESH, TEMPERATURE, BIAS_WEIGHT,
+                           EMBEDDING_SOCKET, EMBEDDING_RETRY_SECONDS, EMBED_MAX_TOKENS)
+from server.embedding_service import EmbeddingClient, EmbeddingServiceError
 from server.logger import setup_logger
-from server.text_utils import keyword_match_bias
+from server.text_utils import KeywordMatcher
+from server.vector_codec import int8_dot, unpack_vector
 
 logger = setup_logger(__name__)
 
 _model_instance = None
 
-def get_model() -> SentenceTransformer:
+def get_model() -> "SentenceTransformer":
     global _model_instance
     if _model_instance is None:
+        # Imported here so that processes which never embed do not load torch
+        from sentence_transformers import SentenceTransformer
         start = time.time()
         _model_instance = SentenceTransformer(MODEL_NAME)
+        memory.budget.register_fixed('model', _parameter_bytes(_model_instance))
         logger.debug(f"✅ Loaded SentenceTransformer model in {time.time() - start:.2f} seconds")
     return _model_instance
 
+def _parameter_bytes(model) -> int:
+    """Size of the model's weights, counted against the memory budget."""
+    try:
+        return sum(parameter.numel() * parameter.element_size() for parameter in model.parameters())
+    except (AttributeError, TypeError):
+        return 0
+
+_tokenizer_instance = None
+
+def get_tokenizer():
+    """The model's tokenizer, loaded on its own when the embedding service holds the model."""
+    global _tokenizer_instance
+    if _tokenizer_instance is None:
+        if _model_instance is not None or _client is None:
+            _tokenizer_instance = get_model().tokenizer
+        else:
+            try:
+                from transformers import AutoTokenizer
+                _tokenizer_instance = AutoTokenizer.from_pretrained(MODEL_NAME)
+            except Exception as e:
+                # Token counts fall back to an estimate from word counts
+                logger.warning(f"⚠️ Could not load the tokenizer for {MODEL_NAME}: {e}")
+                _tokenizer_instance = False
+    return _tokenizer_instance or None
+
+def max_tokens() -> int:
+    """Tokens the model reads from each input, special tokens included."""
+    if _model_instance is not None and getattr(_model_instance, "max_seq_length", None):
+        return int(_model_instance.max_seq_length)
+    return EMBED_MAX_TOKENS
+
+_client = EmbeddingClient(EMBEDDING_SOCKET) if EMBEDDING_SOCKET else None
+_service_retry_at = 0.0
+
+def _encode_with_service(strings: List[str]):
+    """Vectors from the embedding service, or None when it is not configured or not answering."""
+    global _service_retry_at
+    if _client is None or time.monotonic() < _service_retry_at:
+        return None
+    try:
+        vectors = _client.encode(strings)
+        metrics.increment('embedding.service_texts', len(strings))
+        return vectors
+    except (OSError, EmbeddingServiceError) as e:
+        # Encode in-process until the retry interval has passed
+        _service_retry_at = time.monotonic() + EMBEDDING_RETRY_SECONDS
+        metrics.increment('embedding.service_fallbacks')
+        logger.warning(f"⚠️ Embedding service at {EMBEDDING_SOCKET} unavailable ({e}); encoding in-process")
+        return None
+
 def words_to_vector(words: List[str]) -> np.ndarray:
-    text = " ".join(words)
-    return get_model().encode(text,show_progress_bar=False).astype(np.float32)
+    return string_to_vector(" ".join(words))
 
 def string_to_vector(string: str) -> np.ndarray:
-    return get_model().encode(string,show_progress_bar=False).astype(np.float32)
+    return strings_to_vectors([string])[0]
+
+def strings_to_vectors(strings: List[str], batch_size: int = 64) -> np.ndarray:
+    """Encode many strings in one call; returns an (N, dim) float32 matrix of unit-length rows."""
+    vectors = _encode_with_service(strings) if strings else None
+    if vectors is None:
+        vectors = get_model().encode(strings, batch_size=batch_size, show_progress_bar=False).astype(np.float32)
+    return normalize_vectors(vectors)
+
+def normalize_vectors(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalize along the last axis, so a dot product is the cosine similarity. Zero vectors stay zero."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
 
 def vector_to_blob(vec: np.ndarray) -> bytes:
     return vec.astype(np.float32).tobytes()
 
 def blob_to_vector(blob: bytes, dim: int) -> np.ndarray:
-    return np.frombuffer(blob, dtype=np.float32, count=dim)
+    """Float32 vector from a raw blob or one packed by vector_codec (float32 or int8)."""
+    return unpack_vector(blob, dim)
 
 def cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
     dot_product = np.dot(a, b)
@@ -73,6 +142,162 @@ def classify_post_softmax(prob_white: float, prob_black: float,
     else:
         return "AMBIGUOUS"
 
+# --- Vectorized form of score_post, for many posts and/or many settings ---
+DECISIONS = ("SHOW", "HIDE", "AMBIGUOUS")
+SHOW, HIDE, AMBIGUOUS = 0, 1, 2
+
+def softmax_probabilities(raw_white: np.ndarray,
+                          raw_black: np.ndarray,
+                          white_hit: np.ndarray,
+                          black_hit: np.ndarray,
+                          temperature=TEMPERATURE,
+                          bias_weight=BIAS_WEIGHT) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Same arithmetic as softmax_similarity_scores followed by the keyword bias
+    branches of score_post, applied elementwise. All arguments broadcast, so
+    temperature and bias_weight may be arrays to evaluate several settings at
+    once. white_hit/black_hit say whether the post matched a list keyword.
+    Returns (prob_white, prob_black).
+    """
+    logit_white = np.asarray(raw_white, dtype=np.float64) / temperature
+    logit_black = np.asarray(raw_black, dtype=np.float64) / temperature
+    stable = np.maximum(logit_white, logit_black)
+    exp_white = np.exp(logit_white - stable)
+    exp_black = np.exp(logit_black - stable)
+    total = exp_white + exp_black
+    prob_white = exp_white / total
+    prob_black = exp_black / total
+
+    both = white_hit & black_hit
+    white_only = white_hit & ~black_hit
+    black_only = black_hit & ~white_hit
+
+    # Both lists matched: the biases cancel, probabilities are re-derived from white
+    both_white = np.clip(prob_white + (bias_weight - bias_weight), 0.0, 1.0)
+    white_white = np.minimum(prob_white + bias_weight, 1.0)
+    black_black = np.minimum(prob_black + bias_weight, 1.0)
+
+    new_white = np.where(both, both_white,
+                np.where(white_only, white_white,
+                np.where(black_only, np.maximum(1.0 - black_black, 0.0), prob_white)))
+    new_black = np.where(both, 1.0 - both_white,
+                np.where(white_only, np.maximum(1.0 - white_white, 0.0),
+                np.where(black_only, black_black, prob_black)))
+    return new_white, new_black
+
+def classify_probabilities(prob_white: np.ndarray,
+                           prob_black: np.ndarray,
+                           show_thresh=SHOW_THRESH,
+                           hide_thresh=HIDE_THRESH) -> np.ndarray:
+    """Vectorized classify_post_softmax; returns SHOW/HIDE/AMBIGUOUS codes (indexes into DECISIONS)."""
+    return np.where(prob_white >= show_thresh, SHOW,
+           np.where(prob_black >= hide_thresh, HIDE, AMBIGUOUS)).astype(np.int8)
+
+def list_matrix(white_vec: np.ndarray, black_vec: np.ndarray) -> np.ndarray:
+    """
+    The white and black list vectors stacked into one normalized (2, dim)
+    matrix for score_batch. A missing list vector becomes a zero row, which
+    scores a cosine of 0 like cosine_similarity does for a zero vector.
+    """
+    present = white_vec if white_vec is not None else black_vec
+    if present is None:
+        raise ValueError("at least one list vector is required")
+    rows = [np.zeros_like(present, dtype=np.float32) if vec is None else vec for vec in (white_vec, black_vec)]
+    return normalize_vectors(np.stack(rows))
+
+def score_batch(post_vecs: np.ndarray,
+                matrix: np.ndarray,
+                white_hit: np.ndarray,
+                black_hit: np.ndarray,
+                show_thresh: float = SHOW_THRESH,
+                hide_thresh: float = HIDE_THRESH,
+                temperature: float = TEMPERATURE,
+                bias_weight: float = BIAS_WEIGHT) -> dict:
+    """
+    score_post for a batch of posts. Both cosine similarities of every post
+    come from one (N, dim) @ (dim, 2) product against list_matrix, which is
+    exact for the unit-length vectors strings_to_vectors returns; softmax,
+    keyword bias and thresholds are applied to whole arrays. white_hit and
+    black_hit say per post whether a list keyword matched.
+
+    Returns arrays raw_white, raw_black, prob_white, prob_black and decision
+    codes (indexes into DECISIONS). Probabilities can differ from score_post
+    in the last bits, because the dot product is summed in a different order,
+    so a decision can only differ for a post within ~1e-6 of a threshold.
+    """
+    raw = np.atleast_2d(np.asarray(post_vecs, dtype=np.float32)) @ matrix.T
+    return score_similarities(raw, white_hit, black_hit, show_thresh=show_thresh, hide_thresh=hide_thresh,
+                              temperature=temperature, bias_weight=bias_weight)
+
+def score_batch_int8(post_vecs: np.ndarray,
+                     post_scales: np.ndarray,
+                     matrix: np.ndarray,
+                     matrix_scales: np.ndarray,
+                     white_hit: np.ndarray,
+                     black_hit: np.ndarray,
+                     **settings) -> dict:
+    """
+    score_batch for int8-quantized posts and lists (see vector_codec): the
+    similarities are accumulated in int32 and rescaled once per pair, so
+    stored int8 vectors are scored without a float32 copy.
+    """
+    raw = int8_dot(np.atleast_2d(post_vecs), np.atleast_1d(post_scales), matrix, matrix_scales)
+    return score_similarities(raw, white_hit, black_hit, **settings)
+
+def score_batch_feeds(post_vecs: np.ndarray,
+                      matrices: np.ndarray,
+                      white_hit: np.ndarray,
+                      black_hit: np.ndarray,
+                      show_thresh: np.ndarray,
+                      hide_thresh: np.ndarray,
+                      temperature: np.ndarray,
+                      bias_weight: np.ndarray) -> dict:
+    """
+    score_batch for several feeds at once. matrices is (F, 2, dim), one
+    list_matrix per feed, and every similarity comes from a single
+    (N, dim) @ (dim, 2F) product. white_hit and black_hit are (N, F); the
+    settings are one value per feed. The arrays returned are (N, F).
+    """
+    post_vecs = np.atleast_2d(np.asarray(post_vecs, dtype=np.float32))
+    n_feeds, _, dim = matrices.shape
+    raw = (post_vecs @ matrices.reshape(2 * n_feeds, dim).T).reshape(len(post_vecs), n_feeds, 2)
+    return score_similarities(raw, white_hit, black_hit,
+                              show_thresh=np.asarray(show_thresh), hide_thresh=np.asarray(hide_thresh),
+                              temperature=np.asarray(temperature), bias_weight=np.asarray(bias_weight))
+
+def score_similarities(raw: np.ndarray,
+                       white_hit: np.ndarray,
+                       black_hit: np.ndarray,
+                       show_thresh: float = SHOW_THRESH,
+                       hide_thresh: float = HIDE_THRESH,
+                       temperature: float = TEMPERATURE,
+                       bias_weight: float = BIAS_WEIGHT) -> dict:
+    """Softmax, keyword bias and thresholds for (..., 2) white/black cosine similarities."""
+    prob_white, prob_black = softmax_probabilities(raw[..., 0], raw[..., 1],
+                                                   np.asarray(white_hit, dtype=bool),
+                                                   np.asarray(black_hit, dtype=bool),
+                                                   temperature=temperature, bias_weight=bias_weight)
+    return {
+        "raw_white": raw[..., 0],
+        "raw_black": raw[..., 1],
+        "prob_white": prob_white,
+        "prob_black": prob_black,
+        "decision": classify_probabilities(prob_white, prob_black, show_thresh=show_thresh, hide_thresh=hide_thresh),
+    }
+
+def keyword_hits(post_text: str,
+                 whitelist_words: List[str] = (),
+                 blacklist_words: List[str] = (),
+                 keyword_matcher: KeywordMatcher = None) -> dict:
+    """
+    White- and blacklist keywords found in the cleaned post text, as
+    {"white": [...], "black": [...]}. Pass a KeywordMatcher compiled once per
+    list change; plain word lists are compiled on the spot, without lemmas.
+    """
+    if keyword_matcher is None:
+        keyword_matcher = KeywordMatcher({"white": whitelist_words, "black": blacklist_words}, lemmatize=False)
+    return keyword_matcher.match(post_text.split()) if post_text else {"white": [], "black": []}
+
 def score_post(post_vec: np.ndarray,
                whitelist_vec: np.ndarray,
                blacklist_vec: np.ndarray,
@@ -81,20 +306,26 @@ def score_post(post_vec: np.ndarray,
                blacklist_words: List[str] = [],
                show_thresh: float = SHOW_THRESH,
                hide_thresh: float = HIDE_THRESH,
-               temperature: float = TEMPERATURE) -> dict:
+               temperature: float = TEMPERATURE,
+               bias_weight: float = BIAS_WEIGHT,
+               keyword_matcher: KeywordMatcher = None) -> dict:
     """
     Softmax-based scoring to classify post as SHOW / HIDE / AMBIGUOUS.
-    Optionally biases the probability based on keyword matches.
-    Returns a dict with softmax scores, raw cosine scores, and final decision.
+    Optionally biases the probability based on keyword matches, taken from
+    keyword_matcher when given and from the word lists otherwise.
+    Returns a dict with softmax scores, raw cosine scores, the matched
+    keywords and final decision.
     """
-    scores = softmax_similarity_scores(post_vec, whitelist_vec, blacklist_vec, temperature=TEMPERATURE)
+    scores = softmax_similarity_scores(post_vec, whitelist_vec, blacklist_vec, temperature=temperature)
 
     if post_text:
-        white_bias = keyword_match_bias(whitelist_words, post_text)
-        black_bias = keyword_match_bias(blacklist_words, post_text)
+        hits = keyword_hits(post_text, whitelist_words, blacklist_words, keyword_matcher)
+        scores["white_hits"], scores["black_hits"] = hits["white"], hits["black"]
+        white_bias = bias_weight if hits["white"] else 0.0
+        black_bias = bias_weight if hits["black"] else 0.0
         # If both biases apply
         if white_bias > 0.0 and black_bias > 0.0:
-            logger.debug(f"⚖️  Both whitelist (+{white_bias:.2f}) and blacklist (+{black_bias:.2f}) keyword biases matched")
+            logger.debug("⚖️  Both whitelist (+%.2f) and blacklist (+%.2f) keyword biases matched", white_bias, black_bias)
             net_bias = white_bias - black_bias
             scores["prob_white"] = np.clip(scores["prob_white"] + net_bias, 0.0, 1.0)
             scores["prob_black"] = 1.0 - scores["prob_white"]
@@ -102,19 +333,41 @@ def score_post(post_vec: np.ndarray,
         elif white_bias > 0.0:
             scores["prob_white"] = min(scores["prob_white"] + white_bias, 1.0)
             scores["prob_black"] = max(1.0 - scores["prob_white"], 0.0)
-            logger.debug(f"✅ Whitelist keyword bias +{white_bias:.2f} applied")
+            logger.debug("✅ Whitelist keyword bias +%.2f applied", white_bias)
         # Apply blacklist bias
         elif black_bias > 0.0:
             scores["prob_black"] = min(scores["prob_black"] + black_bias, 1.0)
             scores["prob_white"] = max(1.0 - scores["prob_black"], 0.0)
-            logger.debug(f"⚠️  Blacklist keyword bias +{black_bias:.2f} applied")
+            logger.debug("⚠️  Blacklist keyword bias +%.2f applied", black_bias)
 
     scores["decision"] = classify_post_softmax(scores["prob_white"], scores["prob_black"],
-                                               show_thresh=SHOW_THRESH,
-                                               hide_thresh=HIDE_THRESH)
+                                               show_thresh=show_thresh,
+                                               hide_thresh=hide_thresh)
 
     # Pack model hyperparameters within dictionary object
-    scores["show_threshold"] = SHOW_THRESH
-    scores["hide_threshold"] = HIDE_THRESH
-    scores["bias_weight"] = BIAS_WEIGHT
+    scores["show_threshold"] = show_thresh
+    scores["hide_threshold"] = hide_thresh
+    scores["bias_weight"] = bias_weight
     return scores
+
+def score_post_keywords(post_text: str,
+                        whitelist_words: List[str],
+                        blacklist_words: List[str],
+                        bias_weight: float = BIAS_WEIGHT,
+                        keyword_matcher: KeywordMatcher = None) -> dict:
+    """
+    Embedding-free fallback used when the consumer is shedding load: a post
+    matching only whitelist keywords is shown, one matching only blacklist
+    keywords is hidden, anything else is AMBIGUOUS.
+    """
+    hits = keyword_hits(post_text, whitelist_words, blacklist_words, keyword_matcher)
+    white_bias = bias_weight if hits["white"] else 0.0
+    black_bias = bias_weight if hits["black"] else 0.0
+    if white_bias > 0.0 and black_bias == 0.0:
+        decision = "SHOW"
+    elif black_bias > 0.0 and white_bias == 0.0:
+        decision = "HIDE"
+    else:
+        decision = "AMBIGUOUS"
+    return {"white_bias": white_bias, "black_bias": black_bias, "white_hits": hits["white"],
+            "black_hits": hits["black"], "decision": decision, "keyword_only": True}
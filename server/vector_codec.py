@@ -0,0 +1,120 @@
+# server/vector_codec.py
+#
+# Storage format for embedding vectors. A stored vector is a 12-byte header
+# followed by its components, either float32 or int8 scaled per vector:
+#
+#   magic  b"VEC" + format version (1)        4 bytes
+#   dtype  0 = float32, 1 = int8              1 byte
+#   flags  bit 0: vector has unit length      1 byte
+#   dim    number of components               2 bytes, little-endian
+#   scale  int8 only: value of one step       4 bytes, float32
+#
+# An int8 vector takes a quarter of the space of a float32 one, and a batch
+# of them can be scored with int32 accumulation and one rescale per row.
+# Blobs written before the header existed are raw float32; unpack_vector
+# still reads them when given the dim stored next to them.
+#
+# This module only needs NumPy, so the database layer can use it without
+# loading the model.
+import struct
+from typing import Optional, Tuple
+
+import numpy as np
+
+MAGIC = b"VEC\x01"
+FLOAT32, INT8 = 0, 1
+STORAGE_FORMATS = {"float32": FLOAT32, "int8": INT8}
+_FLAG_NORMALIZED = 1
+_HEADER = struct.Struct("<4sBBHf")
+_DTYPES = {FLOAT32: np.float32, INT8: np.int8}
+
+
+def quantize_int8(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Symmetric per-row int8 quantization: each row is divided by
+    max(|row|) / 127 and rounded. Returns (int8 rows, float32 scales); rows
+    that are all zero get a scale of 0.
+    """
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    scales = np.abs(vectors).max(axis=1) / 127
+    quantized = np.divide(vectors, scales[:, None], out=np.zeros_like(vectors), where=scales[:, None] > 0)
+    return np.rint(quantized).astype(np.int8), scales.astype(np.float32)
+
+
+def dequantize_int8(quantized: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    return quantized.astype(np.float32) * np.asarray(scales, dtype=np.float32)[..., None]
+
+
+def int8_dot(rows: np.ndarray, row_scales: np.ndarray, targets: np.ndarray, target_scales: np.ndarray) -> np.ndarray:
+    """
+    (N, K) dot products of int8 rows against int8 targets, accumulated in
+    int32 and rescaled once per pair. Equals dequantize-then-dot up to float
+    rounding, without materializing float32 copies of the rows.
+    """
+    accumulated = rows.astype(np.int32) @ targets.astype(np.int32).T
+    return accumulated * (np.asarray(row_scales, dtype=np.float32)[:, None]
+                          * np.asarray(target_scales, dtype=np.float32)[None, :])
+
+
+def pack_vector(vector: np.ndarray, storage: str = "float32", normalized: bool = False) -> bytes:
+    """Header plus components in the given storage format ("float32" or "int8")."""
+    dtype = STORAGE_FORMATS[storage]
+    vector = np.asarray(vector, dtype=np.float32).ravel()
+    flags = _FLAG_NORMALIZED if normalized else 0
+    if dtype == INT8:
+        quantized, scales = quantize_int8(vector)
+        return _HEADER.pack(MAGIC, dtype, flags, vector.size, float(scales[0])) + quantized.tobytes()
+    return _HEADER.pack(MAGIC, dtype, flags, vector.size, 1.0) + vector.tobytes()
+
+
+def _as_bytes(blob) -> bytes:
+    # PostgreSQL returns BYTEA as a memoryview of format "c", which neither
+    # compares equal to bytes nor suits np.frombuffer
+    return blob if isinstance(blob, bytes) else bytes(blob)
+
+
+def has_header(blob: bytes) -> bool:
+    blob = _as_bytes(blob)
+    if len(blob) < _HEADER.size or blob[:4] != MAGIC:
+        return False
+    _, dtype, _, dim, _ = _HEADER.unpack_from(blob)
+    # A raw float32 blob starting with the magic bytes would not have this exact length
+    return dtype in _DTYPES and len(blob) == _HEADER.size + dim * np.dtype(_DTYPES[dtype]).itemsize
+
+
+def unpack_header(blob: bytes) -> Optional[dict]:
+    """The header fields of a packed vector, or None for a raw float32 blob."""
+    blob = _as_bytes(blob)
+    if not has_header(blob):
+        return None
+    _, dtype, flags, dim, scale = _HEADER.unpack_from(blob)
+    return {"dtype": "int8" if dtype == INT8 else "float32", "dim": dim, "scale": scale,
+            "normalized": bool(flags & _FLAG_NORMALIZED)}
+
+
+def unpack_int8(blob: bytes) -> Tuple[np.ndarray, float]:
+    """(int8 components, scale) of an int8 packed vector, for scoring without dequantizing."""
+    blob = _as_bytes(blob)
+    header = unpack_header(blob)
+    if header is None or header["dtype"] != "int8":
+        raise ValueError("not an int8 packed vector")
+    return np.frombuffer(blob, dtype=np.int8, offset=_HEADER.size, count=header["dim"]), header["scale"]
+
+
+def unpack_vector(blob: bytes, dim: Optional[int] = None) -> np.ndarray:
+    """Float32 vector from a packed blob, or from a raw float32 blob of the given dim."""
+    blob = _as_bytes(blob)
+    header = unpack_header(blob)
+    if header is None:
+        if dim is None:
+            raise ValueError("raw float32 vector blob needs its dim")
+        return np.frombuffer(blob, dtype=np.float32, count=dim)
+    if header["dtype"] == "int8":
+        quantized = np.frombuffer(blob, dtype=np.int8, offset=_HEADER.size, count=header["dim"])
+        return quantized.astype(np.float32) * np.float32(header["scale"])
+    return np.frombuffer(blob, dtype=np.float32, offset=_HEADER.size, count=header["dim"])
+
+
+def is_normalized(blob: bytes) -> bool:
+    header = unpack_header(blob)
+    return bool(header and header["normalized"])
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+#
+# bench_embedding_inputs.py
+#
+# What the model is given to embed for each post, comparing the previous
+# input (post text, alt text and linked page joined into one string and cut
+# off by the model at max_seq_length) with per-source token budgets
+# (server.embedding_inputs), with and without chunking of long pages.
+#
+# $ python3 -m tests.bench_embedding_inputs --posts 2000
+# $ python3 -m tests.bench_embedding_inputs --corpus posts.jsonl
+#
+# The corpus is a seeded synthetic mix of short posts, posts with long alt
+# text and posts linking long pages, or a JSONL file of {"post", "alt",
+# "page"} raw texts. For each mode: throughput, decisions that agree with
+# the previous input, posts with a source cut short, and the share of the
+# model's work spent on padding when batches are taken in arrival order
+# versus sorted by length.
+#
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+os.environ.setdefault("HOSTNAME", "localhost")
+os.environ.setdefault("FEED_URI", "at://did:plc:test/app.bsky.feed.generator/test")
+
+from server import config, metrics
+from server.embedding_inputs import SOURCES, TokenCounter, build_inputs, embed_posts, parse_budgets
+from server.text_utils import clean_texts
+from server.vector import (DECISIONS, get_tokenizer, list_matrix, max_tokens, score_batch,
+                           string_to_vector, strings_to_vectors)
+
+MODES = ("combined", "budget", "budget_chunks")
+WORDS = ("garden compost tomato seedling mulch soil harvest greenhouse pruning orchard bean herb "
+         "election vote senate policy campaign war debate minister coffee train weather photo "
+         "city river morning friend music film book school game market").split()
+
+
+def synthetic_corpus(count: int, seed: int) -> list:
+    """Mostly short posts; a quarter with long alt text, a quarter linking a long page."""
+    rng = random.Random(seed)
+
+    def words(n):
+        return " ".join(rng.choice(WORDS) for _ in range(n))
+
+    corpus = []
+    for i in range(count):
+        post = {"post": words(rng.randint(5, 40)), "alt": "", "page": ""}
+        if i % 4 == 1:
+            post["alt"] = words(rng.randint(60, 200))
+        if i % 4 == 2:
+            post["page"] = words(rng.randint(200, 1500))
+        corpus.append(post)
+    return corpus
+
+
+def load_corpus(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    cleaned = clean_texts([row.get(source) or "" for row in rows for source in SOURCES])
+    return [dict(zip(SOURCES, cleaned[i:i + len(SOURCES)])) for i in range(0, len(cleaned), len(SOURCES))]
+
+
+def padding_ratio(lengths: list, batch_size: int) -> float:
+    """Share of padded positions when the texts are encoded in batches of batch_size, in this order."""
+    padded = sum(max(batch) * len(batch) for batch in
+                 (lengths[i:i + batch_size] for i in range(0, len(lengths), batch_size)))
+    return 1 - sum(lengths) / padded if padded else 0.0
+
+
+def run_mode(mode: str, corpus: list, matrix, counter: TokenCounter, batch_size: int) -> dict:
+    limit = max_tokens()
+    truncated_before = metrics.snapshot()["counters"].get("embedding.sources_truncated", 0)
+    started = time.perf_counter()
+    if mode == "combined":
+        texts = [" ".join(filter(None, (post[source] for source in SOURCES))) for post in corpus]
+        vectors = strings_to_vectors(texts)
+    else:
+        vectors = embed_posts(corpus, chunk_pages=mode == "budget_chunks", counter=counter)
+    elapsed = time.perf_counter() - started
+
+    if mode == "combined":
+        # The model cuts the joined text off after its first max_seq_length tokens
+        truncated = sum(counter.split(text, limit - 2)[1] != "" for text in texts)
+    else:
+        truncated = int(metrics.snapshot()["counters"].get("embedding.sources_truncated", 0) - truncated_before)
+        texts, _ = build_inputs(corpus, chunk_pages=mode == "budget_chunks", counter=counter)
+
+    no_hits = [False] * len(corpus)
+    decisions = [DECISIONS[code] for code in score_batch(vectors, matrix, no_hits, no_hits)["decision"]]
+    # Tokens the model actually reads of each text, [CLS] and [SEP] included
+    lengths = [counter.split(text, limit - 2)[2] + 2 for text in texts]
+    return {
+        "mode": mode,
+        "posts_per_second": round(len(corpus) / elapsed, 1),
+        "texts_embedded": len(texts),
+        "sources_truncated": truncated,
+        "padding_arrival_order": round(padding_ratio(lengths, batch_size), 3),
+        "padding_length_sorted": round(padding_ratio(sorted(lengths), batch_size), 3),
+        "decisions": decisions,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embedding inputs with and without per-source token budgets.")
+    parser.add_argument("--posts", type=int, default=2000, help="Synthetic posts (default: 2000)")
+    parser.add_argument("--seed", type=int, default=7, help="Seed of the synthetic corpus (default: 7)")
+    parser.add_argument("--corpus", help="JSONL file of {\"post\", \"alt\", \"page\"} texts instead of the synthetic corpus")
+    parser.add_argument("--batch-size", type=int, default=32, help="Model batch size for the padding figures (default: 32)")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus) if args.corpus else synthetic_corpus(args.posts, args.seed)
+    matrix = list_matrix(string_to_vector("garden compost tomato seedling harvest"),
+                         string_to_vector("election vote senate campaign war"))
+    counter = TokenCounter(get_tokenizer())
+    print(f"budgets {parse_budgets(config.EMBED_TOKEN_BUDGETS)}, max tokens {max_tokens()}, "
+          f"{'fast tokenizer' if counter.tokenizer else 'word estimate'}", file=sys.stderr)
+
+    results = [run_mode(mode, corpus, matrix, counter, args.batch_size) for mode in MODES]
+    baseline = results[0]["decisions"]
+    for result in results:
+        decisions = result.pop("decisions")
+        result["agreement_with_combined"] = round(float(np.mean([a == b for a, b in zip(decisions, baseline)])), 4)
+        result["truncated_pct"] = round(100 * result["sources_truncated"] / len(corpus), 1)
+
+    columns = [key for key in results[0] if key != "mode"]
+    widths = [len(column) + 2 for column in columns]
+    print(f"{'mode':<15}" + "".join(f"{column:>{width}}" for column, width in zip(columns, widths)))
+    for result in results:
+        print(f"{result['mode']:<15}" + "".join(f"{str(result[column]):>{width}}" for column, width in zip(columns, widths)))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+#
+# bench_list_rebuild.py
+#
+# Time to rebuild a user's list vectors from keywords and URLs, comparing
+# server.user_lists.save_user_lists with the previous one-URL-at-a-time loop
+# of user_list_tool. A local HTTP server on 127.0.0.2 (the fetcher refuses
+# 127.0.0.1) serves the pages, each after a delay standing in for a slow
+# site.
+#
+# $ python3 -m tests.bench_list_rebuild --urls 50 --delay 0.5
+#
+# Rebuilds measured: the previous loop, a cold save (empty page cache), the
+# same save again (nothing changed), a save after one URL was added, and a
+# save of the same URLs once the cache has expired (pages fetched again, but
+# unchanged content is not cleaned or embedded again).
+#
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+os.environ.setdefault("HOSTNAME", "localhost")
+os.environ.setdefault("FEED_URI", "at://did:plc:test/app.bsky.feed.generator/test")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.gettempdir()}/bench_list_rebuild.db")
+
+from server import config, user_lists
+from server.database import PageCache, UserLists, backend
+from server.text_utils import clean_text, get_webpage_text
+from server.vector import string_to_vector
+
+DID = "did:plc:bench-lists"
+TOPICS = ["compost", "seedlings", "pruning", "greenhouse", "irrigation", "mulch", "soil", "orchard"]
+
+
+class _PageHandler(BaseHTTPRequestHandler):
+    delay = 0.0
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        n = int(self.path.strip("/").split("/")[-1] or 0)
+        topic = TOPICS[n % len(TOPICS)]
+        body = (f"<html><head><title>{topic}</title><script>var x = 1;</script></head><body>"
+                f"<nav>Home About</nav><p>Page {n} is a long guide to {topic} in the home garden. "
+                f"It explains how {topic} affects tomatoes, beans and herbs through the seasons, "
+                f"which mistakes beginners make with {topic}, and how to plan a bed around it.</p>"
+                f"</body></html>").encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def legacy_save(urls: list, words: list) -> None:
+    """The rebuild loop user_list_tool ran before save_user_lists, vectors only."""
+    vectors = [string_to_vector(" ".join(words))]
+    for url in urls:
+        raw = get_webpage_text(url)
+        if raw and len(raw.strip()) > 100:
+            vectors.append(string_to_vector(clean_text(raw)))
+    sum(vectors) / len(vectors)
+
+
+def timed(label: str, fn) -> dict:
+    started = time.perf_counter()
+    stats = fn() or {}
+    return {"rebuild": label, "seconds": round(time.perf_counter() - started, 3), **stats}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List vector rebuild time, before and after save_user_lists.")
+    parser.add_argument("--urls", type=int, default=50, help="URLs in the whitelist (default: 50)")
+    parser.add_argument("--delay", type=float, default=0.5, help="Seconds each page takes to respond (default: 0.5)")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    _PageHandler.delay = args.delay
+    server = ThreadingHTTPServer(("127.0.0.2", 0), _PageHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.2:{server.server_address[1]}"
+    urls = [f"{base}/page/{n}" for n in range(args.urls)]
+    words = ["gardening", "compost", "raised beds"]
+
+    with backend.write() as writer:
+        UserLists.delete().where(UserLists.did == DID).execute(writer)
+        PageCache.delete().execute(writer)
+    string_to_vector("warm up the model")
+
+    def lists(white_urls):
+        return {"white_list": {"words": words, "urls": white_urls},
+                "black_list": {"words": ["politics"], "urls": []}}
+
+    results = [
+        timed("previous_loop", lambda: legacy_save(urls, words)),
+        timed("cold", lambda: user_lists.save_user_lists(DID, lists(urls))),
+        timed("unchanged", lambda: user_lists.save_user_lists(DID, lists(urls))),
+        timed("one_url_added", lambda: user_lists.save_user_lists(DID, lists(urls + [f"{base}/page/{args.urls}"]))),
+    ]
+    config.PAGE_CACHE_TTL = 0
+    results.append(timed("cache_expired", lambda: user_lists.save_user_lists(DID, lists(urls))))
+    server.shutdown()
+
+    columns = ["seconds", "lists_rebuilt", "pages_fetched", "pages_reused", "texts_encoded"]
+    print(f"{'rebuild':<16}" + "".join(f"{column:>16}" for column in columns))
+    for result in results:
+        print(f"{result['rebuild']:<16}" + "".join(f"{str(result.get(column, '-')):>16}" for column in columns))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
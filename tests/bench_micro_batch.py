@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+#
+# bench_micro_batch.py
+#
+# Throughput and latency of live classification with and without the
+# cross-commit micro-batcher (server.micro_batch). Synthetic one-post commits
+# are replayed at a fixed arrival rate through operations_callback, either
+# one commit at a time as before or through a MicroBatcher, against a scratch
+# SQLite database and lists built with the configured model.
+#
+# $ python3 -m tests.bench_micro_batch --posts 2000 --rate 200
+#
+# Latency is post-to-feed: from the moment a commit is due to arrive until
+# its batch has been written. Duplicate detection is disabled so every post
+# is cleaned and embedded.
+#
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+os.environ.setdefault("HOSTNAME", "localhost")
+os.environ.setdefault("FEED_URI", "at://did:plc:test/app.bsky.feed.generator/test")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.gettempdir()}/bench_micro_batch.db")
+os.environ.setdefault("DEFAULT_DID", "did:plc:bench")
+os.environ["DEDUP_ENABLED"] = "false"
+
+from server import config, data_filter, embedding_inputs
+from server.data_stream import _get_ops_by_type
+from server.database import Post, UserLists, backend
+from server.micro_batch import MicroBatcher
+from server.vector import string_to_vector, vector_to_blob
+from tests.bench_post_records import synthetic_commits
+
+MODES = ("per_commit", "micro_batch")
+
+
+def seed_lists() -> None:
+    white = string_to_vector("garden compost tomato seedling")
+    black = string_to_vector("politics election war")
+    with backend.write() as conn:
+        Post.delete().execute(conn)
+        UserLists.delete().where(UserLists.did == config.DEFAULT_DID).execute(conn)
+        UserLists.insert(did=config.DEFAULT_DID, white_list_text="garden compost tomato",
+                         black_list_text="politics election",
+                         white_list_vector=vector_to_blob(white), white_list_dim=len(white),
+                         black_list_vector=vector_to_blob(black), black_list_dim=len(black)).execute(conn)
+
+
+def count_encodes() -> list:
+    """Count the embedding calls operations_callback makes."""
+    calls = [0]
+    encode = embedding_inputs.strings_to_vectors
+
+    def counted(strings, *args, **kwargs):
+        calls[0] += 1
+        return encode(strings, *args, **kwargs)
+
+    embedding_inputs.strings_to_vectors = counted
+    return calls
+
+
+def replay(mode: str, commits: list, rate: float, calls: list) -> dict:
+    with backend.write() as conn:
+        Post.delete().execute(conn)
+    ops = [_get_ops_by_type(commit) for commit in commits]
+    calls[0] = 0
+    latencies = []
+    batcher = MicroBatcher(data_filter.operations_callback) if mode == "micro_batch" else None
+
+    started = time.monotonic()
+    for i, commit_ops in enumerate(ops):
+        due = started + i / rate
+        delay = due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        if batcher is not None:
+            batcher.add(commit_ops, i)
+        else:
+            data_filter.operations_callback(commit_ops)
+            latencies.append(time.monotonic() - due)
+    if batcher is not None:
+        batcher.flush()
+    elapsed = time.monotonic() - started
+
+    result = {"mode": mode, "posts": len(ops), "arrival_rate": rate,
+              "throughput_posts_per_second": round(len(ops) / elapsed, 1), "encode_calls": calls[0]}
+    if batcher is not None:
+        stats = batcher.stats()
+        batcher.stop()
+        result.update({"mean_batch_size": stats["mean_batch_size"],
+                       "target_size": stats["target_size"], "wait_ms": stats["wait_ms"],
+                       **{f"latency_{k}_ms": v for k, v in stats["latency_ms"].items()}})
+    else:
+        p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+        result.update({"mean_batch_size": 1.0, "target_size": 1, "wait_ms": 0.0,
+                       "latency_p50_ms": round(p50, 2), "latency_p95_ms": round(p95, 2),
+                       "latency_p99_ms": round(p99, 2), "latency_max_ms": round(max(latencies) * 1000, 2)})
+    result["posts_stored"] = Post.select().count()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Live classification with and without cross-commit micro-batching.")
+    parser.add_argument("--posts", type=int, default=2000, help="Synthetic one-post commits (default: 2000)")
+    parser.add_argument("--rate", type=float, nargs="+", default=[50.0, 200.0],
+                        help="Arrival rates to replay at, in commits per second (default: 50 200)")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    seed_lists()
+    calls = count_encodes()
+    commits = synthetic_commits(args.posts)
+    data_filter.operations_callback(_get_ops_by_type(commits[0]))  # load the model before timing
+
+    results = [replay(mode, commits, rate, calls) for rate in args.rate for mode in MODES]
+
+    columns = [key for key in results[0] if key not in ("mode", "posts")]
+    widths = [len(column) + 2 for column in columns]
+    print(f"{'mode':<14}" + "".join(f"{column:>{width}}" for column, width in zip(columns, widths)))
+    for result in results:
+        print(f"{result['mode']:<14}" + "".join(f"{str(result[column]):>{width}}" for column, width in zip(columns, widths)))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
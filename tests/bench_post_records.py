@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+#
+# bench_post_records.py
+#
+# Memory benchmark for the created-post path: decode synthetic firehose
+# commits, hold the decoded posts the way the catch-up buffer does, then
+# build the rows written for SHOW posts. Compares the PostRecord path in
+# server.data_stream with the previous path (CAR.from_bytes, AtUri, a full
+# pydantic record, a create_info dict and a second row dict per post).
+#
+# $ python3 -m tests.bench_post_records --posts 10000
+#
+# Each variant runs in its own process so peak RSS is comparable. Results are
+# reported per 10k posts. Classification is left out: it costs the same on
+# both paths.
+#
+import argparse
+import hashlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+from datetime import datetime, timezone
+
+os.environ.setdefault("HOSTNAME", "localhost")
+os.environ.setdefault("FEED_URI", "at://did:plc:test/app.bsky.feed.generator/test")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.gettempdir()}/bench_post_records.db")
+
+import libipld
+from atproto import AtUri, CAR, models
+
+VARIANTS = ("legacy", "post_record")
+
+
+def _varint(n: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte, n = n & 0x7F, n >> 7
+        if n:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _car(blocks: list) -> tuple:
+    """A CARv1 file holding the given dag-cbor blocks; returns (bytes, CID strings)."""
+    sections, cids = [], []
+    for block in blocks:
+        encoded = libipld.encode_dag_cbor(block)
+        cid = bytes([1, 0x71, 0x12, 0x20]) + hashlib.sha256(encoded).digest()
+        cids.append(libipld.encode_cid(cid))
+        sections.append(_varint(len(cid) + len(encoded)) + cid + encoded)
+    root = bytes([1, 0x71, 0x12, 0x20]) + hashlib.sha256(b"root").digest()
+    # {"roots": [CID link], "version": 1}; libipld cannot encode a CID link itself
+    header = b"\xa2\x65roots\x81\xd8\x2a\x58\x25\x00" + root + b"\x67version\x01"
+    return _varint(len(header)) + header + b"".join(sections), cids
+
+
+def synthetic_commits(count: int) -> list:
+    """One post per commit, a third of them replies and a third with an image."""
+    now = datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+    commits = []
+    for i in range(count):
+        repo = f"did:plc:bench{i % 997:05d}"
+        record = {
+            "$type": "app.bsky.feed.post",
+            "text": f"Post number {i} about gardening, compost and tomato seedlings in spring",
+            "createdAt": now,
+            "langs": ["en"],
+        }
+        if i % 3 == 1:
+            parent = {"uri": f"at://did:plc:bench{(i + 1) % 997:05d}/app.bsky.feed.post/{i - 1:013d}",
+                      "cid": "bafyreibench"}
+            record["reply"] = {"root": parent, "parent": parent}
+        elif i % 3 == 2:
+            record["embed"] = {"$type": "app.bsky.embed.images",
+                               "images": [{"alt": f"Seedlings on a windowsill {i}", "image": {}}]}
+        blocks, cids = _car([record])
+        commits.append(models.ComAtprotoSyncSubscribeRepos.Commit(
+            seq=i, rebase=False, too_big=False, repo=repo, commit=cids[0], rev=str(i), since=None,
+            blocks=blocks, ops=[models.ComAtprotoSyncSubscribeRepos.RepoOp(
+                action="create", path=f"app.bsky.feed.post/{i:013d}", cid=cids[0])],
+            blobs=[], time=now,
+        ))
+    return commits
+
+
+def legacy_ops(commit) -> defaultdict:
+    """The created-post path before PostRecord, kept here for comparison."""
+    operation_by_type = defaultdict(lambda: {"created": [], "deleted": []})
+    car = CAR.from_bytes(commit.blocks)
+    for op in commit.ops:
+        uri = AtUri.from_str(f"at://{commit.repo}/{op.path}")
+        if op.action == "create" and op.cid:
+            create_info = {"uri": str(uri), "cid": str(op.cid), "author": commit.repo}
+            record = models.get_or_create(car.blocks.get(op.cid), strict=False)
+            if record is not None and models.is_record_type(record, models.AppBskyFeedPost):
+                operation_by_type[uri.collection]["created"].append({"record": record, **create_info})
+    return operation_by_type
+
+
+def legacy_row(created_post: dict) -> dict:
+    record = created_post["record"]
+    reply_root = reply_parent = None
+    if record.reply:
+        reply_root = record.reply.root.uri
+        reply_parent = record.reply.parent.uri
+    return {
+        "uri": created_post["uri"],
+        "cid": created_post["cid"],
+        "reply_parent": reply_parent,
+        "reply_root": reply_root,
+        "indexed_at": created_post.get("indexed_at") or datetime.now(timezone.utc),
+    }
+
+
+def measure(variant: str, posts: int) -> dict:
+    from server.data_stream import _get_ops_by_type
+
+    decode = legacy_ops if variant == "legacy" else _get_ops_by_type
+    row = legacy_row if variant == "legacy" else (lambda post: post.row())
+    commits = synthetic_commits(posts)
+
+    tracemalloc.start()
+    baseline, _ = tracemalloc.get_traced_memory()
+    before = tracemalloc.take_snapshot()
+    started = time.perf_counter()
+
+    # Hold every decoded post at once, as a catch-up batch or a slow consumer does
+    decoded = [post for commit in commits for post in decode(commit)[models.ids.AppBskyFeedPost]["created"]]
+    held, _ = tracemalloc.get_traced_memory()
+    rows = [row(post) for post in decoded]
+
+    elapsed = time.perf_counter() - started
+    current, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocations = sum(stat.count_diff for stat in after.compare_to(before, "filename") if stat.count_diff > 0)
+
+    assert len(rows) == posts
+    scale = 10000 / posts
+    return {
+        "variant": variant,
+        "posts": posts,
+        "seconds_per_10k": round(elapsed * scale, 3),
+        "held_bytes_per_10k": int((held - baseline) * scale),
+        "peak_bytes_per_10k": int((peak - baseline) * scale),
+        "live_allocations_per_10k": int(allocations * scale),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory benchmark for the decode -> classify -> write post path.")
+    parser.add_argument("--posts", type=int, default=10000, help="Synthetic posts per variant (default: 10000)")
+    parser.add_argument("--variant", choices=VARIANTS, help=argparse.SUPPRESS)
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    if args.variant:
+        print(json.dumps(measure(args.variant, args.posts)))
+        return 0
+
+    results = []
+    for variant in VARIANTS:
+        output = subprocess.check_output(
+            [sys.executable, "-m", "tests.bench_post_records", "--posts", str(args.posts), "--variant", variant])
+        results.append(json.loads(output.decode("utf-8").strip().splitlines()[-1]))
+
+    columns = [key for key in results[0] if key not in ("variant", "posts")]
+    print(f"{'variant':<14}" + "".join(f"{column:>26}" for column in columns))
+    for result in results:
+        print(f"{result['variant']:<14}" + "".join(f"{result[column]:>26}" for column in columns))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+#
+# fake_firehose.py
+#
+# A local stand-in for the relay's subscribeRepos websocket, and checks of the
+# supervised consumer in server.data_stream against it. Each connection plays
+# the next scripted scenario: stream some commits, then go silent (a stalled
+# relay or half-open socket), drop the connection, or send an error frame.
+#
+# $ python3 -m tests.fake_firehose
+#
+# The checks use a scratch SQLite database and short timeouts, and print a
+# JSON PASS/FAIL summary like the other test scripts.
+#
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from hashlib import sha256
+from urllib.parse import parse_qs, urlparse
+
+os.environ.setdefault("HOSTNAME", "localhost")
+os.environ.setdefault("FEED_URI", "at://did:plc:test/app.bsky.feed.generator/test")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.gettempdir()}/fake_firehose_test.db")
+os.environ.setdefault("FIREHOSE_STALL_TIMEOUT", "2")
+os.environ.setdefault("FIREHOSE_BACKOFF_BASE", "0.2")
+os.environ.setdefault("FIREHOSE_BACKOFF_MAX", "1")
+
+import libipld
+from websockets.sync.server import serve
+
+from server import config, data_stream, metrics
+from server.database import SubscriptionState, backend
+from server.load_shedding import controller
+
+SERVICE = "did:web:fake-firehose-test"
+_FAKE_CID = libipld.encode_cid(bytes([1, 0x71, 0x12, 32]) + sha256(b"fake-firehose").digest())
+
+# Scenario steps
+STALL, CLOSE, TOO_SLOW = "stall", "close", "too_slow"
+
+
+def commit_frame(seq: int) -> bytes:
+    """A #commit frame without blocks: it moves the cursor but carries no operations."""
+    body = {
+        "seq": seq, "rebase": False, "tooBig": False, "repo": "did:plc:fake",
+        "commit": _FAKE_CID, "rev": str(seq), "since": None, "blocks": b"",
+        "ops": [], "blobs": [], "time": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+    }
+    return libipld.encode_dag_cbor({"op": 1, "t": "#commit"}) + libipld.encode_dag_cbor(body)
+
+
+def error_frame(error: str, message: str = "") -> bytes:
+    return libipld.encode_dag_cbor({"op": -1}) + libipld.encode_dag_cbor({"error": error, "message": message})
+
+
+class FakeFirehose:
+    """
+    Serves scripted scenarios, one per connection, as (commits, then) pairs:
+    send `commits` commit frames continuing from the client's cursor, then
+    STALL (stay open and silent), CLOSE or TOO_SLOW. Once the script runs
+    out every connection stalls.
+    """
+
+    def __init__(self, scenarios, first_seq: int = 1):
+        self.scenarios = list(scenarios)
+        self.next_seq = first_seq
+        self.connections = []  # (monotonic time, cursor or None)
+        self._lock = threading.Lock()
+        self._closing = threading.Event()
+        self._server = serve(self._handle, "127.0.0.1", 0)
+        self.port = self._server.socket.getsockname()[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def uri(self) -> str:
+        return f"ws://127.0.0.1:{self.port}/xrpc"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._closing.set()
+        self._server.shutdown()
+
+    def _handle(self, websocket) -> None:
+        cursor = parse_qs(urlparse(websocket.request.path).query).get("cursor", [None])[0]
+        with self._lock:
+            self.connections.append((time.monotonic(), int(cursor) if cursor else None))
+            commits, then = self.scenarios.pop(0) if self.scenarios else (0, STALL)
+            seq = int(cursor) + 1 if cursor else self.next_seq
+
+        for _ in range(commits):
+            websocket.send(commit_frame(seq))
+            seq += 1
+        with self._lock:
+            self.next_seq = max(self.next_seq, seq)
+
+        if then == TOO_SLOW:
+            websocket.send(error_frame("ConsumerTooSlow", "Stream consumer too slow"))
+        elif then == STALL:
+            self._closing.wait()
+        # Returning closes the connection
+
+    def wait_for_connections(self, count: int, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if len(self.connections) >= count:
+                return True
+            time.sleep(0.05)
+        return False
+
+
+def clear_state() -> None:
+    with backend.write() as writer:
+        SubscriptionState.delete().where(SubscriptionState.service == SERVICE).execute(writer)
+
+
+def run_checks() -> dict:
+    results = {}
+    clear_state()
+    counters = lambda: metrics.snapshot()["counters"]
+    before = counters()
+    reconnect_window = config.FIREHOSE_STALL_TIMEOUT + config.FIREHOSE_BACKOFF_MAX + 2
+
+    scenarios = [
+        (5, STALL),     # 998..1002, cursor checkpointed at 1000, then silence
+        (0, CLOSE),     # dropped before sending anything
+        (0, CLOSE),
+        (3, TOO_SLOW),  # relay gives up on us
+        (2, STALL),     # healthy again, then idle until shutdown
+    ]
+    with FakeFirehose(scenarios, first_seq=998) as relay:
+        config.FIREHOSE_URI = relay.uri
+        stop = threading.Event()
+        level_before = controller.level
+        consumer = threading.Thread(target=data_stream.run, args=(SERVICE, lambda ops: None, stop), daemon=True)
+        consumer.start()
+
+        results["stall_forces_reconnect"] = relay.wait_for_connections(2, reconnect_window)
+        results["resumes_from_checkpointed_cursor"] = (
+            len(relay.connections) >= 2 and relay.connections[1][1] == 1000)
+
+        results["reconnects_after_drops"] = relay.wait_for_connections(5, 4 * reconnect_window)
+        gaps = [b[0] - a[0] for a, b in zip(relay.connections[1:], relay.connections[2:5])]
+        results["backoff_capped"] = bool(gaps) and max(gaps) <= config.FIREHOSE_BACKOFF_MAX + 1
+        results["too_slow_escalates"] = controller.level > level_before
+
+        # Let the last connection deliver its commits so the downtime is recorded
+        time.sleep(1)
+        after = counters()
+        results["stall_counted"] = after.get("firehose.stalls", 0) - before.get("firehose.stalls", 0) >= 1
+        results["reconnects_counted"] = after.get("firehose.reconnects", 0) - before.get("firehose.reconnects", 0) >= 4
+        results["downtime_recorded"] = after.get("firehose.downtime_seconds", 0) > before.get("firehose.downtime_seconds", 0)
+
+        # The relay is now silent: shutdown must not wait for a message or a stall
+        started = time.monotonic()
+        stop.set()
+        consumer.join(timeout=config.FIREHOSE_STALL_TIMEOUT)
+        shutdown_seconds = time.monotonic() - started
+        results["prompt_shutdown_without_traffic"] = not consumer.is_alive() and shutdown_seconds < 1.5
+
+    clear_state()
+    return results
+
+
+if __name__ == "__main__":
+    checks = run_checks()
+    output = {
+        "checks": {name: "PASS" if ok else "FAIL" for name, ok in checks.items()},
+        "metrics": metrics.snapshot()["counters"],
+        "result": "PASS" if all(checks.values()) else "FAIL",
+    }
+    print(json.dumps(output, indent=2))
+    sys.exit(0 if output["result"] == "PASS" else 1)
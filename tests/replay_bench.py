@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+#
+# replay_bench.py
+#
+# Replays a corpus of posts through operations_callback in firehose-sized
+# batches against a scratch SQLite database, once per mode, and compares
+# the work done and the resulting feed with the "full" mode, which scores
+# every post.
+#
+# $ python3 -m tests.replay_bench --posts 20000
+# $ python3 -m tests.replay_bench --corpus posts.jsonl --modes full authors
+# $ python3 -m tests.replay_bench --modes full debug
+#
+# The corpus is a seeded synthetic stream in which most authors keep to one
+# topic and the rest mix topics, with a few prolific authors posting much of
+# the stream, or a JSONL file of {"uri", "author", "text"} objects with
+# optional "reply_parent" and "reply_root". Duplicate detection is disabled
+# so only the mode under test skips work.
+#
+# Modes:
+#   full     every post is scored
+#   authors  per-author reputation (server.authors) short-circuits
+#            confidently one-sided authors
+#   debug    every post is scored with debug logging on; records are
+#            formatted but not written, so the difference from full is the
+#            cost of logging on the consumer thread
+#
+# log_records counts the records the server's loggers emitted in each mode.
+#
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+os.environ.setdefault("HOSTNAME", "localhost")
+os.environ.setdefault("FEED_URI", "at://did:plc:test/app.bsky.feed.generator/test")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.gettempdir()}/replay_bench.db")
+os.environ.setdefault("DEFAULT_DID", "did:plc:replay")
+os.environ.setdefault("AMBIGUOUS_POST_POLICY", "HIDE")
+os.environ.setdefault("SOFTMAX_TEMPERATURE", "0.05")
+os.environ["DEDUP_ENABLED"] = "false"
+
+from atproto import models
+
+from server import authors, config, data_filter, embedding_inputs, feed_window, threads
+from server.database import Post, UserLists, backend
+from server.post_record import PostRecord
+from server.vector import string_to_vector, vector_to_blob
+
+TOPICS = {
+    "garden": "repotting tomato seedlings compost heap garden beds spring planting",
+    "politics": "election debate senate vote policy campaign parliament",
+    "travel": "train ride river valley coffee book window station",
+}
+WORDS = "today really think maybe little great another morning evening people friends time".split()
+
+
+def synthetic_corpus(count: int, seed: int, n_authors: int = 500) -> list:
+    """Three in four authors keep to one topic; author activity follows a power law."""
+    rng = random.Random(seed)
+    topics = list(TOPICS)
+    habits = [rng.choice(topics) if rng.random() < 0.75 else None for _ in range(n_authors)]
+    weights = [1 / (rank + 1) ** 1.1 for rank in range(n_authors)]
+    started = datetime.now(timezone.utc)
+    corpus = []
+    for i, author in enumerate(rng.choices(range(n_authors), weights=weights, k=count)):
+        topic = habits[author] or rng.choice(topics)
+        words = TOPICS[topic].split()
+        text = " ".join(rng.sample(words, 4) + rng.sample(WORDS, 3)) + f" {i}"
+        corpus.append({"uri": f"at://did:plc:author{author}/app.bsky.feed.post/{i:013d}",
+                       "author": f"did:plc:author{author}", "text": text,
+                       "indexed_at": started + timedelta(milliseconds=i)})
+    return corpus
+
+
+def load_corpus(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def seed_lists() -> None:
+    white, black = string_to_vector(TOPICS["garden"]), string_to_vector(TOPICS["politics"])
+    with backend.write() as conn:
+        UserLists.delete().where(UserLists.did == config.DEFAULT_DID).execute(conn)
+        UserLists.insert(did=config.DEFAULT_DID, white_list_text="garden compost tomato seedling",
+                         black_list_text="election senate vote policy",
+                         white_list_vector=vector_to_blob(white), white_list_dim=len(white),
+                         black_list_vector=vector_to_blob(black), black_list_dim=len(black),
+                         vectors_normalized=True, modified_at=datetime.now(timezone.utc)).execute(conn)
+
+
+def count_encodes() -> list:
+    """Count the embedding calls, and the inputs embedded, that operations_callback makes."""
+    counts = [0, 0]
+    encode = embedding_inputs.strings_to_vectors
+
+    def counted(strings, *args, **kwargs):
+        counts[0] += 1
+        counts[1] += len(strings)
+        return encode(strings, *args, **kwargs)
+
+    embedding_inputs.strings_to_vectors = counted
+    return counts
+
+
+class LogCounter(logging.Filter):
+    """Counts and formats the records reaching the shared queue handler, then drops them."""
+
+    def __init__(self):
+        super().__init__()
+        self.records = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        self.records += 1
+        record.getMessage()
+        return False
+
+
+def server_loggers() -> list:
+    return [logger for name, logger in logging.root.manager.loggerDict.items()
+            if name.startswith("server.") and isinstance(logger, logging.Logger)]
+
+
+def setup(mode: str, seed: int) -> None:
+    """Fresh indexes for the mode, so no run benefits from the one before."""
+    threads.index = threads.ThreadDecisions()
+    feed_window.window = None
+    authors.index = authors.AuthorReputation(seed=seed) if mode == "authors" else None
+    level = logging.DEBUG if mode == "debug" else getattr(logging, config.LOG_LEVEL)
+    for logger in server_loggers():
+        logger.setLevel(level)
+        for handler in logger.handlers:
+            handler.setLevel(level)
+
+
+def replay(mode: str, corpus: list, batch: int, counts: list, log_counter: LogCounter, seed: int) -> tuple:
+    with backend.write() as conn:
+        Post.delete().execute(conn)
+    setup(mode, seed)
+    posts = [PostRecord(row["uri"], f"cid{n}", row["author"], text=row["text"],
+                        reply_parent=row.get("reply_parent"), reply_root=row.get("reply_root"),
+                        indexed_at=row.get("indexed_at") or datetime.now(timezone.utc))
+             for n, row in enumerate(corpus)]
+    counts[:] = [0, 0]
+    log_counter.records = 0
+    started = time.perf_counter()
+    for start in range(0, len(posts), batch):
+        ops = defaultdict(lambda: {'created': [], 'deleted': []})
+        ops[models.ids.AppBskyFeedPost]['created'] = posts[start:start + batch]
+        data_filter.operations_callback(ops)
+    elapsed = time.perf_counter() - started
+    shown = {row.uri for row in Post.select(Post.uri)}
+    result = {"mode": mode, "posts": len(posts),
+              "posts_per_second": round(len(posts) / elapsed, 1),
+              "encode_calls": counts[0], "inputs_embedded": counts[1], "in_feed": len(shown),
+              "log_records": log_counter.records}
+    if authors.index is not None:
+        stats = authors.index.stats()
+        result.update(author_skips=stats["predicted"], author_mismatches=stats["mismatched"],
+                      authors_tracked=stats["tracked"])
+    return result, shown
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a corpus through the classifier in several modes.")
+    parser.add_argument("--posts", type=int, default=20000, help="Synthetic posts (default: 20000)")
+    parser.add_argument("--corpus", help="JSONL corpus to replay instead of the synthetic one")
+    parser.add_argument("--batch", type=int, default=64, help="Posts per operations_callback call (default: 64)")
+    parser.add_argument("--modes", nargs="+", default=["full", "authors"], choices=["full", "authors", "debug"],
+                        help="Modes to replay; the first is the reference (default: full authors)")
+    parser.add_argument("--seed", type=int, default=1, help="Corpus and sampling seed (default: 1)")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    seed_lists()
+    counts = count_encodes()
+    log_counter = LogCounter()
+    # Every server logger shares one queue handler
+    data_filter.logger.handlers[0].addFilter(log_counter)
+    corpus = load_corpus(args.corpus) if args.corpus else synthetic_corpus(args.posts, args.seed)
+    data_filter.score_posts([PostRecord("at://warmup", "cid", "did:plc:warmup", text="warm up")], 0,
+                            [None] * len(data_filter.feeds))  # load the models before timing
+
+    results, reference = [], None
+    for mode in args.modes:
+        result, shown = replay(mode, corpus, args.batch, counts, log_counter, args.seed)
+        if reference is None:
+            reference = (result, shown)
+        base, base_shown = reference
+        result["encode_reduction"] = round(1 - result["inputs_embedded"] / max(base["inputs_embedded"], 1), 4)
+        result["feed_agreement"] = round(1 - len(shown ^ base_shown) / max(len(shown | base_shown), 1), 4)
+        results.append(result)
+
+    columns = [key for key in results[0] if key not in ("mode", "posts")]
+    columns += [key for result in results for key in result if key not in columns and key not in ("mode", "posts")]
+    widths = [len(column) + 2 for column in columns]
+    print(f"{'mode':<10}" + "".join(f"{column:>{width}}" for column, width in zip(columns, widths)))
+    for result in results:
+        print(f"{result['mode']:<10}" + "".join(f"{str(result.get(column, '')):>{width}}"
+                                              for column, width in zip(columns, widths)))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
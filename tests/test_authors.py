@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+#
+# test_authors.py
+#
+# Checks of per-author reputation (server.authors): an author is only
+# predicted after enough one-sided decisions, a contrary keyword or a
+# failed verification sends their posts back to the model, histories decay
+# and the number of authors tracked stays bounded.
+#
+# $ python3 -m tests.test_authors
+#
+import json
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("HOSTNAME", "localhost")
+os.environ.setdefault("FEED_URI", "at://did:plc:test/app.bsky.feed.generator/test")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.gettempdir()}/test_authors.db")
+
+from server import authors
+from server.algos.definitions import FeedDefinition
+from server.post_record import PostRecord
+from server.text_utils import KeywordMatcher
+
+
+class Lists:
+    """The parts of CompiledLists that predict() reads."""
+
+    def __init__(self, white: list, black: list):
+        self.matcher = KeywordMatcher({"white": white, "black": black}, lemmatize=False)
+
+
+FEED = FeedDefinition("at://did:plc:test/app.bsky.feed.generator/test", show_thresh=0.6, hide_thresh=0.6)
+LISTS = [Lists(["garden"], ["election"])]
+
+
+def post(author: str, text: str) -> PostRecord:
+    return PostRecord(f"at://{author}/app.bsky.feed.post/1", "cid", author, text=text)
+
+
+def reputation(**kwargs) -> authors.AuthorReputation:
+    options = dict(half_life=3600, max_entries=100, min_posts=5, confidence=0.9, verify_rate=0.0,
+                   definitions=[FEED], seed=1)
+    return authors.AuthorReputation(**{**options, **kwargs})
+
+
+def run_checks() -> dict:
+    results = {}
+
+    index = reputation()
+    for n in range(4):
+        index.observe("did:plc:hider", ("HIDE",), [0.1], [0.9])
+    results["needs_min_posts"] = index.predict(post("did:plc:hider", "a long day"), LISTS) is None
+    for n in range(2):
+        index.observe("did:plc:hider", ("HIDE",), [0.1], [0.9])
+    results["one_sided_predicted"] = index.predict(post("did:plc:hider", "a long day"), LISTS) == (("HIDE",), False)
+    results["contrary_keyword_scored"] = index.predict(post("did:plc:hider", "My Garden!"), LISTS) is None
+
+    for n in range(5):
+        index.observe("did:plc:mixed", ("SHOW" if n % 2 else "HIDE",), [0.5], [0.5])
+    results["mixed_not_predicted"] = index.predict(post("did:plc:mixed", "hello"), LISTS) is None
+
+    for n in range(10):
+        index.observe("did:plc:borderline", ("SHOW",), [0.55], [0.45])
+    results["borderline_not_predicted"] = index.predict(post("did:plc:borderline", "hello"), LISTS) is None
+
+    verifying = reputation(verify_rate=1.0)
+    for n in range(6):
+        verifying.observe("did:plc:shower", ("SHOW",), [0.9], [0.1])
+    predicted, verify = verifying.predict(post("did:plc:shower", "hello"), LISTS)
+    agreed = verifying.verify("did:plc:shower", predicted, ("HIDE",), [0.2], [0.8])
+    results["mismatch_resets"] = verify and not agreed and verifying.summary("did:plc:shower")["test"]["posts"] == 1.0
+    results["no_lists_not_needed"] = verifying.predict(post("did:plc:shower", "hello"), [None]) is None
+
+    decaying = reputation(half_life=1e-3)
+    for n in range(10):
+        decaying.observe("did:plc:old", ("HIDE",), [0.1], [0.9])
+    time.sleep(0.05)
+    results["history_decays"] = decaying.predict(post("did:plc:old", "hello"), LISTS) is None
+
+    bounded = reputation(max_entries=10)
+    for n in range(50):
+        bounded.observe(f"did:plc:author{n}", ("SHOW",), [0.9], [0.1])
+    results["authors_bounded"] = len(bounded) == 10 and bounded.summary("did:plc:author49") is not None
+
+    index.bind(("changed",))
+    results["bind_clears"] = len(index) == 0
+    return results
+
+
+if __name__ == "__main__":
+    checks = run_checks()
+    output = {
+        "checks": {name: "PASS" if ok else "FAIL" for name, ok in checks.items()},
+        "result": "PASS" if all(checks.values()) else "FAIL",
+    }
+    print(json.dumps(output, indent=2))
+    sys.exit(0 if output["result"] == "PASS" else 1)
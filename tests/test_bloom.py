@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+#
+# test_bloom.py
+#
+# Checks of the rotating Bloom filter (server.bloom) and of firehose deletes
+# going through it (database.delete_accepted_posts) against a scratch SQLite
+# database: no accepted URI is ever missed, the false-positive rate stays
+# near its target, generations expire, and deletes of posts the feed never
+# accepted cost no query. Prints the false-positive rate and the delete
+# queries saved for a stream in which --ratio deletes in every thousand
+# are of accepted posts.
+#
+# $ python3 -m tests.test_bloom --deletes 50000 --ratio 5
+#
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+os.environ.setdefault("HOSTNAME", "localhost")
+os.environ.setdefault("FEED_URI", "at://did:plc:test/app.bsky.feed.generator/test")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.gettempdir()}/test_bloom.db")
+os.environ.setdefault("DEFAULT_DID", "did:plc:bloom")
+os.environ["ACCEPTED_FILTER_ENABLED"] = "true"
+
+from atproto import models
+
+from server import data_filter, database
+from server.bloom import RotatingBloomFilter
+from server.database import Post, backend, insert_posts
+
+
+def uri(i: int) -> str:
+    return f"at://did:plc:bloom{i % 997}/app.bsky.feed.post/{i:013d}"
+
+
+def row(i: int) -> dict:
+    return {'uri': uri(i), 'cid': f'cid{i}', 'indexed_at': datetime.now(timezone.utc)}
+
+
+def deletes(uris: list) -> defaultdict:
+    result = defaultdict(lambda: {'created': [], 'deleted': []})
+    result[models.ids.AppBskyFeedPost]['deleted'] = [{'uri': u} for u in uris]
+    return result
+
+
+def run_checks(count: int, ratio: int) -> dict:
+    results = {}
+
+    bloom = RotatingBloomFilter(window=3600, capacity=10000, fpr=0.01)
+    added = [uri(i) for i in range(10000)]
+    bloom.add_many(added)
+    results["no_false_negatives"] = all(bloom.might_contain(added))
+    absent = bloom.might_contain([uri(i) for i in range(10000, 110000)])
+    fpr = sum(absent) / len(absent)
+    results["fpr_near_target"] = fpr < 0.015 and abs(bloom.estimated_fpr() - fpr) < 0.005
+    print(f"filter: {bloom.bits} bits, {bloom.hashes} hashes, measured FPR {fpr:.4f}, "
+          f"estimated {bloom.estimated_fpr():.4f}", file=sys.stderr)
+
+    rotating = RotatingBloomFilter(window=0.05, capacity=100)
+    rotating.add_many(["at://old"])
+    time.sleep(0.06)
+    rotating.add_many(["at://new"])
+    kept = rotating.might_contain(["at://old", "at://new"]) == [True, True]
+    time.sleep(0.06)
+    rotating.might_contain(["at://new"])
+    time.sleep(0.06)
+    results["generations_expire"] = kept and rotating.might_contain(["at://old", "at://new"]) == [False, False]
+
+    # A delete stream in which ratio in every thousand deletes are of posts in the feed
+    with backend.write() as conn:
+        Post.delete().execute(conn)
+    database.accepted_uris = RotatingBloomFilter(window=3600, capacity=count, fpr=0.01)
+    stored = list(range(0, count, 1000 // ratio))
+    insert_posts([row(i) for i in stored])
+    before = database.delete_stats()
+    batch = 64
+    for start in range(0, count, batch):
+        data_filter.operations_callback(deletes([uri(i) for i in range(start, start + batch)]))
+    after = database.delete_stats()
+    queries = after["queries"] - before["queries"]
+    saved = after["queries_saved"] - before["queries_saved"]
+    results["accepted_posts_deleted"] = Post.select().count() == 0
+    # Only batches holding a stored post need a query, give or take a false positive
+    needed = len({i // batch for i in stored})
+    results["queries_only_when_needed"] = needed <= queries <= needed + 0.02 * (queries + saved)
+    print(f"{count} deletes in batches of {batch}, {len(stored)} of posts in the feed: {queries} delete queries "
+          f"instead of {queries + saved}, observed FPR {after['observed_fpr']:.4f}", file=sys.stderr)
+
+    # Posts stored before the filter existed, e.g. before a restart, are loaded from the table,
+    # into a filter sized for them when they outnumber the configured capacity
+    database.accepted_uris = None
+    insert_posts([row(i) for i in range(1, 2001)])
+    capacity, database.ACCEPTED_FILTER_CAPACITY = database.ACCEPTED_FILTER_CAPACITY, 100
+    try:
+        database.load_accepted_uris()
+    finally:
+        database.ACCEPTED_FILTER_CAPACITY = capacity
+    results["sized_for_stored_rows"] = database.accepted_uris.capacity == 2000
+    data_filter.operations_callback(deletes([uri(i) for i in range(1, 2001)]))
+    results["loaded_from_table"] = Post.select().count() == 0
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Checks of the accepted-URI filter for firehose deletes.")
+    parser.add_argument("--deletes", type=int, default=50000, help="Deletes replayed (default: 50000)")
+    parser.add_argument("--ratio", type=int, default=5, help="Deletes of stored posts per thousand (default: 5)")
+    args = parser.parse_args()
+    checks = run_checks(args.deletes, args.ratio)
+    output = {
+        "checks": {name: "PASS" if ok else "FAIL" for name, ok in checks.items()},
+        "result": "PASS" if all(checks.values()) else "FAIL",
+    }
+    print(json.dumps(output, indent=2))
+    sys.exit(0 if output["result"] == "PASS" else 1)
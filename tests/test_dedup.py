@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+#
+# test_dedup.py
+#
+# Checks of the duplicate index in server.dedup: exact and near copies are
+# matched, unrelated posts are not, and the window and entry limits bound
+# memory.
+#
+# $ python3 -m tests.test_dedup
+#
+import json
+import os
+import sys
+import time
+
+os.environ.setdefault("HOSTNAME", "localhost")
+os.environ.setdefault("FEED_URI", "at://did:plc:test/app.bsky.feed.generator/test")
+
+from server.dedup import DedupIndex, fingerprint
+from server.post_record import PostRecord
+
+CAMPAIGN = ("Huge giveaway today only! Follow and repost to win a brand new phone, "
+            "winners announced tonight, do not miss out on this amazing chance")
+
+
+def post(i: int, text: str, embed: dict = None) -> PostRecord:
+    return PostRecord(f"at://did:plc:dedup{i}/app.bsky.feed.post/{i}", f"cid{i}", f"did:plc:dedup{i}",
+                      text=text, embed=embed)
+
+
+def run_checks() -> dict:
+    results = {}
+    index = DedupIndex(window=3600, max_entries=1000, max_distance=6)
+    first = post(0, CAMPAIGN)
+    index.add(fingerprint(first), "HIDE", first.uri)
+
+    results["exact_copy_matches"] = index.match(fingerprint(post(1, CAMPAIGN.upper() + " !!!"))) == ("HIDE", first.uri)
+    edited = CAMPAIGN.replace("tonight", "tomorrow")
+    results["near_copy_matches"] = index.match(fingerprint(post(2, edited))) == ("HIDE", first.uri)
+    unrelated = post(3, "Spent the afternoon repotting tomato seedlings and turning the compost heap")
+    results["unrelated_post_misses"] = index.match(fingerprint(unrelated)) == (None, None)
+    results["alt_text_counts"] = fingerprint(post(4, CAMPAIGN, {
+        "$type": "app.bsky.embed.images", "images": [{"alt": "a cat asleep on a keyboard"}]})).exact != fingerprint(first).exact
+    results["short_text_ignored"] = fingerprint(post(5, "good morning")) is None
+
+    index.bind("lists-v2")
+    results["bind_forgets_decisions"] = len(index) == 0 and index.match(fingerprint(first)) == (None, None)
+
+    bounded = DedupIndex(window=3600, max_entries=100, max_distance=6)
+    for i in range(1000):
+        p = post(i, f"{i} distinct post number {i} with enough words {i * 7919} to fingerprint")
+        bounded.add(fingerprint(p), "SHOW", p.uri)
+    results["entries_bounded"] = len(bounded) == 100 and len(bounded._exact) == 100
+
+    expiring = DedupIndex(window=0.2, max_entries=1000, max_distance=6)
+    expiring.add(fingerprint(first), "HIDE", first.uri)
+    time.sleep(0.3)
+    results["window_evicts"] = expiring.match(fingerprint(first)) == (None, None) and len(expiring) == 0
+    return results
+
+
+if __name__ == "__main__":
+    checks = run_checks()
+    output = {
+        "checks": {name: "PASS" if ok else "FAIL" for name, ok in checks.items()},
+        "result": "PASS" if all(checks.values()) else "FAIL",
+    }
+    print(json.dumps(output, indent=2))
+    sys.exit(0 if output["result"] == "PASS" else 1)
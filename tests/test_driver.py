@@ -16,7 +16,7 @@ from sentence_transformers import SentenceTransformer
 from server.config import BSKY_USERNAME, BSKY_PASSWORD, DEFAULT_DID
 from server.logger import setup_logger
 from server.text_utils import clean_text, extract_extra_text
-from server.vector import string_to_vector, vector_to_blob, cosine_similarity, score_post
+from server.vector import string_to_vector, vector_to_blob, blob_to_vector, cosine_similarity, score_post
 from server.database import db, Post, UserLists
 
 logger = setup_logger(__name__)
@@ -68,8 +68,8 @@ def fetch_user_vectors(did: str) -> tuple[np.ndarray, np.ndarray, UserLists]:
     if not row:
         print(f"No UserLists entry for DID: {DEFAULT_DID}")
         sys.exit(1)
-    white_vec = np.frombuffer(row.white_list_vector, dtype=np.float32, count=row.white_list_dim)
-    black_vec = np.frombuffer(row.black_list_vector, dtype=np.float32, count=row.black_list_dim)
+    white_vec = blob_to_vector(row.white_list_vector, row.white_list_dim)
+    black_vec = blob_to_vector(row.black_list_vector, row.black_list_dim)
     return white_vec, black_vec, row
 
 # ---- Main test function ----
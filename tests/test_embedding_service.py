@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+#
+# test_embedding_service.py
+#
+# Checks of the local embedding service in server.embedding_service:
+# concurrent clients get back exactly their own vectors, requests arriving
+# together are coalesced into fewer model calls, a lone request is not held
+# past the deadline, and server.vector falls back to the in-process model
+# when the socket is missing.
+#
+# $ python3 -m tests.test_embedding_service
+#
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+os.environ.setdefault("HOSTNAME", "localhost")
+os.environ.setdefault("FEED_URI", "at://did:plc:test/app.bsky.feed.generator/test")
+
+from server import vector
+from server.embedding_service import DynamicBatcher, EmbeddingClient, EmbeddingServer
+
+DIM = 16
+
+
+def fake_encode(texts):
+    # Deterministic per text, so results can be checked against a direct call
+    time.sleep(0.005)
+    return np.stack([np.random.default_rng(abs(hash(text)) % (2 ** 32)).standard_normal(DIM).astype(np.float32)
+                     for text in texts]) if texts else np.zeros((0, DIM), dtype=np.float32)
+
+
+def run_checks() -> dict:
+    results = {}
+    path = os.path.join(tempfile.mkdtemp(), "embeddings.sock")
+    batcher = DynamicBatcher(fake_encode, max_batch=64, max_wait=0.02)
+    server = EmbeddingServer(path, batcher)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = EmbeddingClient(path, timeout=5)
+
+    try:
+        texts = [f"post number {i}" for i in range(10)]
+        results["round_trip"] = np.array_equal(client.encode(texts), fake_encode(texts))
+
+        errors, mismatches = [], []
+
+        def worker(n):
+            try:
+                for j in range(5):
+                    batch = [f"worker {n} item {j} text {k}" for k in range(3)]
+                    if not np.array_equal(client.encode(batch), fake_encode(batch)):
+                        mismatches.append((n, j))
+            except Exception as e:
+                errors.append(e)
+
+        before = client.stats()
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        after = client.stats()
+        batches = after["batches"] - before["batches"]
+        requests = after["requests"] - before["requests"]
+        results["concurrent_clients_get_own_vectors"] = not errors and not mismatches and requests == 80
+        results["requests_coalesced"] = batches < requests / 2
+
+        started = time.monotonic()
+        client.encode(["lonely"])
+        results["lone_request_within_deadline"] = time.monotonic() - started < 0.5
+
+        results["empty_request"] = client.encode([]).shape == (0, DIM)
+    finally:
+        server.shutdown()
+        server.server_close()
+        client.close()
+
+    # Nothing listens on the socket any more: vector must encode in-process
+    os.unlink(path)
+    vector._client, vector._service_retry_at = EmbeddingClient(path, timeout=1), 0.0
+    local = vector.normalize_vectors(vector.get_model().encode(["fallback text"], show_progress_bar=False))
+    results["fallback_in_process"] = (np.allclose(vector.strings_to_vectors(["fallback text"]), local)
+                                      and vector._service_retry_at > time.monotonic())
+    vector._client = None
+    return results
+
+
+if __name__ == "__main__":
+    checks = run_checks()
+    output = {
+        "checks": {name: "PASS" if ok else "FAIL" for name, ok in checks.items()},
+        "result": "PASS" if all(checks.values()) else "FAIL",
+    }
+    print(json.dumps(output, indent=2))
+    sys.exit(0 if output["result"] == "PASS" else 1)
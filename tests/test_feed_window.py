@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+#
+# test_feed_window.py
+#
+# Checks of server.feed_window against a scratch SQLite database: after the
+# user's lists change, re-scoring the window leaves the feed exactly as
+# scoring every post against the new lists from scratch would, without
+# embedding anything again; deleted and expired posts are not brought back;
+# and the ring stays bounded.
+#
+# $ python3 -m tests.test_feed_window --posts 2000
+#
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+os.environ.setdefault("HOSTNAME", "localhost")
+os.environ.setdefault("FEED_URI", "at://did:plc:test/app.bsky.feed.generator/test")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.gettempdir()}/test_feed_window.db")
+os.environ.setdefault("DEFAULT_DID", "did:plc:window")
+# Posts the lists cannot place stay out of the feed, so a list edit shows up in it
+os.environ.setdefault("AMBIGUOUS_POST_POLICY", "HIDE")
+os.environ.setdefault("SOFTMAX_TEMPERATURE", "0.05")
+
+from atproto import models
+
+from server import config, data_filter, embedding_inputs, feed_window
+from server.database import Post, UserLists, backend
+from server.post_record import PostRecord
+from server.vector import string_to_vector, vector_to_blob
+
+TOPICS = [
+    "repotting tomato seedlings and turning the compost heap in the garden",
+    "the election debate last night and what the senate vote means for policy",
+    "a long train ride through the river valley with coffee and a good book",
+]
+
+
+def post(i: int, indexed_at: datetime = None) -> PostRecord:
+    # Every seventh post copies the one before it, to exercise reused decisions
+    n = i - 1 if i % 7 == 6 else i
+    text = f"Post {n} about {TOPICS[n % len(TOPICS)]}, note {n * 7919 % 1000}"
+    return PostRecord(f"at://did:plc:window{i % 97}/app.bsky.feed.post/{i:013d}", f"cid{i}",
+                      f"did:plc:window{i % 97}", text=text, indexed_at=indexed_at or datetime.now(timezone.utc))
+
+
+def ops(created=(), deleted=()) -> defaultdict:
+    result = defaultdict(lambda: {'created': [], 'deleted': []})
+    result[models.ids.AppBskyFeedPost]['created'] = list(created)
+    result[models.ids.AppBskyFeedPost]['deleted'] = [{'uri': uri} for uri in deleted]
+    return result
+
+
+def save_lists(white: str, black: str) -> None:
+    white_vec, black_vec = string_to_vector(white), string_to_vector(black)
+    with backend.write() as conn:
+        UserLists.delete().where(UserLists.did == config.DEFAULT_DID).execute(conn)
+        UserLists.insert(did=config.DEFAULT_DID, white_list_text=white, black_list_text=black,
+                         white_list_vector=vector_to_blob(white_vec), white_list_dim=len(white_vec),
+                         black_list_vector=vector_to_blob(black_vec), black_list_dim=len(black_vec),
+                         vectors_normalized=True, modified_at=datetime.now(timezone.utc)).execute(conn)
+
+
+def feed() -> set:
+    return {row.uri for row in Post.select(Post.uri)}
+
+
+def classify(posts: list, batch: int = 64) -> None:
+    for start in range(0, len(posts), batch):
+        data_filter.operations_callback(ops(posts[start:start + batch]))
+
+
+def run_checks(count: int) -> dict:
+    results = {}
+    encodes = [0]
+    encode = embedding_inputs.strings_to_vectors
+
+    def counted(strings, *args, **kwargs):
+        encodes[0] += 1
+        return encode(strings, *args, **kwargs)
+
+    embedding_inputs.strings_to_vectors = counted
+    posts = [post(i) for i in range(count)]
+
+    for storage in ("float32", "int8"):
+        with backend.write() as conn:
+            Post.delete().execute(conn)
+        feed_window.window = feed_window.WindowStore(window=3600, max_entries=count * 2, storage=storage)
+        save_lists("garden compost tomato seedling", "election senate vote policy")
+        classify(posts)
+        before = feed()
+
+        # The edit: the user swaps their lists
+        time.sleep(0.01)
+        save_lists("election senate vote policy", "garden compost tomato seedling")
+        encodes[0] = 0
+        started = time.perf_counter()
+        data_filter.operations_callback(ops())
+        elapsed = time.perf_counter() - started
+        rescored = feed()
+        reencoded = encodes[0]
+
+        # Reference: every post scored against the new lists from scratch
+        with backend.write() as conn:
+            Post.delete().execute(conn)
+        feed_window.window = feed_window.WindowStore(window=3600, max_entries=count * 2, storage=storage)
+        classify(posts)
+        reference = feed()
+
+        agreement = 1 - len(rescored ^ reference) / max(len(rescored | reference), 1)
+        results[f"{storage}_feed_changed"] = before != rescored
+        results[f"{storage}_matches_fresh_scoring"] = agreement == 1.0 if storage == "float32" else agreement > 0.99
+        results[f"{storage}_nothing_reencoded"] = reencoded == 0
+        print(f"{storage}: {count} posts re-scored in {elapsed * 1000:.1f} ms, {len(before)} -> {len(rescored)} "
+              f"in feed, agreement with fresh scoring {agreement:.4f}", file=sys.stderr)
+
+    # Politics posts hidden under the first lists: one deleted, one older than the window
+    with backend.write() as conn:
+        Post.delete().execute(conn)
+    feed_window.window = feed_window.WindowStore(window=600, max_entries=100, storage="float32")
+    save_lists("garden compost tomato seedling", "election senate vote policy")
+    expired, deleted = post(1003, indexed_at=datetime.now(timezone.utc) - timedelta(seconds=1200)), post(1)
+    garden, politics = [post(i) for i in (0, 3, 9, 12)], [post(i) for i in (4, 10)]
+    classify([expired, deleted] + garden + politics)
+    data_filter.operations_callback(ops(deleted=[deleted.uri]))
+    time.sleep(0.01)
+    save_lists("election senate vote policy", "garden compost tomato seedling")
+    data_filter.operations_callback(ops())
+    shown = feed()
+    results["deleted_not_restored"] = deleted.uri not in shown
+    results["expired_not_restored"] = expired.uri not in shown
+    results["window_posts_swapped"] = shown == {p.uri for p in politics}
+
+    bounded = feed_window.WindowStore(window=3600, max_entries=100, storage="int8")
+    for i in range(300):
+        p = post(i)
+        bounded.add(p, string_to_vector(p.text), p.text, [False])
+    results["entries_bounded"] = len(bounded) == 100 and len(bounded._slots) == 100
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Checks of feed window re-scoring.")
+    parser.add_argument("--posts", type=int, default=2000, help="Posts in the window (default: 2000)")
+    args = parser.parse_args()
+    checks = run_checks(args.posts)
+    output = {
+        "checks": {name: "PASS" if ok else "FAIL" for name, ok in checks.items()},
+        "result": "PASS" if all(checks.values()) else "FAIL",
+    }
+    print(json.dumps(output, indent=2))
+    sys.exit(0 if output["result"] == "PASS" else 1)
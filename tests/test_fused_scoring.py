@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+#
+# test_fused_scoring.py
+#
+# Decision agreement between the fused batch kernel (server.vector.score_batch
+# against list_matrix) and per-post score_post, on random unit vectors with
+# random keyword hits, over several temperatures and bias weights. The two
+# sum the dot products in a different order, so probabilities agree to about
+# 1e-6 rather than bit for bit; any decision that differs must belong to a
+# post whose probability sits that close to a threshold.
+#
+# $ python3 -m tests.test_fused_scoring --posts 20000
+#
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+os.environ.setdefault("HOSTNAME", "localhost")
+os.environ.setdefault("FEED_URI", "at://did:plc:test/app.bsky.feed.generator/test")
+
+from server.vector import DECISIONS, list_matrix, normalize_vectors, score_batch, score_post
+
+DIM = 384
+# Largest probability difference accepted between the two paths
+TOLERANCE = 1e-5
+
+
+def compare(posts: int, temperature: float, bias_weight: float, seed: int) -> dict:
+    rng = np.random.default_rng(seed)
+    white, black = rng.standard_normal((2, DIM)).astype(np.float32)
+    # Posts spread around both lists so plenty of them land near the thresholds
+    vectors = normalize_vectors(rng.standard_normal((posts, DIM)).astype(np.float32)
+                                + rng.uniform(-1, 1, (posts, 1)).astype(np.float32) * (white - black) / 8)
+    white_hit = rng.random(posts) < 0.2
+    black_hit = rng.random(posts) < 0.2
+    keyword = {(True, False): "white", (False, True): "black", (True, True): "white black", (False, False): ""}
+
+    batch = score_batch(vectors, list_matrix(white, black), white_hit, black_hit,
+                        temperature=temperature, bias_weight=bias_weight)
+    disagreements = near_threshold = 0
+    max_difference = 0.0
+    for i in range(posts):
+        single = score_post(vectors[i], white, black,
+                            post_text=keyword[(bool(white_hit[i]), bool(black_hit[i]))] or None,
+                            whitelist_words=["white"], blacklist_words=["black"],
+                            temperature=temperature, bias_weight=bias_weight)
+        difference = max(abs(single["prob_white"] - batch["prob_white"][i]),
+                         abs(single["prob_black"] - batch["prob_black"][i]))
+        max_difference = max(max_difference, difference)
+        if single["decision"] != DECISIONS[batch["decision"][i]]:
+            disagreements += 1
+            margin = min(abs(single["prob_white"] - single["show_threshold"]),
+                         abs(single["prob_black"] - single["hide_threshold"]))
+            near_threshold += margin <= TOLERANCE
+    return {"temperature": temperature, "bias_weight": bias_weight, "posts": posts,
+            "agreement": round(1 - disagreements / posts, 6), "disagreements": disagreements,
+            "disagreements_near_threshold": near_threshold, "max_probability_difference": float(max_difference)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Decision agreement of score_batch with score_post.")
+    parser.add_argument("--posts", type=int, default=20000, help="Random posts per setting (default: 20000)")
+    args = parser.parse_args()
+
+    reports = [compare(args.posts, temperature, bias_weight, seed)
+               for seed, (temperature, bias_weight) in enumerate([(0.05, 0.0), (0.1, 0.05), (0.5, 0.1), (1.0, 0.05)])]
+    passed = all(report["disagreements"] == report["disagreements_near_threshold"]
+                 and report["max_probability_difference"] <= TOLERANCE for report in reports)
+    print(json.dumps({"settings": reports, "result": "PASS" if passed else "FAIL"}, indent=2))
+    return 0 if passed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+#
+# test_int8_vectors.py
+#
+# Checks of the packed vector format in server.vector_codec, and an accuracy
+# report for int8 storage: decision agreement between scoring on int8 vectors
+# (int32 accumulation, server.vector.score_batch_int8) and on float32 vectors
+# (score_batch), over random unit vectors at several temperature/bias
+# settings.
+#
+# $ python3 -m tests.test_int8_vectors --posts 20000
+#
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+os.environ.setdefault("HOSTNAME", "localhost")
+os.environ.setdefault("FEED_URI", "at://did:plc:test/app.bsky.feed.generator/test")
+
+from server.vector import list_matrix, normalize_vectors, score_batch, score_batch_int8
+from server.vector_codec import (has_header, int8_dot, pack_vector, quantize_int8, unpack_header, unpack_int8,
+                                 unpack_vector)
+
+DIM = 384
+# Lowest decision agreement with float32 accepted for int8 scoring
+MIN_AGREEMENT = 0.99
+
+
+def format_checks() -> dict:
+    results = {}
+    rng = np.random.default_rng(0)
+    vector = normalize_vectors(rng.standard_normal(DIM).astype(np.float32))
+
+    packed = pack_vector(vector, "float32", normalized=True)
+    results["float32_round_trip"] = np.array_equal(unpack_vector(packed), vector)
+    results["header_fields"] = unpack_header(packed) == {"dtype": "float32", "dim": DIM, "scale": 1.0,
+                                                         "normalized": True}
+
+    packed = pack_vector(vector, "int8")
+    results["int8_quarter_size"] = len(packed) == 12 + DIM and len(pack_vector(vector)) == 12 + 4 * DIM
+    results["int8_round_trip_close"] = float(np.abs(unpack_vector(packed) - vector).max()) <= unpack_header(packed)["scale"] / 2 + 1e-7
+    quantized, scale = unpack_int8(packed)
+    results["int8_components"] = quantized.dtype == np.int8 and int(np.abs(quantized).max()) == 127
+
+    raw = vector.tobytes()
+    results["legacy_blob_read"] = not has_header(raw) and np.array_equal(unpack_vector(raw, DIM), vector)
+    results["legacy_blob_with_magic_prefix"] = not has_header(b"VEC\x01" + raw[4:])
+
+    rows, row_scales = quantize_int8(rng.standard_normal((50, DIM)))
+    targets, target_scales = quantize_int8(rng.standard_normal((2, DIM)))
+    expected = (rows.astype(np.float32) * row_scales[:, None]) @ (targets.astype(np.float32) * target_scales[:, None]).T
+    results["int8_dot_matches_dequantized"] = np.allclose(int8_dot(rows, row_scales, targets, target_scales),
+                                                          expected, rtol=1e-5, atol=1e-5)
+    results["zero_vector"] = not unpack_vector(pack_vector(np.zeros(DIM), "int8")).any()
+    return results
+
+
+def agreement(posts: int, temperature: float, bias_weight: float, seed: int) -> dict:
+    rng = np.random.default_rng(seed)
+    white, black = rng.standard_normal((2, DIM)).astype(np.float32)
+    vectors = normalize_vectors(rng.standard_normal((posts, DIM)).astype(np.float32)
+                                + rng.uniform(-1, 1, (posts, 1)).astype(np.float32) * (white - black) / 8)
+    white_hit = rng.random(posts) < 0.2
+    black_hit = rng.random(posts) < 0.2
+    matrix = list_matrix(white, black)
+    settings = {"temperature": temperature, "bias_weight": bias_weight}
+
+    exact = score_batch(vectors, matrix, white_hit, black_hit, **settings)
+    post_q, post_scales = quantize_int8(vectors)
+    matrix_q, matrix_scales = quantize_int8(matrix)
+    quantized = score_batch_int8(post_q, post_scales, matrix_q, matrix_scales, white_hit, black_hit, **settings)
+
+    agreed = float(np.mean(exact["decision"] == quantized["decision"]))
+    return {"temperature": temperature, "bias_weight": bias_weight, "posts": posts,
+            "agreement": round(agreed, 6),
+            "max_similarity_error": float(np.abs(exact["raw_white"] - quantized["raw_white"]).max()),
+            "max_probability_error": float(np.abs(exact["prob_white"] - quantized["prob_white"]).max())}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="int8 vector storage checks and accuracy report.")
+    parser.add_argument("--posts", type=int, default=20000, help="Random posts per setting (default: 20000)")
+    args = parser.parse_args()
+
+    checks = format_checks()
+    reports = [agreement(args.posts, temperature, bias_weight, seed)
+               for seed, (temperature, bias_weight) in enumerate([(0.05, 0.0), (0.1, 0.05), (0.5, 0.1), (1.0, 0.05)])]
+    passed = all(checks.values()) and all(report["agreement"] >= MIN_AGREEMENT for report in reports)
+    print(json.dumps({
+        "checks": {name: "PASS" if ok else "FAIL" for name, ok in checks.items()},
+        "bytes_per_vector": {"float32": len(pack_vector(np.zeros(DIM))), "int8": len(pack_vector(np.zeros(DIM), "int8"))},
+        "agreement": reports,
+        "result": "PASS" if passed else "FAIL",
+    }, indent=2))
+    return 0 if passed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
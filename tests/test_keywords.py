@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+#
+# test_keywords.py
+#
+# Checks of the compiled keyword matcher in server.text_utils: single words,
+# multi-word phrases, lemmatized forms and both lists in one scan.
+#
+# $ python3 -m tests.test_keywords
+#
+import json
+import os
+import sys
+
+os.environ.setdefault("HOSTNAME", "localhost")
+os.environ.setdefault("FEED_URI", "at://did:plc:test/app.bsky.feed.generator/test")
+
+from server.text_utils import KeywordMatcher, clean_text, keyword_match_bias
+from server.vector import keyword_hits
+
+
+def run_checks() -> dict:
+    results = {}
+    matcher = KeywordMatcher({
+        "white": ["python", "machine learning", "open source"],
+        "black": ["crypto", "giveaway"],
+    })
+
+    results["single_word"] = matcher.match("love python code".split()) == {"white": ["python"], "black": []}
+    results["phrase"] = matcher.match("new machine learning paper".split())["white"] == ["machine learning"]
+    results["partial_phrase_misses"] = matcher.match("machine shop open late".split()) == {"white": [], "black": []}
+    results["both_lists_one_scan"] = matcher.match("python crypto giveaway".split()) == {
+        "white": ["python"], "black": ["crypto", "giveaway"]}
+    results["repeated_keyword_once"] = matcher.match("python python python".split())["white"] == ["python"]
+
+    # Keywords go through the same cleaning as posts, so inflected forms meet
+    lemma_matcher = KeywordMatcher({"white": ["running shoes"]})
+    post = clean_text("Just bought new running shoes for the marathon")
+    results["lemmatized_phrase"] = lemma_matcher.match(post.split())["white"] == ["running shoes"]
+
+    results["keyword_match_bias_compat"] = (keyword_match_bias(["Python", "rust"], "love python code", 0.05) == 0.05
+                                            and keyword_match_bias(["rust"], "love python code", 0.05) == 0.0)
+    results["keyword_hits_from_word_lists"] = keyword_hits("love python code", ["python"], ["code"]) == {
+        "white": ["python"], "black": ["code"]}
+    results["empty_lists"] = not KeywordMatcher({"white": [], "black": None}) and \
+        KeywordMatcher({"white": [], "black": None}).match(["python"]) == {"white": [], "black": []}
+    return results
+
+
+if __name__ == "__main__":
+    checks = run_checks()
+    output = {
+        "checks": {name: "PASS" if ok else "FAIL" for name, ok in checks.items()},
+        "result": "PASS" if all(checks.values()) else "FAIL",
+    }
+    print(json.dumps(output, indent=2))
+    sys.exit(0 if output["result"] == "PASS" else 1)
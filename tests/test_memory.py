@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+#
+# test_memory.py
+#
+# Checks of the memory budget (server.memory): the default limit follows the
+# cgroup or physical memory, caches are shrunk cheapest and stalest first
+# until the total is back under the low-water mark, fixed allocations count
+# but are never evicted, dropped caches are forgotten, the DID cache is
+# shrinkable, and per-cache usage shows up in the metrics snapshot. Prints
+# per-cache usage after a stream of posts fills the caches under a small
+# budget.
+#
+# $ python3 -m tests.test_memory --posts 50000 --budget-kb 4096
+#
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("HOSTNAME", "localhost")
+os.environ.setdefault("FEED_URI", "at://did:plc:test/app.bsky.feed.generator/test")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.gettempdir()}/test_memory.db")
+
+from server import memory, metrics
+from server.auth import _BudgetedDidCache
+from server.dedup import DedupIndex, Fingerprint
+from server.memory import MemoryBudget
+from server.threads import ThreadDecisions
+
+
+def uri(i: int) -> str:
+    return f"at://did:plc:memory{i % 997}/app.bsky.feed.post/{i:013d}"
+
+
+def fill(budget: MemoryBudget, dedup: DedupIndex, decisions: ThreadDecisions, posts: int) -> int:
+    """Stream posts into both caches, enforcing every thousand; returns the peak usage seen."""
+    peak = 0
+    for i in range(posts):
+        dedup.add(Fingerprint(i.to_bytes(16, "big"), i), "HIDE", uri(i))
+        decisions.record(uri(i), ("HIDE",))
+        if i % 1000 == 999:
+            budget.enforce()
+            peak = max(peak, budget.stats()["used_bytes"])
+    return peak
+
+
+def run_checks(posts: int, budget_kb: int) -> dict:
+    results = {}
+
+    limit = memory.memory_limit()
+    results["limit_detected"] = limit is not None and limit > 0
+    results["default_is_fraction"] = memory.default_limit() in (0, int(limit * memory.config.MEMORY_BUDGET_FRACTION))
+
+    # A stream of posts under a small budget
+    budget = MemoryBudget(limit=budget_kb * 1024, low_water=0.9, interval=0)
+    dedup = DedupIndex(window=3600, max_entries=10000, max_distance=3)
+    decisions = ThreadDecisions(window=3600, max_entries=posts, policy="hide")
+    budget.register("dedup", dedup, cost=1.0)
+    budget.register("threads", decisions, cost=2.0)
+    budget.register_fixed("model", 256 * 1024)
+    peak = fill(budget, dedup, decisions, posts)
+    stats = budget.stats()
+    results["stays_under_budget"] = peak <= budget.limit
+    results["fixed_counted"] = stats["fixed"] == {"model": 256 * 1024}
+    results["every_cache_reported"] = set(stats["caches"]) == {"dedup", "threads"}
+    print(f"{posts} posts under a {budget_kb} KB budget: peak {peak >> 10} KB, "
+          f"{len(dedup)} fingerprints and {len(decisions)} thread entries kept", file=sys.stderr)
+    for name, usage in stats["caches"].items():
+        print(f"  {name}: {usage['bytes'] >> 10} KB, {usage['evicted_bytes'] >> 10} KB evicted "
+              f"in {usage['shrinks']} shrinks", file=sys.stderr)
+
+    # Just over the budget: only the cheaper, staler cache gives anything up
+    budget = MemoryBudget(limit=10 ** 9, low_water=0.9, interval=0)
+    cheap = ThreadDecisions(window=3600, max_entries=10 ** 6, policy="hide")
+    dear = ThreadDecisions(window=3600, max_entries=10 ** 6, policy="hide")
+    for i in range(2000):
+        cheap.record(uri(i), ("HIDE",))
+    time.sleep(0.05)
+    for i in range(2000):
+        dear.record(uri(i), ("HIDE",))
+    budget.register("cheap", cheap, cost=1.0)
+    budget.register("dear", dear, cost=1.0)
+    budget.limit = int((cheap.memory_bytes() + dear.memory_bytes()) / 1.05)
+    freed = budget.enforce()
+    results["stalest_evicted_first"] = len(dear) == 2000 and len(cheap) < 2000 and freed > 0
+    results["oldest_entries_go"] = uri(0) not in cheap._entries and uri(1999) in cheap._entries
+    results["under_low_water"] = budget.stats()["used_bytes"] <= budget.limit * 0.9
+
+    budget.limit = 10 ** 9
+    results["nothing_evicted_under_budget"] = budget.enforce() == 0
+
+    # A cache nobody holds any more is forgotten
+    del cheap
+    results["dead_caches_dropped"] = set(budget.stats()["caches"]) == {"dear"}
+
+    # The DID cache keeps its most recently used documents
+    dids = _BudgetedDidCache()
+    for i in range(10):
+        dids.set(f"did:plc:{i}", object())
+    dids.get("did:plc:0")
+    freed = dids.shrink(dids.memory_bytes() // 2)
+    results["did_cache_shrinks_lru"] = (freed > 0 and dids.get("did:plc:0") is not None
+                                        and dids.get("did:plc:1") is None and dids.get("did:plc:9") is not None)
+
+    results["usage_in_metrics"] = "caches" in metrics.snapshot()["memory"]
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Checks of the memory budget shared by the caches.")
+    parser.add_argument("--posts", type=int, default=50000, help="Posts streamed into the caches (default: 50000)")
+    parser.add_argument("--budget-kb", type=int, default=4096, help="Budget for the stream (default: 4096)")
+    args = parser.parse_args()
+    checks = run_checks(args.posts, args.budget_kb)
+    output = {
+        "checks": {name: "PASS" if ok else "FAIL" for name, ok in checks.items()},
+        "result": "PASS" if all(checks.values()) else "FAIL",
+    }
+    print(json.dumps(output, indent=2))
+    sys.exit(0 if output["result"] == "PASS" else 1)
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+#
+# test_multi_feed.py
+#
+# Checks of several feeds served from one ingest pass (server.algos.definitions)
+# against a scratch SQLite database: every feed gets the same posts as
+# scoring it on its own with its lists and settings would give, the batch is
+# embedded once whatever the number of feeds, each feed's handler serves only
+# its own posts, and editing one feed's lists re-scores only that feed.
+# Then times score_posts for 1 to --max-feeds feeds.
+#
+# $ python3 -m tests.test_multi_feed --posts 1000 --max-feeds 8
+#
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+os.environ.setdefault("HOSTNAME", "localhost")
+os.environ.setdefault("FEED_URI", "at://did:plc:test/app.bsky.feed.generator/test")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.gettempdir()}/test_multi_feed.db")
+os.environ["DEDUP_ENABLED"] = "false"
+
+from atproto import models
+
+from server import data_filter, embedding_inputs, feed_window
+from server.algos import definitions
+from server.algos.definitions import FeedDefinition
+from server.algos.feed import make_handler
+from server.database import Post, UserLists, backend
+from server.post_record import PostRecord
+from server.user_lists import get_user_lists
+from server.vector import DECISIONS, keyword_hits, score_batch, string_to_vector, vector_to_blob
+
+TOPICS = [
+    "repotting tomato seedlings and turning the compost heap in the garden",
+    "the election debate last night and what the senate vote means for policy",
+    "a long train ride through the river valley with coffee and a good book",
+    "new telescope photos of the moon and the planets from the back yard",
+]
+LISTS = {
+    "did:plc:garden": ("garden compost tomato seedling", "election senate vote policy"),
+    "did:plc:politics": ("election senate vote policy", "garden compost tomato"),
+    "did:plc:sky": ("telescope moon planet photo", "election senate"),
+}
+
+
+def post(i: int) -> PostRecord:
+    text = f"Post {i} about {TOPICS[i % len(TOPICS)]}, note {i * 7919 % 1000}"
+    return PostRecord(f"at://did:plc:multi{i % 97}/app.bsky.feed.post/{i:013d}", f"cid{i}",
+                      f"did:plc:multi{i % 97}", text=text, indexed_at=datetime.now(timezone.utc))
+
+
+def ops(created=()) -> defaultdict:
+    result = defaultdict(lambda: {'created': [], 'deleted': []})
+    result[models.ids.AppBskyFeedPost]['created'] = list(created)
+    return result
+
+
+def save_lists(did: str, white: str, black: str) -> None:
+    white_vec, black_vec = string_to_vector(white), string_to_vector(black)
+    with backend.write() as conn:
+        UserLists.delete().where(UserLists.did == did).execute(conn)
+        UserLists.insert(did=did, white_list_text=white, black_list_text=black,
+                         white_list_vector=vector_to_blob(white_vec), white_list_dim=len(white_vec),
+                         black_list_vector=vector_to_blob(black_vec), black_list_dim=len(black_vec),
+                         vectors_normalized=True, modified_at=datetime.now(timezone.utc)).execute(conn)
+
+
+def register(feeds: list) -> None:
+    # The registry is imported by name, so it is changed in place
+    definitions.feeds[:] = feeds
+    feed_window.window = feed_window.WindowStore(window=3600, max_entries=10000, definitions=feeds)
+
+
+def feed(name: str) -> set:
+    return {row.uri for row in Post.select(Post.uri).where(Post.feed == name)}
+
+
+def expected(definition: FeedDefinition, posts: list) -> set:
+    """The posts the feed shows when scored on its own, as a single-feed server would."""
+    lists = get_user_lists(definition.lists_did)
+    texts = [p.text for p in posts]
+    cleaned = data_filter.clean_texts(texts)
+    hits = [keyword_hits(text, keyword_matcher=lists.matcher) for text in cleaned]
+    vectors = data_filter.embed_posts([{"post": text} for text in cleaned])
+    codes = score_batch(vectors, lists.matrix, [bool(h["white"]) for h in hits], [bool(h["black"]) for h in hits],
+                        **definition.settings())["decision"]
+    return {p.uri for p, code in zip(posts, codes) if definition.shows(DECISIONS[code])}
+
+
+def run_checks(count: int) -> dict:
+    results = {}
+    encodes = [0]
+    encode = embedding_inputs.strings_to_vectors
+
+    def counted(strings, *args, **kwargs):
+        encodes[0] += 1
+        return encode(strings, *args, **kwargs)
+
+    embedding_inputs.strings_to_vectors = counted
+    for did, (white, black) in LISTS.items():
+        save_lists(did, white, black)
+    feeds = [
+        FeedDefinition("at://did:plc:test/app.bsky.feed.generator/garden", "did:plc:garden",
+                       temperature=0.05, ambiguous_policy="HIDE"),
+        FeedDefinition("at://did:plc:test/app.bsky.feed.generator/politics", "did:plc:politics",
+                       show_thresh=0.6, temperature=0.1, ambiguous_policy="HIDE"),
+        FeedDefinition("at://did:plc:test/app.bsky.feed.generator/sky", "did:plc:sky",
+                       temperature=0.05, bias_weight=0.2, ambiguous_policy="SHOW"),
+    ]
+    register(feeds)
+    with backend.write() as conn:
+        Post.delete().execute(conn)
+
+    posts = [post(i) for i in range(count)]
+    batches = range(0, count, 64)
+    encodes[0] = 0
+    for start in batches:
+        data_filter.operations_callback(ops(posts[start:start + 64]))
+    results["one_encode_per_batch"] = encodes[0] == len(batches)
+    results["feeds_match_scoring_alone"] = all(feed(d.name) == expected(d, posts) for d in feeds)
+    results["feeds_differ"] = len({frozenset(feed(d.name)) for d in feeds}) == len(feeds)
+    served = [{item['post'] for item in make_handler(d.name)(None, count)['feed']} for d in feeds]
+    results["handlers_serve_own_feed"] = all(uris == feed(d.name) for uris, d in zip(served, feeds))
+
+    before = {d.name: feed(d.name) for d in feeds}
+    time.sleep(0.01)
+    save_lists("did:plc:garden", "election senate vote policy", "garden compost tomato seedling")
+    encodes[0] = 0
+    data_filter.operations_callback(ops())
+    after = {d.name: feed(d.name) for d in feeds}
+    results["edit_rescores_without_encoding"] = encodes[0] == 0
+    results["edit_rescores_only_its_feed"] = (after["garden"] != before["garden"]
+                                              and after["garden"] == expected(feeds[0], posts)
+                                              and after["politics"] == before["politics"]
+                                              and after["sky"] == before["sky"])
+    return results
+
+
+def bench(count: int, max_feeds: int) -> list:
+    """score_posts time for 1..max_feeds feeds over the same posts."""
+    posts = [post(i) for i in range(count)]
+    dids = list(LISTS)
+    rows = []
+    n_feeds = 1
+    while n_feeds <= max_feeds:
+        feeds = [FeedDefinition(f"at://did:plc:test/app.bsky.feed.generator/bench{i}", dids[i % len(dids)],
+                                temperature=0.05 + 0.01 * i) for i in range(n_feeds)]
+        feed_lists = [get_user_lists(d.lists_did) for d in feeds]
+        timings = []
+        for _ in range(5):
+            started = time.perf_counter()
+            for start in range(0, count, 64):
+                data_filter.score_posts(posts[start:start + 64], 0, feed_lists, feeds)
+            timings.append(time.perf_counter() - started)
+        rows.append({"feeds": n_feeds, "ms_per_1k_posts": round(min(timings) / count * 1e6, 1)})
+        n_feeds *= 2
+    base = rows[0]["ms_per_1k_posts"]
+    for row in rows:
+        row["extra_ms_per_feed"] = round((row["ms_per_1k_posts"] - base) / max(row["feeds"] - 1, 1), 1)
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Checks and timing of several feeds from one ingest pass.")
+    parser.add_argument("--posts", type=int, default=1000, help="Posts classified (default: 1000)")
+    parser.add_argument("--max-feeds", type=int, default=8, help="Largest number of feeds timed (default: 8)")
+    args = parser.parse_args()
+    checks = run_checks(args.posts)
+    for row in bench(args.posts, args.max_feeds):
+        print(f"{row['feeds']} feeds: {row['ms_per_1k_posts']} ms per 1k posts, "
+              f"{row['extra_ms_per_feed']} ms per extra feed", file=sys.stderr)
+    output = {
+        "checks": {name: "PASS" if ok else "FAIL" for name, ok in checks.items()},
+        "result": "PASS" if all(checks.values()) else "FAIL",
+    }
+    print(json.dumps(output, indent=2))
+    sys.exit(0 if output["result"] == "PASS" else 1)
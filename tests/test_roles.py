@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+#
+# test_roles.py
+#
+# Import cost of each process role (python -m server serve|ingest), measured
+# in a fresh interpreter per role: the time to import the role's modules,
+# peak RSS afterwards, and which heavy modules got loaded. The serve role
+# must not load torch, spaCy, sentence-transformers, the firehose client or
+# the classifier, and must import faster than the ingest role. With
+# DB_MIGRATE=false, as in the serve role, an unmigrated database is refused,
+# and the ingest role publishes /health/ and /metrics/ on a listener of its own.
+#
+# $ python3 -m tests.test_roles --repeat 3
+#
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ROLE_MODULES = {
+    "serve": ["server.app"],
+    "ingest": ["server.ingest"],
+}
+HEAVY = ["torch", "spacy", "sentence_transformers", "transformers", "atproto_firehose", "atproto_client",
+         "server.data_stream", "server.data_filter", "server.text_utils", "server.vector"]
+
+PROBE = """
+import json, resource, sys, time
+started = time.perf_counter()
+for name in {modules!r}:
+    __import__(name)
+seconds = time.perf_counter() - started
+print(json.dumps({{
+    "seconds": seconds,
+    "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "heavy": [name for name in {heavy!r} if name in sys.modules],
+}}))
+"""
+
+
+def measure(role: str, repeat: int) -> dict:
+    env = dict(os.environ)
+    env.setdefault("HOSTNAME", "localhost")
+    env.setdefault("FEED_URI", "at://did:plc:test/app.bsky.feed.generator/test")
+    env.setdefault("DATABASE_URL", f"sqlite:///{tempfile.gettempdir()}/test_roles.db")
+    env["PYTHONWARNINGS"] = "ignore"
+    runs = []
+    for _ in range(repeat):
+        done = subprocess.run([sys.executable, "-c", PROBE.format(modules=ROLE_MODULES[role], heavy=HEAVY)],
+                              capture_output=True, text=True, env=env,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        if done.returncode != 0:
+            return {"role": role, "error": done.stderr.strip().splitlines()[-1]}
+        runs.append(json.loads(done.stdout.strip().splitlines()[-1]))
+    return {
+        "role": role,
+        "import_seconds": round(min(run["seconds"] for run in runs), 3),
+        "rss_mb": round(min(run["rss_mb"] for run in runs), 1),
+        "heavy_modules": runs[0]["heavy"],
+    }
+
+
+def refuses_unmigrated() -> bool:
+    """Serve-side imports against an empty database without migrating fail on the schema check."""
+    path = os.path.join(tempfile.mkdtemp(), "unmigrated.db")
+    env = dict(os.environ, HOSTNAME="localhost", DB_MIGRATE="false", DATABASE_URL=f"sqlite:///{path}",
+               FEED_URI=os.environ.get("FEED_URI", "at://did:plc:test/app.bsky.feed.generator/test"))
+    done = subprocess.run([sys.executable, "-c", "import server.app"], capture_output=True, text=True, env=env,
+                          cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return done.returncode != 0 and "schema is at v0" in done.stderr
+
+
+METRICS_PROBE = """
+import json, urllib.request
+from server import ingest
+server = ingest.start_metrics_server("127.0.0.1", 0)
+with urllib.request.urlopen(f"http://127.0.0.1:{server.effective_port}/metrics/") as response:
+    print(json.dumps(sorted(json.load(response))))
+"""
+
+
+def ingest_metrics() -> list:
+    """The sections of the ingest role's /metrics/ snapshot, or None when the role cannot be imported."""
+    env = dict(os.environ, PYTHONWARNINGS="ignore")
+    env.setdefault("HOSTNAME", "localhost")
+    env.setdefault("FEED_URI", "at://did:plc:test/app.bsky.feed.generator/test")
+    env.setdefault("DATABASE_URL", f"sqlite:///{tempfile.gettempdir()}/test_roles.db")
+    done = subprocess.run([sys.executable, "-c", METRICS_PROBE], capture_output=True, text=True, env=env,
+                          cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return json.loads(done.stdout.strip().splitlines()[-1]) if done.returncode == 0 else None
+
+
+def run_checks(repeat: int) -> dict:
+    serve, ingest = measure("serve", repeat), measure("ingest", repeat)
+    for result in (serve, ingest):
+        print(json.dumps(result), file=sys.stderr)
+    results = {
+        "serve_imports": "error" not in serve,
+        "serve_skips_heavy_modules": not serve.get("heavy_modules", ["?"]),
+        "serve_refuses_unmigrated_schema": refuses_unmigrated(),
+    }
+    # The ingest role needs the whole classifier stack, which may not be installed everywhere
+    if "error" not in ingest:
+        results["serve_imports_faster"] = serve["import_seconds"] < ingest["import_seconds"]
+        results["serve_uses_less_memory"] = serve["rss_mb"] < ingest["rss_mb"]
+        sections = ingest_metrics()
+        results["ingest_publishes_metrics"] = sections is not None and "threads" in sections and "deletes" in sections
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import time and memory of the serve and ingest roles.")
+    parser.add_argument("--repeat", type=int, default=3, help="Fresh interpreters per role; the best is kept (default: 3)")
+    args = parser.parse_args()
+    checks = run_checks(args.repeat)
+    output = {
+        "checks": {name: "PASS" if ok else "FAIL" for name, ok in checks.items()},
+        "result": "PASS" if all(checks.values()) else "FAIL",
+    }
+    print(json.dumps(output, indent=2))
+    sys.exit(0 if output["result"] == "PASS" else 1)
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+#
+# test_threads.py
+#
+# Checks of thread decisions (server.threads) against a scratch SQLite
+# database: replies to a hidden post are hidden without being embedded,
+# replies to a shown post are scored as usual under the default policy,
+# entries expire and stay bounded, and a collapsing handler serves each
+# thread once. Prints the share of replies that skipped the model for a
+# stream of threads.
+#
+# $ python3 -m tests.test_threads --threads 200
+#
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+os.environ.setdefault("HOSTNAME", "localhost")
+os.environ.setdefault("FEED_URI", "at://did:plc:test/app.bsky.feed.generator/test")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.gettempdir()}/test_threads.db")
+os.environ.setdefault("DEFAULT_DID", "did:plc:threads")
+os.environ.setdefault("AMBIGUOUS_POST_POLICY", "HIDE")
+os.environ.setdefault("SOFTMAX_TEMPERATURE", "0.05")
+os.environ["DEDUP_ENABLED"] = "false"
+os.environ["THREAD_INHERIT"] = "hide"
+
+from atproto import models
+
+from server import config, data_filter, embedding_inputs, threads
+from server.algos.feed import make_handler
+from server.database import Post, UserLists, backend, insert_posts
+from server.post_record import PostRecord
+from server.vector import string_to_vector, vector_to_blob
+
+GARDEN = "repotting tomato seedlings and turning the compost heap in the garden"
+POLITICS = "the election debate last night and what the senate vote means for policy"
+
+
+def post(i: int, text: str, parent: PostRecord = None, root: PostRecord = None) -> PostRecord:
+    return PostRecord(f"at://did:plc:thread{i % 97}/app.bsky.feed.post/{i:013d}", f"cid{i}",
+                      f"did:plc:thread{i % 97}", text=f"Post {i}: {text}",
+                      reply_parent=parent.uri if parent else None,
+                      reply_root=(root or parent).uri if parent else None,
+                      indexed_at=datetime.now(timezone.utc) + timedelta(milliseconds=i))
+
+
+def ops(created=()) -> defaultdict:
+    result = defaultdict(lambda: {'created': [], 'deleted': []})
+    result[models.ids.AppBskyFeedPost]['created'] = list(created)
+    return result
+
+
+def save_lists(white: str, black: str) -> None:
+    white_vec, black_vec = string_to_vector(white), string_to_vector(black)
+    with backend.write() as conn:
+        UserLists.delete().where(UserLists.did == config.DEFAULT_DID).execute(conn)
+        UserLists.insert(did=config.DEFAULT_DID, white_list_text=white, black_list_text=black,
+                         white_list_vector=vector_to_blob(white_vec), white_list_dim=len(white_vec),
+                         black_list_vector=vector_to_blob(black_vec), black_list_dim=len(black_vec),
+                         vectors_normalized=True, modified_at=datetime.now(timezone.utc)).execute(conn)
+
+
+def feed() -> set:
+    return {row.uri for row in Post.select(Post.uri)}
+
+
+def run_checks(count: int) -> dict:
+    results = {}
+    encoded = []
+    encode = embedding_inputs.strings_to_vectors
+
+    def counted(strings, *args, **kwargs):
+        encoded.append(len(strings))
+        return encode(strings, *args, **kwargs)
+
+    embedding_inputs.strings_to_vectors = counted
+    with backend.write() as conn:
+        Post.delete().execute(conn)
+    save_lists("garden compost tomato seedling", "election senate vote policy")
+    threads.index = threads.ThreadDecisions(window=3600, max_entries=count * 10, policy="hide")
+
+    # Each thread: a root, then replies on the root's topic from other batches
+    roots = [post(i, POLITICS if i % 2 else GARDEN) for i in range(count)]
+    data_filter.operations_callback(ops(roots))
+    replies = [post(count + i, GARDEN, parent=root) for i, root in enumerate(roots)]
+    encoded.clear()
+    data_filter.operations_callback(ops(replies))
+    hidden_replies = {reply.uri for reply, root in zip(replies, roots) if root.uri not in feed()}
+    results["replies_to_hidden_hidden"] = len(hidden_replies) == count // 2 and not hidden_replies & feed()
+    results["replies_to_shown_scored"] = sum(encoded) == count - count // 2
+    results["replies_to_shown_kept"] = {r.uri for r in replies} - hidden_replies <= feed()
+
+    # A decision carries down the thread through replies that inherited it
+    nested = [post(3 * count + i, GARDEN, parent=reply, root=root)
+              for i, (reply, root) in enumerate(zip(replies, roots)) if reply.uri in hidden_replies]
+    encoded.clear()
+    data_filter.operations_callback(ops(nested))
+    results["nested_replies_inherit"] = not encoded and not {p.uri for p in nested} & feed()
+    stats = threads.index.stats()
+    results["skips_counted"] = stats["replies_skipped"] == len(hidden_replies) + len(nested)
+    print(f"{stats['replies_checked']} replies, {stats['replies_skipped']} skipped the model "
+          f"(skip rate {stats['skip_rate']:.2%})", file=sys.stderr)
+
+    # Edited lists void every remembered decision
+    time.sleep(0.01)
+    save_lists("garden compost tomato seedling", "telescope moon")
+    late = post(5 * count, GARDEN, parent=roots[1])
+    encoded.clear()
+    data_filter.operations_callback(ops([late]))
+    results["lists_edit_clears"] = len(encoded) == 1
+
+    expiring = threads.ThreadDecisions(window=0.05, max_entries=10, policy="hide")
+    hidden = post(0, POLITICS)
+    expiring.record(hidden.uri, ("HIDE",))
+    inherited_now = expiring.inherit(post(1, GARDEN, parent=hidden), [True])
+    time.sleep(0.1)
+    results["entries_expire"] = inherited_now == ("HIDE",) and expiring.inherit(post(2, GARDEN, parent=hidden), [True]) is None
+    for i in range(100):
+        expiring.record(f"at://bounded/{i}", ("HIDE",))
+    results["entries_bounded"] = len(expiring) == 10
+    expiring.record(hidden.uri, ("SHOW",))
+    results["shown_not_inherited_by_default"] = expiring.inherit(post(3, GARDEN, parent=hidden), [True]) is None
+    showing = threads.ThreadDecisions(window=3600, max_entries=10, policy="show")
+    showing.record(hidden.uri, ("SHOW",))
+    results["show_policy"] = showing.inherit(post(4, GARDEN, parent=hidden), [True]) == ("SHOW",)
+
+    # Collapsing: one entry per thread, the root when it is in the feed, else the newest reply
+    with backend.write() as conn:
+        Post.delete().execute(conn)
+    root, orphan_root = post(10000, GARDEN), post(10001, POLITICS)
+    thread = [post(10002 + i, GARDEN, parent=root) for i in range(3)]
+    orphan = [post(10010 + i, GARDEN, parent=orphan_root) for i in range(3)]
+    loose = post(10020, GARDEN)
+    insert_posts([p.row() for p in [root, loose] + thread + orphan])
+    served = [item['post'] for item in make_handler(config.FEED_NAME, collapse_threads=True)(None, 50)['feed']]
+    results["collapse_one_per_thread"] = sorted(served) == sorted([root.uri, loose.uri, orphan[-1].uri])
+    results["no_collapse_by_default"] = len(make_handler(config.FEED_NAME)(None, 50)['feed']) == 8
+    first = make_handler(config.FEED_NAME, collapse_threads=True)(None, 4)
+    rest = make_handler(config.FEED_NAME, collapse_threads=True)(first['cursor'], 50)
+    paged = [item['post'] for item in first['feed'] + rest['feed']]
+    results["collapse_pages"] = sorted(paged) == sorted(served)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Checks of thread decision inheritance and collapsing.")
+    parser.add_argument("--threads", type=int, default=200, help="Threads classified (default: 200)")
+    args = parser.parse_args()
+    checks = run_checks(args.threads)
+    output = {
+        "checks": {name: "PASS" if ok else "FAIL" for name, ok in checks.items()},
+        "result": "PASS" if all(checks.values()) else "FAIL",
+    }
+    print(json.dumps(output, indent=2))
+    sys.exit(0 if output["result"] == "PASS" else 1)